@@ -0,0 +1,102 @@
+# acuerdo.py
+import numpy as np
+
+# =====================================================
+# Acuerdo entre particiones (ARI y NMI)
+# =====================================================
+#
+# Compara los cortes con el mismo K de varios métodos de linkage (y, si se
+# eligen, de varias matrices sobre las mismas muestras). La tabla de
+# contingencia de cada par de particiones es un np.bincount del código
+# combinado a * kb + b; de ella salen el índice de Rand ajustado y la
+# información mutua normalizada (media aritmética de las entropías, como el
+# valor por defecto de sklearn).
+
+
+def _codigos(etiquetas):
+    _, codigos = np.unique(np.asarray(etiquetas), return_inverse=True)
+    return codigos.astype(np.int64)
+
+
+def contingencia(a, b):
+    """Tabla (clusters de a, clusters de b) de dos particiones."""
+    a = _codigos(a)
+    b = _codigos(b)
+    ka, kb = a.max() + 1, b.max() + 1
+    return np.bincount(a * kb + b, minlength=ka * kb).reshape(ka, kb)
+
+
+def _pares(x):
+    x = np.asarray(x, dtype=np.float64)
+    return (x * (x - 1) / 2).sum()
+
+
+def ari(tabla):
+    n = tabla.sum()
+    suma = _pares(tabla)
+    filas = _pares(tabla.sum(axis=1))
+    columnas = _pares(tabla.sum(axis=0))
+    esperado = filas * columnas / (n * (n - 1) / 2)
+    maximo = (filas + columnas) / 2
+    if maximo == esperado:
+        return 1.0
+    return float((suma - esperado) / (maximo - esperado))
+
+
+def nmi(tabla):
+    n = tabla.sum()
+    p = tabla / n
+    pa = p.sum(axis=1)
+    pb = p.sum(axis=0)
+    con_valor = p > 0
+    mi = (p[con_valor] * np.log(p[con_valor] / np.outer(pa, pb)[con_valor])).sum()
+    ha = -(pa[pa > 0] * np.log(pa[pa > 0])).sum()
+    hb = -(pb[pb > 0] * np.log(pb[pb > 0])).sum()
+    if ha == 0 and hb == 0:
+        return 1.0
+    return float(mi / ((ha + hb) / 2)) if ha + hb > 0 else 0.0
+
+
+def matrices_acuerdo(particiones):
+    """
+    {nombre: etiquetas} (mismas muestras, mismo orden) -> (ARI, NMI) como
+    DataFrames nombre × nombre.
+    """
+    import pandas as pd
+
+    nombres = list(particiones)
+    m = len(nombres)
+    A = np.eye(m)
+    N = np.eye(m)
+    for i in range(m):
+        for j in range(i + 1, m):
+            tabla = contingencia(particiones[nombres[i]], particiones[nombres[j]])
+            A[i, j] = A[j, i] = ari(tabla)
+            N[i, j] = N[j, i] = nmi(tabla)
+    return (pd.DataFrame(A, index=nombres, columns=nombres),
+            pd.DataFrame(N, index=nombres, columns=nombres))
+
+
+def asignaciones_por_metodo(gestor, grupo, matrices, metodos, al_progresar=None):
+    """
+    matrices: {nombre: (DataFrame alineado, huella de la matriz completa)}.
+    Un trabajo del gestor por (matriz, método), todos a la vez; los linkages
+    ya guardados en la caché de disco se leen de ahí. Devuelve
+    {(nombre, método): asignaciones (n, K_MAX - K_MIN + 1)}.
+    """
+    import cache_disco
+    import trabajos
+
+    pendientes = {
+        (nombre, metodo): gestor.enviar((*grupo, nombre, metodo),
+                                        (huella, cache_disco.huella_muestras(df.index), metodo),
+                                        trabajos.tarea_asignaciones, df, metodo, huella=huella)
+        for nombre, (df, huella) in matrices.items()
+        for metodo in metodos
+    }
+    gestor.esperar_todos(list(pendientes.values()), al_progresar=al_progresar, unidad="linkages")
+    fallidos = [f"{n} · {m}: {t.error or 'cancelado'}" for (n, m), t in pendientes.items()
+                if t.estado != "terminado"]
+    if fallidos:
+        raise RuntimeError(fallidos[0])
+    return {k: t.resultado for k, t in pendientes.items()}
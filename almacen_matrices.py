@@ -0,0 +1,148 @@
+# almacen_matrices.py
+import os
+import json
+import numpy as np
+
+# =====================================================
+# Almacén binario de matrices de distancia
+# =====================================================
+#
+# Una matriz se guarda como una carpeta "<nombre>.matriz" con:
+#   meta.json       n, dtype, orden y parámetros con los que se calculó
+#   muestras.txt    una etiqueta por línea (nombres de archivo, como en los CSV)
+#   distancias.bin  triángulo inferior por filas, sin cabecera:
+#                   d(1,0), d(2,0), d(2,1), d(3,0), ... d(n-1,n-2)
+#
+# Con ese orden, añadir la muestra n solo añade d(n,0..n-1) al final del
+# archivo: lo ya calculado no se reescribe nunca.
+
+EXTENSION = ".matriz"
+ORDEN = "triangular-inferior"
+
+
+def es_almacen(ruta):
+    return os.path.isdir(ruta) and os.path.exists(os.path.join(ruta, "meta.json"))
+
+
+def n_pares(n):
+    return n * (n - 1) // 2
+
+
+def indice(i, j):
+    """Posición de d(i, j) en distancias.bin (acepta arrays; i != j)."""
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    fila = np.maximum(i, j)
+    col = np.minimum(i, j)
+    return fila * (fila - 1) // 2 + col
+
+# =====================================================
+# Metadatos
+# =====================================================
+
+def leer_meta(ruta):
+    with open(os.path.join(ruta, "meta.json")) as f:
+        return json.load(f)
+
+
+def escribir_meta(ruta, meta):
+    # Escritura atómica: un lector nunca ve un meta.json a medias
+    tmp = os.path.join(ruta, ".meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(ruta, "meta.json"))
+
+
+def leer_muestras(ruta):
+    with open(os.path.join(ruta, "muestras.txt")) as f:
+        return [linea.rstrip("\n") for linea in f if linea.strip()]
+
+# =====================================================
+# Creación y acceso
+# =====================================================
+
+def crear(ruta, muestras, dtype="float64", **parametros):
+    """
+    Crea el almacén con el archivo de distancias reservado (relleno de ceros).
+    parametros se guardan en meta.json para saber cómo se calculó.
+    """
+    os.makedirs(ruta, exist_ok=True)
+    n = len(muestras)
+    with open(os.path.join(ruta, "muestras.txt"), "w") as f:
+        f.write("".join(f"{m}\n" for m in muestras))
+    with open(os.path.join(ruta, "distancias.bin"), "wb") as f:
+        f.truncate(n_pares(n) * np.dtype(dtype).itemsize)
+    meta = {"n": n, "dtype": np.dtype(dtype).name, "orden": ORDEN, "completa": False}
+    meta.update(parametros)
+    escribir_meta(ruta, meta)
+    return meta
+
+
+def abrir(ruta, modo="r"):
+    """
+    Devuelve (meta, muestras, distancias) con distancias como np.memmap 1-D.
+    modo "r+" para escribir en sitio (varios procesos pueden escribir a la
+    vez posiciones distintas).
+    """
+    meta = leer_meta(ruta)
+    muestras = leer_muestras(ruta)[:meta["n"]]
+    n = meta["n"]
+    if n < 2:
+        return meta, muestras, np.zeros(0, dtype=meta["dtype"])
+    distancias = np.memmap(os.path.join(ruta, "distancias.bin"), dtype=meta["dtype"],
+                           mode=modo, shape=(n_pares(n),))
+    return meta, muestras, distancias
+
+
+def leer_filas(distancias, n, filas):
+    """
+    Filas completas (len(filas), n) de la matriz cuadrada, leídas del
+    triángulo inferior sin construir la matriz entera.
+    """
+    filas = np.asarray(filas, dtype=np.int64)
+    cols = np.arange(n, dtype=np.int64)
+    ii, jj = np.meshgrid(filas, cols, indexing="ij")
+    diagonal = ii == jj
+    bloque = np.asarray(distancias[indice(ii[~diagonal], jj[~diagonal])], dtype=np.float64)
+    resultado = np.zeros(ii.shape, dtype=np.float64)
+    resultado[~diagonal] = bloque
+    return resultado
+
+
+def leer_submatriz(distancias, filas):
+    """
+    Matriz cuadrada (len(filas), len(filas)) de las muestras 'filas', leyendo
+    del triángulo inferior solo los pares entre ellas.
+    """
+    filas = np.asarray(filas, dtype=np.int64)
+    m = len(filas)
+    D = np.zeros((m, m), dtype=np.float64)
+    # Fila a fila: los índices de todos los pares a la vez ocuparían más que D
+    for r in range(1, m):
+        D[r, :r] = distancias[indice(filas[r], filas[:r])]
+        D[:r, r] = D[r, :r]
+    return D
+
+
+def a_dataframe(ruta):
+    """Matriz cuadrada como DataFrame, con el mismo formato que los CSV de data/matrices."""
+    import pandas as pd
+
+    meta, muestras, distancias = abrir(ruta)
+    n = meta["n"]
+    D = np.zeros((n, n), dtype=np.float64)
+    # tril_indices recorre el triángulo inferior por filas: el mismo orden del archivo
+    D[np.tril_indices(n, -1)] = distancias
+    D += D.T
+    return pd.DataFrame(D, index=muestras, columns=muestras)
+
+
+def guardar_dataframe(ruta, matrix_df, dtype="float64", **parametros):
+    """Guarda una matriz cuadrada (DataFrame) como almacén."""
+    muestras = [str(m) for m in matrix_df.index]
+    crear(ruta, muestras, dtype=dtype, **parametros)
+    meta, _, distancias = abrir(ruta, "r+")
+    distancias[:] = matrix_df.values[np.tril_indices(len(muestras), -1)]
+    distancias.flush()
+    meta["completa"] = True
+    escribir_meta(ruta, meta)
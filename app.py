@@ -1,9 +1,12 @@
 # app.py
 import streamlit as st
-import pandas as pd
 import os
-import io
 import importlib
+import time
+import uuid
+import trabajos
+import datos
+import precalentamiento
 
 st.set_page_config(layout="wide")
 st.title("🔬 Explorador interactivo de Clustermaps TDA")
@@ -54,28 +57,83 @@ else:
 # Rutas base
 # ============================================================
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, "data")
-PRELOADED_MATRIX_DIR = os.path.join(DATA_DIR, "matrices")
-PRELOADED_METADATA_DIR = os.path.join(DATA_DIR, "anotaciones")
+PRELOADED_MATRIX_DIR = datos.PRELOADED_MATRIX_DIR
+PRELOADED_METADATA_DIR = datos.PRELOADED_METADATA_DIR
 
-modo = st.radio("Selecciona la fuente de datos:", ["Usar archivos precargados", "Subir archivos manualmente"])
+# ============================================================
+# Precálculo opcional de las matrices precargadas
+# ============================================================
+
+@st.cache_resource
+def iniciar_precalentamiento():
+    # Una vez por servidor; los procesos trabajan en segundo plano y llenan
+    # la caché de disco sin bloquear la carga de la página
+    return precalentamiento.iniciar()
+
+if os.environ.get("CLUSTERMAP_PRECALENTAR") == "1":
+    iniciar_precalentamiento()
+
+TIEMPOS = os.environ.get("CLUSTERMAP_TIEMPOS") == "1"
+
+inicio_run = time.perf_counter()
+
+def registrar_tiempo(nombre, inicio):
+    # Latencia de cada rerun (script completo o fragmento), para comparar controles
+    st.session_state.setdefault("tiempos", {})[nombre] = time.perf_counter() - inicio
+
+if "sesion_id" not in st.session_state:
+    st.session_state["sesion_id"] = uuid.uuid4().hex
+sesion_id = st.session_state["sesion_id"]
+
+# ============================================================
+# POOL DE PROCESOS (compartido por todas las sesiones)
+# ============================================================
+
+@st.cache_resource
+def get_gestor():
+    # Un único pool por servidor, compartido por todas las sesiones
+    return trabajos.GestorTrabajos()
+
+gestor = get_gestor()
+
+def mostrar_progreso(barra, etapa):
+    def _cb(trabajo):
+        barra.progress(trabajo.progreso, text=f"{etapa}: {trabajo.mensaje}")
+    return _cb
+
+en_disco = False
+modo = st.radio("Selecciona la fuente de datos:", ["Usar archivos precargados", "Subir archivos manualmente",
+                                                    "Consenso de varias matrices precargadas"])
 
 # ============================================================
-# CARGA ARCHIVOS
+# CARGA ARCHIVOS (memoizada en la sesión)
 # ============================================================
 
 if modo == "Usar archivos precargados":
 
-    matrices = [f for f in os.listdir(PRELOADED_MATRIX_DIR) if f.endswith(".csv")]
+    matrices = datos.listar_matrices(PRELOADED_MATRIX_DIR)
     selected_matrix = st.selectbox("📌 Selecciona matriz:", matrices)
-    df = pd.read_csv(os.path.join(PRELOADED_MATRIX_DIR, selected_matrix), index_col=0)
+    matrix_path = os.path.join(PRELOADED_MATRIX_DIR, selected_matrix)
 
     metadata_files = [f for f in os.listdir(PRELOADED_METADATA_DIR) if f.endswith(".csv")]
     selected_metadata = st.selectbox("📄 Selecciona metadatos:", metadata_files)
-    metadata = pd.read_csv(os.path.join(PRELOADED_METADATA_DIR, selected_metadata))
+    metadata_path = os.path.join(PRELOADED_METADATA_DIR, selected_metadata)
 
-else:
+    fuente = (matrix_path, datos.version_matriz(matrix_path), metadata_path, os.path.getmtime(metadata_path))
+    if selected_matrix.endswith(".matriz"):
+        import almacen_matrices
+        import fuera_de_memoria
+
+        n_almacen = almacen_matrices.leer_meta(matrix_path)["n"]
+        en_disco = st.checkbox(
+            "💽 Trabajar sobre el disco (sin cargar la matriz en memoria)",
+            value=fuera_de_memoria.necesita_disco(n_almacen),
+            help=f"{n_almacen} muestras: la matriz cuadrada ocuparía "
+                 f"{n_almacen ** 2 * 8 / 1024 ** 3:.1f} GB en float64.")
+    leer_matriz = lambda: datos.leer_matriz(matrix_path)
+    leer_metadata = lambda: datos.leer_metadata(metadata_path)
+
+elif modo == "Subir archivos manualmente":
     metadata_file = st.file_uploader("📄 Metadatos (.csv)", type=["csv"])
     matrix_files = st.file_uploader("📁 Matrices de distancia (.csv)", type=["csv"], accept_multiple_files=True)
 
@@ -83,62 +141,182 @@ else:
         st.info("Sube metadatos y al menos una matriz.")
         st.stop()
 
-    metadata = pd.read_csv(metadata_file)
     names = [m.name for m in matrix_files]
     selected_matrix_name = st.selectbox("📌 Matriz a visualizar:", names)
     matrix_file = next(m for m in matrix_files if m.name == selected_matrix_name)
-    df = pd.read_csv(matrix_file, index_col=0)
+
+    fuente = (matrix_file.file_id, metadata_file.file_id)
+    leer_matriz = lambda: datos.leer_csv_subido(matrix_file)
+    leer_metadata = lambda: datos.leer_metadata(metadata_file)
+
+else:
+    # Mismas muestras en varios compartimentos: se alinean por el nombre limpio
+    # y la app trabaja con 1 - co-clustering como matriz de distancias
+    matrices = datos.listar_matrices(PRELOADED_MATRIX_DIR)
+    seleccion = st.multiselect("📌 Matrices a combinar:", matrices, default=matrices[:2])
+    metadata_files = [f for f in os.listdir(PRELOADED_METADATA_DIR) if f.endswith(".csv")]
+    selected_metadata = st.selectbox("📄 Selecciona metadatos:", metadata_files)
+    metadata_path = os.path.join(PRELOADED_METADATA_DIR, selected_metadata)
+    col_metodo, col_k = st.columns(2)
+    metodo_consenso = col_metodo.selectbox("Linkage de cada matriz", datos.METODOS)
+    k_desde, k_hasta = col_k.slider("K del co-clustering", 2, 15, (2, 15))
+
+    if len(seleccion) < 2:
+        st.info("Elige al menos dos matrices.")
+        st.stop()
+
+    rutas = [os.path.join(PRELOADED_MATRIX_DIR, m) for m in seleccion]
+    fuente = ("consenso", tuple((r, datos.version_matriz(r)) for r in rutas),
+              metadata_path, os.path.getmtime(metadata_path), metodo_consenso, k_desde, k_hasta)
+    leer_metadata = lambda: datos.leer_metadata(metadata_path)
+
+    def leer_matriz():
+        import consenso
+
+        matrices_limpias = {}
+        for ruta in rutas:
+            m = datos.leer_matriz(ruta)
+            limpios = [clean_filename(i) for i in m.index]
+            m.index = limpios
+            m.columns = limpios
+            matrices_limpias[os.path.basename(ruta)] = m
+        alineadas = consenso.alinear(matrices_limpias)
+        n_comunes = len(next(iter(alineadas.values())))
+        if n_comunes < 3:
+            st.error(f"❌ Las matrices solo comparten {n_comunes} muestras.")
+            st.stop()
+
+        barra = st.progress(0.0, text="En cola")
+        try:
+            resultado = consenso.matriz_consenso(
+                gestor, (sesion_id, "consenso"), alineadas, metodo_consenso,
+                range(k_desde, k_hasta + 1),
+                al_progresar=lambda f, m: barra.progress(f, text=f"Consenso: {m}"))
+        except RuntimeError as e:
+            st.error(f"❌ Error en el consenso: {e}")
+            st.stop()
+        barra.empty()
+        return resultado
 
 # ============================================================
-# ANOTACIONES
+# MATRIZ EN DISCO (más grande que la memoria)
 # ============================================================
 
-cleaned = [clean_filename(i) for i in df.index]
-df.index = cleaned
-df.columns = cleaned
+if en_disco:
+    # Solo se leen los nombres de las muestras; la matriz se recorre por
+    # tramos desde los procesos del pool (fuera_de_memoria.py)
+    import numpy as np
 
-metadata["Sample"] = metadata["Archivo"].apply(clean_filename)
-metadata = metadata.set_index("Sample")
+    if st.session_state.get("disco_clave") != (fuente, module_mode):
+        muestras_disco = [clean_filename(m) for m in almacen_matrices.leer_muestras(matrix_path)]
+        st.session_state["disco"] = datos.anotaciones(muestras_disco, leer_metadata(), mod)
+        st.session_state["disco_clave"] = (fuente, module_mode)
+    anotaciones_disco = st.session_state["disco"]
 
-annotations = pd.DataFrame(index=cleaned)
-annotations["Tipo"] = [get_sample_type(n) for n in cleaned]
-annotations["Fanconi"] = [get_fanconi_status(n) for n in cleaned]
-annotations["Grado displasia"] = [get_grado_displasia(n) for n in cleaned]
+    st.info("Con la matriz en disco el árbol es siempre single linkage sobre las distancias del "
+            "archivo y el heatmap muestra la distancia media entre franjas de muestras.")
+    grupo_disco = st.selectbox("Subgrupo", list(datos.SUBGRUPOS))
+    miembros = set(datos.definir_subgrupos(anotaciones_disco.index.tolist(), anotaciones_disco)[grupo_disco])
+    seleccion = np.flatnonzero(anotaciones_disco.index.isin(miembros))
+    if len(seleccion) < 3:
+        st.warning("Subgrupo con menos de 3 muestras.")
+        st.stop()
+
+    anotaciones_figura = st.multiselect("Selecciona anotaciones", list(color_palettes.keys()),
+                                        default=["Tipo", "Fanconi"])
+    col_memoria, col_celdas = st.columns(2)
+    memoria_mb = col_memoria.number_input("Memoria máxima por proceso (MB)", 64, 65536,
+                                          int(fuera_de_memoria.MEMORIA_MB), step=64)
+    celdas = col_celdas.slider("Franjas del heatmap", 100, 2000, min(fuera_de_memoria.CELDAS, len(seleccion)),
+                               step=100)
+    with st.expander("🕸️ Comunidades del grafo kNN (Louvain)"):
+        import comunidades
 
-for col in ["Condition", "Gender", "Tumor stage", "BMT", "Desmoplastic category"]:
-    if col in metadata.columns:
-        annotations[col] = metadata.reindex(cleaned)[col]
+        louvain = None
+        con_comunidades = st.checkbox("Añadir la barra Louvain")
+        col_k, col_res = st.columns(2)
+        k_grafo = col_k.slider("Vecinos por muestra en el grafo", 5, 50, comunidades.K_GRAFO)
+        resolucion = col_res.slider("Resolución", 0.1, 3.0, comunidades.RESOLUCION, step=0.1)
+        if con_comunidades:
+            louvain = (k_grafo, resolucion)
+
+    barra = st.progress(0.0, text="En cola")
+    trabajo = gestor.enviar(
+        (sesion_id, "disco"), (fuente, grupo_disco, tuple(anotaciones_figura), memoria_mb, celdas, louvain),
+        trabajos.tarea_clustermap_disco, matrix_path, seleccion,
+        anotaciones_disco.iloc[seleccion], anotaciones_figura, (18, 20), memoria_mb, celdas, louvain)
+    gestor.esperar(trabajo, al_progresar=mostrar_progreso(barra, "Matriz en disco"))
+    barra.empty()
+    if trabajo.estado == "error":
+        st.error(f"❌ Error con la matriz en disco: {trabajo.error}")
+    elif trabajo.estado == "terminado":
+        if "comunidades" in trabajo.resultado:
+            st.caption(f"{trabajo.resultado['comunidades']} comunidades de Louvain.")
+        st.image(trabajo.resultado["vista"], width="stretch")
+        st.download_button("⬇️ Descargar PNG (Clustermap agregado)", trabajo.resultado["vista"],
+                           "clustermap_agregado.png", "image/png", on_click="ignore")
+    st.stop()
 
 # ============================================================
-# Clusters k (solo se aplica a dendrograma_clusters)
+# ANOTACIONES
 # ============================================================
 
-K = st.slider("Número de clusters (K)", min_value=2, max_value=15, value=4)
+# El CSV solo se vuelve a leer si cambia el archivo o el módulo (los helpers difieren)
+clave_datos = (fuente, module_mode)
+if st.session_state.get("datos_clave") != clave_datos:
+    # Lo que la sesión tuviera en marcha era de la matriz anterior
+    gestor.cancelar_grupo((sesion_id,))
+    with st.spinner("Cargando matriz..."):
+        st.session_state["datos"] = datos.preparar_datos(leer_matriz(), leer_metadata(), mod)
+    st.session_state["datos_clave"] = clave_datos
+    st.session_state["linkages"] = {}
+    st.session_state["proyecciones"] = {}
+    st.session_state["indice_vecinos"] = None
+    st.session_state["calidad"] = {}
+    st.session_state["soportes"] = {}
+    st.session_state["enriquecimientos"] = {}
+    st.session_state["acuerdos"] = {}
+    st.session_state["medoides"] = {}
+    st.session_state["etiquetas_externas"] = {}
+    st.session_state["ordenes_optimos"] = {}
+    st.session_state["matriz_compartida"] = None
+    st.session_state["cofeneticas"] = {}
+
+datos_sesion = st.session_state["datos"]
+df = datos_sesion["df"]
+annotations = datos_sesion["annotations"]
+cleaned = df.index.tolist()
+
+def matriz_compartida():
+    """
+    Referencia a la matriz cargada en memoria compartida, publicada una vez
+    por matriz y compartida entre sesiones; los trabajos del pool la leen
+    por nombre en lugar de recibir el DataFrame serializado.
+    """
+    if st.session_state["matriz_compartida"] is None:
+        import memoria_compartida
+
+        # La sesión deja de usar la matriz anterior; el testigo suelta la
+        # actual cuando Streamlit descarta la sesión
+        memoria_compartida.soltar_titular(sesion_id)
+        st.session_state.setdefault("testigo_memoria", memoria_compartida.testigo(sesion_id))
+        st.session_state["matriz_compartida"] = memoria_compartida.publicar_matriz(
+            datos_sesion["huella"], df, sesion_id)
+    return st.session_state["matriz_compartida"]
 
 # ============================================================
-# CONTROLES
+# CONTROLES DE CÁLCULO
 # ============================================================
 
-st.subheader("🎛️ Anotaciones a mostrar")
-selected_annotations = st.multiselect(
-    "Selecciona anotaciones",
-    list(color_palettes.keys()),
-    default=["Tipo", "Fanconi"]
-)
-
-metodo = st.selectbox("Método de linkage", ["average", "ward", "single", "complete", "median"])
+metodo = st.selectbox("Método de linkage", datos.METODOS)
+with st.expander("🌳 Usar un árbol guardado (Newick o .npz)"):
+    archivo_arbol = st.file_uploader(
+        "Árbol exportado con las mismas muestras que el subgrupo", type=["nwk", "newick", "tree", "npz"],
+        help="Se dibuja este árbol en lugar de calcular el linkage.")
 
 # ---- Subgrupos ----
 st.subheader("🧪 Subgrupos")
-subgrupos = {
-    "Todos": cleaned,
-    "Carcinoma": [s for s in cleaned if annotations.loc[s, "Tipo"] == "carcinoma"],
-    "Dysplasia": [s for s in cleaned if annotations.loc[s, "Tipo"] == "dysplasia"],
-    "Stroma-ad": [s for s in cleaned if "stroma" in annotations.loc[s, "Tipo"]],
-    "Carcinoma + Dysplasia": [s for s in cleaned if annotations.loc[s, "Tipo"] in ["carcinoma", "dysplasia"]],
-    "Fanconi": [s for s in cleaned if annotations.loc[s, "Fanconi"] == "Fanconi"],
-    "No Fanconi": [s for s in cleaned if annotations.loc[s, "Fanconi"] == "No Fanconi"]
-}
+subgrupos = datos.definir_subgrupos(cleaned, annotations)
 
 selected_group = st.selectbox("Subgrupo", list(subgrupos.keys()))
 muestras = subgrupos[selected_group]
@@ -149,69 +327,749 @@ if len(muestras) < 3:
 
 submatrix = df.loc[muestras, muestras]
 subann = annotations.loc[muestras]
+huella = datos_sesion["huella"]
+clave_matriz = (huella, selected_group)
 
-# ---- Tamaño figura ----
-st.sidebar.header("📏 Tamaño de la figura")
-fig_width = st.sidebar.slider("Ancho", 8, 30, 18)
-fig_height = st.sidebar.slider("Alto", 8, 40, 20)
+# ============================================================
+# CLUSTERING EN SEGUNDO PLANO (memoizado en la sesión)
+# ============================================================
+
+modulo = os.path.splitext(module_mode)[0]
+
+# Árbol importado: sustituye al linkage si sus hojas son las muestras del subgrupo
+arbol_importado = None
+if archivo_arbol is not None:
+    import formato_arbol
+
+    arboles = st.session_state.setdefault("arboles", {})
+    if archivo_arbol.file_id not in arboles:
+        try:
+            arboles[archivo_arbol.file_id] = formato_arbol.leer_arbol(archivo_arbol.name,
+                                                                      archivo_arbol.getvalue())
+        except ValueError as e:
+            arboles[archivo_arbol.file_id] = e
+    leido = arboles[archivo_arbol.file_id]
+    if isinstance(leido, ValueError):
+        st.error(f"❌ No se pudo leer el árbol: {leido}")
+    else:
+        Z_archivo, etiquetas_archivo, metodo_archivo = leido
+        try:
+            arbol_importado = {
+                "Z": formato_arbol.alinear(Z_archivo, etiquetas_archivo, submatrix.index),
+                "id": archivo_arbol.file_id, "metodo": metodo_archivo}
+        except ValueError as e:
+            st.error(f"❌ El árbol no corresponde al subgrupo: {e}")
+        else:
+            st.caption(f"🌳 Árbol de **{archivo_arbol.name}**"
+                       + (f" ({metodo_archivo})" if metodo_archivo else "")
+                       + ": la figura, el corte y el bootstrap usan este árbol; las vistas que "
+                       f"recalculan los clusters (medoides, enriquecimiento, calidad) usan «{metodo}».")
+origen_arbol = arbol_importado["id"] if arbol_importado else None
+
+linkages = st.session_state["linkages"]
+if arbol_importado is None and (clave_matriz, metodo) not in linkages:
+    barra = st.progress(0.0, text="En cola")
+    trabajo_linkage = gestor.enviar(
+        (sesion_id, "linkage"), (clave_matriz, metodo),
+        trabajos.tarea_linkage, submatrix, metodo, huella=huella
+    )
+    gestor.esperar(trabajo_linkage, al_progresar=mostrar_progreso(barra, "Clustering"))
+    barra.empty()
+    if trabajo_linkage.estado == "error":
+        st.error(f"❌ Error en el clustering: {trabajo_linkage.error}")
+        st.stop()
+    linkages[(clave_matriz, metodo)] = trabajo_linkage.resultado
+Z = arbol_importado["Z"] if arbol_importado else linkages[(clave_matriz, metodo)]
+
+# ============================================================
+# BÚSQUEDA DE VECINOS (índice kNN de la matriz cargada)
+# ============================================================
+
+st.sidebar.header("🔎 Vecinos más cercanos")
+consulta = st.sidebar.selectbox("Muestra", cleaned, index=None, placeholder="Buscar muestra...")
+resaltar = None
+if consulta is not None:
+    import vecinos
+
+    k_vecinos = st.sidebar.slider("Número de vecinos", 1, min(vecinos.K_INDICE, len(cleaned) - 1), 10)
+    if st.session_state["indice_vecinos"] is None:
+        # Una vez por matriz cargada (y en la caché de disco para las siguientes sesiones)
+        barra = st.sidebar.progress(0.0, text="En cola")
+        trabajo_knn = gestor.enviar(
+            (sesion_id, "vecinos"), huella, trabajos.tarea_indice_vecinos, df, huella=huella
+        )
+        gestor.esperar(trabajo_knn, al_progresar=mostrar_progreso(barra, "Índice"))
+        barra.empty()
+        if trabajo_knn.estado == "error":
+            st.sidebar.error(f"❌ Error al construir el índice: {trabajo_knn.error}")
+            st.stop()
+        st.session_state["indice_vecinos"] = trabajo_knn.resultado
+
+    posiciones, distancias = vecinos.consultar(
+        st.session_state["indice_vecinos"], df.index.get_loc(consulta), k_vecinos)
+    tabla = annotations.iloc[posiciones].copy()
+    tabla.insert(0, "Distancia", distancias)
+    st.sidebar.dataframe(tabla)
+
+    if st.sidebar.checkbox("Resaltar en la figura", value=True):
+        # Solo cuentan las muestras del subgrupo visible
+        en_subgrupo = set(muestras)
+        resaltar = [consulta] + [s for s in tabla.index if s in en_subgrupo]
+        if en_subgrupo.isdisjoint(resaltar):
+            resaltar = None
 
 # ============================================================
-# GENERAR FIGURA (usa el módulo elegido)
+# FIGURA (fragmento: K, anotaciones y tamaño solo re-dibujan)
 # ============================================================
 
-if module_mode == "dendrograma_clusters.py":
-    # plot_dendrograma acepta K
-    fig_dendo = plot_function(
-        submatrix,
-        subann,
-        selected_annotations=selected_annotations,
-        metodo=metodo,
-        K=K,
-        figsize=(fig_width, fig_height),
-        xticklabels=False,
-        yticklabels=False
+# Parámetros de la figura visible; el fragmento de exportación lee este mismo
+# objeto al descargar, así que se actualiza en sitio y no se reemplaza
+parametros_figura = st.session_state.setdefault("parametros_figura", {})
+soportes = st.session_state["soportes"]
+enriquecimientos = st.session_state["enriquecimientos"]
+sumas_medoides = st.session_state["medoides"]
+memo_etiquetas = st.session_state["etiquetas_externas"]
+ordenes_optimos = st.session_state["ordenes_optimos"]
+
+def vista_medoides(K):
+    # Sumas intra-cluster de todos los K, una vez por linkage (y en la caché de disco)
+    import medoides
+
+    col_n, col_boton = st.columns([1, 3])
+    n_top = col_n.number_input("Muestras por cluster", 1, 50, medoides.N_REPRESENTANTES)
+    if (clave_matriz, metodo) not in sumas_medoides:
+        if not col_boton.button("Calcular medoides"):
+            return
+        barra = st.progress(0.0, text="En cola")
+        trabajo = gestor.enviar((sesion_id, "medoides"), (clave_matriz, metodo),
+                                trabajos.tarea_medoides, submatrix, metodo, huella=huella)
+        gestor.esperar(trabajo, al_progresar=mostrar_progreso(barra, "Medoides"))
+        barra.empty()
+        if trabajo.estado == "error":
+            st.error(f"❌ Error al calcular los medoides: {trabajo.error}")
+            return
+        sumas_medoides[(clave_matriz, metodo)] = trabajo.resultado
+
+    import cache_disco
+
+    asignaciones = cache_disco.asignaciones_cacheadas(submatrix, metodo, huella=huella)
+    tabla = medoides.representantes(sumas_medoides[(clave_matriz, metodo)], asignaciones, K,
+                                    submatrix.index, int(n_top), cache_disco.K_MIN)
+    tabla = tabla.join(subann, on="Muestra")
+    st.dataframe(tabla, hide_index=True)
+    st.download_button("⬇️ Descargar CSV (representantes)", tabla.to_csv(index=False).encode(),
+                       f"representantes_K{K}.csv", "text/csv", on_click="ignore")
+
+def etiquetas_externas(titulo, parametros, tarea, *args, **kwargs):
+    """
+    Etiquetas de una agrupación calculada fuera del árbol (HDBSCAN, Louvain)
+    en un trabajo del pool, memorizadas por matriz y parámetros.
+    """
+    clave_etiquetas = (clave_matriz, titulo, *parametros)
+    if clave_etiquetas not in memo_etiquetas:
+        barra = st.progress(0.0, text="En cola")
+        trabajo = gestor.enviar((sesion_id, titulo), clave_etiquetas, tarea, *args, **kwargs)
+        gestor.esperar(trabajo, al_progresar=mostrar_progreso(barra, titulo))
+        barra.empty()
+        if trabajo.estado == "error":
+            st.error(f"❌ Error en {titulo}: {trabajo.error}")
+            return None
+        memo_etiquetas[clave_etiquetas] = trabajo.resultado
+    return memo_etiquetas[clave_etiquetas]
+
+def vista_enriquecimiento(K):
+    # Tablas de todos los K calculadas una vez por linkage; mover K solo filtra
+    import cache_disco
+    import enriquecimiento
+
+    if (clave_matriz, metodo) not in enriquecimientos:
+        asignaciones = cache_disco.asignaciones_cacheadas(submatrix, metodo, huella=huella)
+        enriquecimientos[(clave_matriz, metodo)] = enriquecimiento.enriquecimiento(asignaciones, subann)
+    mostrar_enriquecimiento(enriquecimientos[(clave_matriz, metodo)], K - cache_disco.K_MIN)
+
+def mostrar_enriquecimiento(resultado, j, nombre_grupo="Cluster"):
+    """Mapa de calor y chi² del corte j (columna j de las asignaciones)."""
+    import altair as alt
+    import enriquecimiento
+
+    if not resultado:
+        st.info("No hay anotaciones con valores en este subgrupo.")
+        return
+
+    tabla = enriquecimiento.tabla_k(resultado, j, 0).rename(columns={"Cluster": nombre_grupo})
+    tabla["Columna"] = tabla["Anotación"] + ": " + tabla["Categoría"]
+    tabla["Texto"] = tabla["Observados"].astype(str) + tabla["q"].lt(0.05).map({True: "*", False: ""})
+    base = alt.Chart(tabla).encode(
+        x=alt.X("Columna:N", title=None, sort=None),
+        y=alt.Y(f"{nombre_grupo}:O"),
+        tooltip=[nombre_grupo, "Anotación", "Categoría", "Observados",
+                 alt.Tooltip("Esperados", format=".1f"), alt.Tooltip("log2 O/E", format=".2f"),
+                 alt.Tooltip("p", format=".2e"), alt.Tooltip("q", format=".2e")],
     )
-    st.pyplot(fig_dendo)
+    mapa = base.mark_rect().encode(
+        color=alt.Color("log2 O/E:Q", scale=alt.Scale(scheme="redblue", domain=[-2, 2], reverse=True))
+    ) + base.mark_text(fontSize=9).encode(text="Texto:N")
+    st.altair_chart(mapa, width="stretch")
+    st.caption(f"Observados por {nombre_grupo.lower()} y categoría; * = sobrerrepresentada "
+               "(Fisher unilateral, q de Benjamini-Hochberg < 0.05). Color: log2 observados / esperados.")
 
-    # -----------------------
-    # Generar leyendas como figura separada
-    # -----------------------
-    if selected_annotations:
-        fig_legends = mod.plot_legends(selected_annotations)
-        st.pyplot(fig_legends)
+    st.dataframe(
+        {"Anotación": list(resultado),
+         "Chi²": [r["chi2"][j] for r in resultado.values()],
+         "gl": [int(r["gl"][j]) for r in resultado.values()],
+         "p": [r["p_chi2"][j] for r in resultado.values()]},
+        hide_index=True,
+    )
 
-else:
-    # plot_clustermap NO acepta K
-    fig_dendo = plot_function(
-        submatrix,
-        subann,
-        selected_annotations=selected_annotations,
-        metodo=metodo,
-        figsize=(fig_width, fig_height),
-        xticklabels=False,
-        yticklabels=False
+@st.fragment
+def vista_figura():
+    inicio = time.perf_counter()
+
+    # Clusters k (solo se aplica a dendrograma_clusters)
+    K = st.slider("Número de clusters (K)", min_value=2, max_value=15, value=4)
+
+    st.subheader("🎛️ Anotaciones a mostrar")
+    selected_annotations = st.multiselect(
+        "Selecciona anotaciones",
+        list(color_palettes.keys()),
+        default=["Tipo", "Fanconi"]
+    )
+
+    with st.expander("📏 Tamaño de la figura"):
+        col_ancho, col_alto = st.columns(2)
+        fig_width = col_ancho.slider("Ancho", 8, 30, 18)
+        fig_height = col_alto.slider("Alto", 8, 40, 20)
+        orden_optimo = st.checkbox(
+            "Orden óptimo de las hojas", help="Reordena las ramas para que las hojas vecinas "
+            "sean lo más parecidas posible. Se calcula en segundo plano: mientras tanto se "
+            "muestra el orden rápido.", disabled=arbol_importado is not None)
+
+    # Z de la figura: el del linkage o, si ya está calculado, el de orden óptimo
+    Z_figura = Z
+    trabajo_orden = None
+    if orden_optimo:
+        if (clave_matriz, metodo) not in ordenes_optimos:
+            trabajo_orden = gestor.enviar((sesion_id, "orden"), (clave_matriz, metodo),
+                                          trabajos.tarea_orden_optimo, submatrix, metodo,
+                                          huella=huella)
+            if trabajo_orden.estado == "terminado":
+                ordenes_optimos[(clave_matriz, metodo)] = trabajo_orden.resultado
+                trabajo_orden = None
+        Z_figura = ordenes_optimos.get((clave_matriz, metodo), Z)
+
+    soporte = None
+    replicas = None
+    clusters = None
+    corte = None
+    # Barras de agrupaciones externas al árbol y los parámetros de cada una
+    barras_clusters = {}
+    parametros_barras = {}
+    if module_mode == "dendrograma_clusters.py":
+        import estabilidad
+        import corte_dinamico
+
+        with st.expander("✂️ Corte del árbol"):
+            dinamico = st.radio("Corte", ["K fijo (altura única)", "Dinámico (dynamic tree cut)"],
+                                horizontal=True) != "K fijo (altura única)"
+            col_deep, col_min = st.columns(2)
+            deep_split = col_deep.slider("Sensibilidad (deep split)", 0, 4, corte_dinamico.DEEP_SPLIT,
+                                         disabled=not dinamico)
+            tamano_minimo = col_min.number_input("Tamaño mínimo del cluster", 2, 500,
+                                                 min(corte_dinamico.TAMANO_MINIMO, max(len(submatrix) // 4, 2)),
+                                                 disabled=not dinamico)
+            if dinamico:
+                corte = (deep_split, int(tamano_minimo))
+                clusters = corte_dinamico.corte_dinamico(Z_figura, deep_split, int(tamano_minimo))
+                st.caption(f"{int(clusters.max())} clusters; {int((clusters == 0).sum())} muestras "
+                           "sin asignar (ramas en negro). K sigue aplicándose a las tablas de abajo.")
+
+        with st.expander("🫧 Clusters por densidad (HDBSCAN)"):
+            con_densidad = st.checkbox("Añadir la barra HDBSCAN")
+            col_tam, col_muestras = st.columns(2)
+            tamano_densidad = int(col_tam.number_input("Tamaño mínimo de los clusters", 2, 1000, 10))
+            min_muestras = int(col_muestras.number_input("Vecinos para la densidad (min_samples)",
+                                                         1, 1000, tamano_densidad))
+            if con_densidad:
+                densidad = etiquetas_externas(
+                    "HDBSCAN", (tamano_densidad, min_muestras),
+                    trabajos.tarea_densidad, submatrix, tamano_densidad, min_muestras, huella=huella)
+                if densidad is not None:
+                    barras_clusters["HDBSCAN"] = densidad
+                    parametros_barras["HDBSCAN"] = (tamano_densidad, min_muestras)
+                    st.caption(f"{int(densidad.max())} clusters; {int((densidad == 0).sum())} "
+                               "muestras de ruido (gris).")
+
+        with st.expander("🕸️ Comunidades del grafo kNN (Louvain)"):
+            import comunidades
+
+            con_comunidades = st.checkbox("Añadir la barra Louvain")
+            col_k, col_res = st.columns(2)
+            k_grafo = col_k.slider("Vecinos por muestra en el grafo", 5, 50, comunidades.K_GRAFO)
+            resolucion = col_res.slider("Resolución", 0.1, 3.0, comunidades.RESOLUCION, step=0.1)
+            if con_comunidades:
+                louvain = etiquetas_externas(
+                    "Louvain", (k_grafo, resolucion),
+                    trabajos.tarea_comunidades, submatrix, k_grafo, resolucion, huella=huella)
+                if louvain is not None:
+                    barras_clusters["Louvain"] = louvain
+                    parametros_barras["Louvain"] = (k_grafo, resolucion)
+                    st.caption(f"{int(louvain.max())} comunidades.")
+                    if st.checkbox("Enriquecimiento de anotaciones por comunidad"):
+                        import enriquecimiento
+
+                        mostrar_enriquecimiento(
+                            enriquecimiento.enriquecimiento(louvain[:, None], subann), 0, "Comunidad")
+
+        with st.expander("🔁 Estabilidad de las ramas (bootstrap)"):
+            mostrar_soporte = st.checkbox("Mostrar el soporte de las ramas")
+            replicas = st.slider("Réplicas", 20, 500, estabilidad.REPLICAS, step=20)
+        if not mostrar_soporte:
+            replicas = None
+        elif (clave_matriz, metodo, replicas, origen_arbol) in soportes:
+            soporte = soportes[(clave_matriz, metodo, replicas, origen_arbol)]
+        else:
+            barra = st.progress(0.0, text="En cola")
+            try:
+                soporte = estabilidad.calcular_soporte(
+                    gestor, (sesion_id, "estabilidad"), submatrix, Z, metodo, huella,
+                    replicas=replicas, publicada=matriz_compartida(),
+                    al_progresar=lambda f, m: barra.progress(f, text=f"Bootstrap: {m}"))
+            except RuntimeError as e:
+                st.error(f"❌ Error en el bootstrap: {e}")
+                replicas = None
+            else:
+                soportes[(clave_matriz, metodo, replicas, origen_arbol)] = soporte
+            barra.empty()
+
+    K_figura = K if module_mode == "dendrograma_clusters.py" else None
+    parametros_figura.clear()
+    parametros_figura.update(
+        modulo=modulo, huella=huella, matrix_df=submatrix, annotations_df=subann,
+        selected_annotations=selected_annotations, metodo=metodo, Z=Z_figura,
+        figsize=(fig_width, fig_height), K=K_figura, resaltar=resaltar, soporte=soporte,
+        clusters=clusters, barras_clusters=barras_clusters,
+        clave=(modulo, clave_matriz, metodo, tuple(selected_annotations),
+               K_figura, fig_width, fig_height, tuple(resaltar or ()), replicas, corte,
+               tuple(parametros_barras.items()), Z_figura is not Z, origen_arbol),
+        metodo_arbol=arbol_importado["metodo"] if arbol_importado else metodo,
+    )
+
+    trabajo_render = gestor.enviar(
+        (sesion_id, "figura"), parametros_figura["clave"],
+        trabajos.tarea_render, modulo, submatrix, subann, selected_annotations, metodo,
+        Z_figura, (fig_width, fig_height), K=K_figura, formatos=trabajos.FORMATOS_VISTA,
+        huella=huella, resaltar=resaltar, soporte=soporte, clusters=clusters,
+        barras_clusters=barras_clusters
+    )
+
+    # La última figura terminada sigue en pantalla mientras se dibuja la nueva
+    figura_slot = st.empty()
+    leyendas_slot = st.empty()
+    ultima = st.session_state.get("ultima_figura")
+    if ultima is not None and not trabajo_render.terminado():
+        figura_slot.image(ultima["vista"], width="stretch")
+        if "leyendas" in ultima:
+            leyendas_slot.image(ultima["leyendas"])
+
+    barra = st.progress(0.0, text="En cola")
+    gestor.esperar(trabajo_render, al_progresar=mostrar_progreso(barra, "Figura"))
+    barra.empty()
+    if trabajo_render.estado == "error":
+        st.error(f"❌ Error al dibujar la figura: {trabajo_render.error}")
+        return
+
+    figura = trabajo_render.resultado
+    st.session_state["ultima_figura"] = figura
+    figura_slot.image(figura["vista"], width="stretch")
+    if "leyendas" in figura:
+        leyendas_slot.image(figura["leyendas"])
+        # ===============================
+        # Exportar leyendas (opcional)
+        # ===============================
+        st.download_button("⬇️ Descargar PNG (Leyendas)", figura["leyendas"],
+                           "leyendas.png", "image/png", on_click="ignore")
+    else:
+        leyendas_slot.empty()
+
+    with st.expander(f"🧬 Enriquecimiento de anotaciones por cluster (K = {K})"):
+        vista_enriquecimiento(K)
+
+    with st.expander(f"🎯 Medoides y muestras representativas (K = {K})"):
+        vista_medoides(K)
+
+    registrar_tiempo("figura", inicio)
+
+    # La figura con el orden rápido ya está en pantalla: el orden óptimo sigue
+    # en segundo plano y se recoge al terminar sin bloquear el resto de la página
+    if trabajo_orden is not None:
+        vigilar_orden(trabajo_orden, (clave_matriz, metodo))
+
+@st.fragment(run_every=1.0)
+def vigilar_orden(trabajo, clave):
+    # Fragmento anidado en vista_figura: se repite cada segundo mientras el
+    # trabajo sigue pendiente y, al terminar, vuelve a dibujar la página
+    gestor.actualizar()
+    if not trabajo.terminado():
+        st.progress(trabajo.progreso, text=f"Orden óptimo: {trabajo.mensaje}")
+    elif trabajo.estado == "error":
+        st.error(f"❌ Error en el orden óptimo de las hojas: {trabajo.error}")
+    elif trabajo.estado == "terminado" and clave not in ordenes_optimos:
+        ordenes_optimos[clave] = trabajo.resultado
+        st.rerun()
+
+vista_figura()
+
+# ============================================================
+# EXPORTAR (fragmento: descargar no re-ejecuta nada)
+# ============================================================
+
+def exportar_figura(nombre):
+    # Se ejecuta al pulsar el botón, fuera del script: solo usa el pool
+    p = dict(parametros_figura)
+    trabajo = gestor.enviar(
+        (sesion_id, "exportar", nombre), p["clave"],
+        trabajos.tarea_render, p["modulo"], p["matrix_df"], p["annotations_df"],
+        p["selected_annotations"], p["metodo"], p["Z"], p["figsize"], K=p["K"],
+        formatos=[f for f in trabajos.FORMATOS_EXPORTACION if f[0] == nombre],
+        huella=p["huella"], resaltar=p["resaltar"], soporte=p["soporte"],
+        clusters=p["clusters"], barras_clusters=p["barras_clusters"]
     )
-    st.pyplot(fig_dendo)
-
-# ===============================
-# Exportar dendrograma
-# ===============================
-buf_png = io.BytesIO()
-fig_dendo.savefig(buf_png, format="png", dpi=300, bbox_inches="tight")
-buf_png.seek(0)
-st.download_button("⬇️ Descargar PNG (Dendrograma)", buf_png, "dendrograma.png", "image/png")
-
-buf_pdf = io.BytesIO()
-fig_dendo.savefig(buf_pdf, format="pdf", bbox_inches="tight")
-buf_pdf.seek(0)
-st.download_button("⬇️ Descargar PDF (Dendrograma)", buf_pdf, "dendrograma.pdf", "application/pdf")
-
-# ===============================
-# Exportar leyendas (opcional)
-# ===============================
-if module_mode == "dendrograma_clusters.py" and selected_annotations:
-    buf_legends = io.BytesIO()
-    fig_legends.savefig(buf_legends, format="png", dpi=300, bbox_inches="tight")
-    buf_legends.seek(0)
-    st.download_button("⬇️ Descargar PNG (Leyendas)", buf_legends, "leyendas.png", "image/png")
+    gestor.esperar(trabajo)
+    if trabajo.estado != "terminado":
+        raise RuntimeError(trabajo.error or "Exportación cancelada")
+    return trabajo.resultado[nombre]
+
+def exportar_arbol(formato):
+    # El árbol de la figura (con el orden óptimo si está activo) y sus muestras
+    import formato_arbol
+
+    p = dict(parametros_figura)
+    etiquetas = p["matrix_df"].index
+    if formato == "npz":
+        return formato_arbol.a_npz(p["Z"], etiquetas, p["metodo_arbol"])
+    return formato_arbol.a_newick(p["Z"], etiquetas).encode()
+
+@st.fragment
+def exportar():
+    # ===============================
+    # Exportar dendrograma
+    # ===============================
+    st.download_button("⬇️ Descargar PNG (Dendrograma)", lambda: exportar_figura("png"),
+                       "dendrograma.png", "image/png", on_click="ignore")
+    st.download_button("⬇️ Descargar PDF (Dendrograma)", lambda: exportar_figura("pdf"),
+                       "dendrograma.pdf", "application/pdf", on_click="ignore")
+    # Árbol para otras herramientas (Newick) o para volver a cargarlo aquí (.npz)
+    st.download_button("⬇️ Descargar Newick (Árbol)", lambda: exportar_arbol("newick"),
+                       "arbol.nwk", "text/plain", on_click="ignore")
+    st.download_button("⬇️ Descargar NPZ (Árbol)", lambda: exportar_arbol("npz"),
+                       "arbol.npz", "application/octet-stream", on_click="ignore")
+
+exportar()
+
+# ============================================================
+# DISTANCIAS COFENÉTICAS (la matriz frente al árbol)
+# ============================================================
+
+cofeneticas = st.session_state["cofeneticas"]
+
+@st.fragment
+def vista_cofenetica():
+    import cofenetica
+
+    st.subheader("🌲 Distancias cofenéticas")
+    if not st.toggle("Comparar las distancias con las del árbol", value=False):
+        return
+    inicio = time.perf_counter()
+    celdas = st.slider("Franjas", 50, 1000, cofenetica.CELDAS, step=50,
+                       help="Cada píxel es la media de un bloque de muestras consecutivas en el "
+                            "orden de las hojas de la figura.")
+
+    # Mismo orden de hojas que la figura (orden óptimo incluido)
+    Z_orden = parametros_figura["Z"]
+    clave_cofenetica = (clave_matriz, metodo, origen_arbol, Z_orden is not Z, celdas)
+    if clave_cofenetica not in cofeneticas:
+        import memoria_compartida
+
+        referencia = matriz_compartida()
+        barra = st.progress(0.0, text="En cola")
+        trabajo = gestor.enviar(
+            (sesion_id, "cofenetica"), clave_cofenetica, trabajos.tarea_cofenetica,
+            referencia, memoria_compartida.posiciones(referencia, submatrix.index), Z, Z_orden,
+            huella, celdas)
+        gestor.esperar(trabajo, al_progresar=mostrar_progreso(barra, "Cofenética"))
+        barra.empty()
+        if trabajo.estado == "error":
+            st.error(f"❌ Error en las distancias cofenéticas: {trabajo.error}")
+            return
+        cofeneticas[clave_cofenetica] = trabajo.resultado
+    resultado = cofeneticas[clave_cofenetica]
+
+    st.image(resultado["vista"], width="stretch")
+    st.caption("Las alturas del árbol se pasan a las unidades de la matriz con el ajuste lineal "
+               f"{resultado['alfa']:.3g} + {resultado['beta']:.3g} · altura (mínimos cuadrados). "
+               "En el residuo, rojo: pares más separados en la matriz que en el árbol; azul: al revés.")
+    st.download_button("⬇️ Descargar PNG (Cofenéticas)", resultado["vista"], "cofeneticas.png",
+                       "image/png", on_click="ignore")
+
+    registrar_tiempo("cofenetica", inicio)
+
+vista_cofenetica()
+
+# ============================================================
+# CALIDAD DE LOS CLUSTERS (todos los métodos y K a la vez)
+# ============================================================
+
+calidades = st.session_state["calidad"]
+
+@st.fragment
+def vista_calidad():
+    import pandas as pd
+
+    st.subheader("📊 Calidad de los clusters")
+    if not st.toggle("Comparar métodos y K (cofenética y silueta)", value=False):
+        return
+    inicio = time.perf_counter()
+
+    if clave_matriz not in calidades:
+        # Un trabajo por método: el pool los calcula en paralelo
+        barra = st.progress(0.0, text="En cola")
+        pendientes = {
+            m: gestor.enviar((sesion_id, "calidad", m), (clave_matriz, m),
+                             trabajos.tarea_calidad, submatrix, m, huella=huella)
+            for m in datos.METODOS
+        }
+        gestor.esperar_todos(list(pendientes.values()), unidad="métodos",
+                             al_progresar=lambda f, m: barra.progress(f, text=f"Calidad: {m}"))
+        barra.empty()
+        fallidos = [f"{m}: {t.error}" for m, t in pendientes.items() if t.estado != "terminado"]
+        if fallidos:
+            st.error("❌ Error al evaluar los métodos: " + "; ".join(fallidos))
+            return
+        calidades[clave_matriz] = {m: t.resultado for m, t in pendientes.items()}
+
+    resultados = calidades[clave_matriz]
+    ks = [f"K={k}" for k in range(2, 16)]
+    tabla = pd.DataFrame({m: r for m, r in resultados.items()}, index=["Cofenética"] + ks).T
+    mejor_metodo, mejor_k = tabla[ks].stack().idxmax()
+    st.caption(f"Mayor silueta: {mejor_metodo} con {mejor_k} ({tabla.loc[mejor_metodo, mejor_k]:.3f}). "
+               f"Mayor correlación cofenética: {tabla['Cofenética'].idxmax()} "
+               f"({tabla['Cofenética'].max():.3f}).")
+    st.line_chart(tabla[ks].T.set_axis(range(2, 16)), x_label="K", y_label="Silueta media")
+    st.dataframe(tabla.style.format("{:.3f}"))
+
+    registrar_tiempo("calidad", inicio)
+
+vista_calidad()
+
+# ============================================================
+# ACUERDO ENTRE PARTICIONES (ARI y NMI entre métodos y matrices)
+# ============================================================
+
+acuerdos = st.session_state["acuerdos"]
+
+def mapa_cuadrado(tabla, titulo):
+    import altair as alt
+
+    largo = tabla.rename_axis("fila").reset_index().melt("fila", var_name="columna", value_name=titulo)
+    base = alt.Chart(largo, title=titulo).encode(
+        x=alt.X("columna:N", title=None, sort=list(tabla.columns)),
+        y=alt.Y("fila:N", title=None, sort=list(tabla.index)),
+    )
+    return base.mark_rect().encode(
+        color=alt.Color(f"{titulo}:Q", scale=alt.Scale(scheme="viridis", domain=[0, 1]))
+    ) + base.mark_text(fontSize=10, color="white").encode(text=alt.Text(f"{titulo}:Q", format=".2f"))
+
+@st.fragment
+def vista_acuerdo():
+    st.subheader("🤝 Acuerdo entre particiones")
+    if not st.toggle("Comparar los cortes de todos los métodos (ARI y NMI)", value=False):
+        return
+    import acuerdo
+    import cache_disco
+
+    inicio = time.perf_counter()
+    col_k, col_extra = st.columns([1, 3])
+    K_acuerdo = col_k.slider("K", cache_disco.K_MIN, cache_disco.K_MAX, 4, key="k_acuerdo")
+    extras = col_extra.multiselect("Comparar también con otras matrices (mismas muestras)",
+                                   datos.listar_matrices(PRELOADED_MATRIX_DIR))
+
+    clave_acuerdo = (clave_matriz, tuple(extras))
+    if clave_acuerdo not in acuerdos:
+        matrices = {"actual": submatrix}
+        huellas = {"actual": huella}
+        for nombre in extras:
+            m = datos.leer_matriz(os.path.join(PRELOADED_MATRIX_DIR, nombre))
+            limpios = [clean_filename(i) for i in m.index]
+            m.index = limpios
+            m.columns = limpios
+            matrices[nombre] = m
+            huellas[nombre] = cache_disco.huella_matriz(m)
+        if extras:
+            import consenso
+            matrices = consenso.alinear(matrices)
+            if len(matrices["actual"]) < 3:
+                st.warning(f"Las matrices solo comparten {len(matrices['actual'])} muestras del subgrupo.")
+                return
+
+        barra = st.progress(0.0, text="En cola")
+        try:
+            acuerdos[clave_acuerdo] = acuerdo.asignaciones_por_metodo(
+                gestor, (sesion_id, "acuerdo"),
+                {nombre: (m, huellas[nombre]) for nombre, m in matrices.items()}, datos.METODOS,
+                al_progresar=lambda f, m: barra.progress(f, text=f"Linkages: {m}"))
+        except RuntimeError as e:
+            st.error(f"❌ Error al agrupar: {e}")
+            return
+        barra.empty()
+
+    asignaciones = acuerdos[clave_acuerdo]
+    j = K_acuerdo - cache_disco.K_MIN
+    particiones = {(metodo if not extras else f"{nombre} · {metodo}"): a[:, j]
+                   for (nombre, metodo), a in asignaciones.items()}
+    tabla_ari, tabla_nmi = acuerdo.matrices_acuerdo(particiones)
+
+    col_ari, col_nmi = st.columns(2)
+    col_ari.altair_chart(mapa_cuadrado(tabla_ari, "ARI"), width="stretch")
+    col_nmi.altair_chart(mapa_cuadrado(tabla_nmi, "NMI"), width="stretch")
+    n_muestras = len(next(iter(asignaciones.values())))
+    st.caption(f"Cortes con K = {K_acuerdo} sobre {n_muestras} muestras. 1 = particiones idénticas; "
+               f"ARI ≈ 0 = acuerdo esperable por azar.")
+
+    registrar_tiempo("acuerdo", inicio)
+
+vista_acuerdo()
+
+# ============================================================
+# COMPARACIÓN DE MATRICES (prueba de Mantel)
+# ============================================================
+
+# No depende de la matriz cargada: se conserva al cambiarla
+resultados_mantel = st.session_state.setdefault("mantel", {})
+
+@st.fragment
+def vista_mantel():
+    st.subheader("🧮 Comparación de matrices (Mantel)")
+    if not st.toggle("Comparar dos matrices precargadas", value=False):
+        return
+    import consenso
+    import mantel
+
+    inicio = time.perf_counter()
+    matrices = datos.listar_matrices(PRELOADED_MATRIX_DIR)
+    col_a, col_b, col_c = st.columns(3)
+    nombre_a = col_a.selectbox("Matriz A", matrices, index=0)
+    nombre_b = col_b.selectbox("Matriz B", matrices, index=min(1, len(matrices) - 1))
+    nombre_c = col_c.selectbox("Controlar por (parcial)", ["Ninguna"] + matrices)
+    permutaciones = st.number_input("Permutaciones", 99, 99999, mantel.PERMUTACIONES, step=1000)
+
+    nombres = [nombre_a, nombre_b] + ([nombre_c] if nombre_c != "Ninguna" else [])
+    if len(set(nombres)) < len(nombres):
+        st.info("Elige matrices distintas.")
+        return
+
+    # Las matrices solo se leen y alinean si cambia la selección o alguna de ellas
+    clave_mantel = (tuple((nombre, datos.version_matriz(os.path.join(PRELOADED_MATRIX_DIR, nombre)))
+                          for nombre in nombres), int(permutaciones))
+    if clave_mantel not in resultados_mantel:
+        matrices_limpias = {}
+        for nombre in nombres:
+            m = datos.leer_matriz(os.path.join(PRELOADED_MATRIX_DIR, nombre))
+            limpios = [clean_filename(i) for i in m.index]
+            m.index = limpios
+            m.columns = limpios
+            matrices_limpias[nombre] = m
+        alineadas = list(consenso.alinear(matrices_limpias).values())
+        if len(alineadas[0]) < 4:
+            resultados_mantel[clave_mantel] = {"muestras": len(alineadas[0])}
+        else:
+            barra = st.progress(0.0, text="En cola")
+            try:
+                resultados_mantel[clave_mantel] = mantel.prueba_mantel(
+                    gestor, (sesion_id, "mantel"), *alineadas, permutaciones=int(permutaciones),
+                    al_progresar=lambda f, m: barra.progress(f, text=f"Mantel: {m}"))
+            except RuntimeError as e:
+                st.error(f"❌ Error en la prueba de Mantel: {e}")
+                return
+            barra.empty()
+    res = resultados_mantel[clave_mantel]
+    if "r" not in res:
+        st.warning(f"Las matrices solo comparten {res['muestras']} muestras.")
+        return
+
+    columnas = st.columns(4 if res["r_parcial"] is not None else 2)
+    columnas[0].metric("r de Mantel", f"{res['r']:.3f}")
+    columnas[1].metric("p-valor", f"{res['p']:.4g}")
+    if res["r_parcial"] is not None:
+        # NaN: C está perfectamente correlada con A o con B
+        definido = res["r_parcial"] == res["r_parcial"]
+        columnas[2].metric(f"r parcial (| {nombre_c})", f"{res['r_parcial']:.3f}" if definido else "—")
+        columnas[3].metric("p-valor parcial", f"{res['p_parcial']:.4g}" if definido else "—")
+    st.caption(f"{res['muestras']} muestras comunes, {res['permutaciones']} permutaciones, "
+               f"p unilateral (r permutado ≥ r observado).")
+
+    registrar_tiempo("mantel", inicio)
+
+vista_mantel()
+
+# ============================================================
+# PROYECCIÓN MDS (fragmento: color y ejes solo re-dibujan)
+# ============================================================
+
+proyecciones = st.session_state["proyecciones"]
+
+@st.fragment
+def vista_mds():
+    import altair as alt
+    import pandas as pd
+
+    st.subheader("🗺️ Proyección MDS")
+    if not st.toggle("Mostrar proyección MDS clásica", value=False):
+        return
+    inicio = time.perf_counter()
+
+    if clave_matriz not in proyecciones:
+        barra = st.progress(0.0, text="En cola")
+        trabajo_mds = gestor.enviar(
+            (sesion_id, "mds"), clave_matriz, trabajos.tarea_mds, submatrix, huella=huella
+        )
+        gestor.esperar(trabajo_mds, al_progresar=mostrar_progreso(barra, "MDS"))
+        barra.empty()
+        if trabajo_mds.estado == "error":
+            st.error(f"❌ Error en el MDS: {trabajo_mds.error}")
+            return
+        proyecciones[clave_matriz] = trabajo_mds.resultado
+    coordenadas, explicada = proyecciones[clave_matriz]
+
+    disponibles = [a for a in color_palettes if a in subann.columns]
+    col_color, col_ejes = st.columns(2)
+    anotacion = col_color.selectbox("Colorear por", disponibles)
+    ejes = col_ejes.radio("Ejes", ["1-2", "1-3", "2-3"], horizontal=True)
+    ex, ey = (int(e) - 1 for e in ejes.split("-"))
+
+    puntos = pd.DataFrame({
+        "muestra": submatrix.index,
+        "x": coordenadas[:, ex],
+        "y": coordenadas[:, ey],
+        anotacion: subann[anotacion].astype(str).values,
+    })
+    # Valores sin color en la paleta (p. ej. metadatos vacíos) en gris
+    paleta = dict(color_palettes[anotacion])
+    for valor in sorted(set(puntos[anotacion]) - set(paleta)):
+        paleta[valor] = "#BBBBBB"
+    grafico = alt.Chart(puntos).mark_circle(size=40, opacity=0.8).encode(
+        x=alt.X("x", title=f"MDS {ex + 1} ({explicada[ex]:.1%})"),
+        y=alt.Y("y", title=f"MDS {ey + 1} ({explicada[ey]:.1%})"),
+        color=alt.Color(anotacion, scale=alt.Scale(domain=list(paleta), range=list(paleta.values()))),
+        tooltip=["muestra", anotacion],
+    ).interactive()
+    st.altair_chart(grafico, width="stretch")
+
+    registrar_tiempo("mds", inicio)
+
+vista_mds()
 
+registrar_tiempo("script completo", inicio_run)
+if TIEMPOS:
+    with st.sidebar.expander("⏱️ Tiempos del último rerun"):
+        for nombre, segundos in st.session_state["tiempos"].items():
+            st.write(f"{nombre}: {segundos:.2f} s")
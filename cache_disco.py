@@ -0,0 +1,279 @@
+# cache_disco.py
+import os
+import io
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos para la purga
+    fcntl = None
+
+# =====================================================
+# Configuración
+# =====================================================
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("CLUSTERMAP_CACHE_DIR", os.path.join(BASE_DIR, ".cache_clustermap"))
+CUOTA_BYTES = int(float(os.environ.get("CLUSTERMAP_CACHE_MB", "2048")) * 1024 ** 2)
+
+# Sube este número si cambia cómo se dibujan las figuras o se cortan los clusters
+VERSION = 1
+
+# Rango de K del slider de la app; se guardan las asignaciones de todos a la vez
+K_MIN, K_MAX = 2, 15
+
+# Cada cuántos bytes escritos por este proceso se revisa la cuota
+_REVISAR_CADA = 64 * 1024 ** 2
+_escritos_desde_purga = 0
+
+# =====================================================
+# Claves
+# =====================================================
+
+def _digest(datos, n=32):
+    return hashlib.blake2b(datos, digest_size=n // 2).hexdigest()
+
+
+def huella_matriz(matrix_df):
+    """
+    Huella de contenido de la matriz (etiquetas + valores en float64).
+    Todo lo derivado de una matriz se guarda bajo su huella.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update("\n".join(map(str, matrix_df.index)).encode())
+    h.update(b"\0")
+    h.update("\n".join(map(str, matrix_df.columns)).encode())
+    h.update(b"\0")
+    h.update(np.ascontiguousarray(matrix_df.values, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def huella_matriz_filas(etiquetas, leer_filas, n, bloque=1024):
+    """
+    La misma huella que huella_matriz para una matriz cuadrada con esas
+    etiquetas en filas y columnas, leída por bloques con
+    leer_filas(ini, fin) -> filas completas (fin - ini, n).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    texto = "\n".join(map(str, etiquetas)).encode()
+    h.update(texto)
+    h.update(b"\0")
+    h.update(texto)
+    h.update(b"\0")
+    for ini in range(0, n, bloque):
+        h.update(np.ascontiguousarray(leer_filas(ini, min(ini + bloque, n)), dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def huella_archivo(ruta):
+    """Identifica un archivo por ruta, tamaño y fecha (sin leerlo entero)."""
+    st = os.stat(ruta)
+    return _digest(f"{os.path.abspath(ruta)}\0{st.st_size}\0{st.st_mtime_ns}".encode())
+
+
+def huella_muestras(muestras):
+    """Huella del subconjunto de muestras (en orden)."""
+    return _digest("\n".join(map(str, muestras)).encode(), 16)
+
+
+def huella_array(arr):
+    arr = np.ascontiguousarray(arr)
+    return _digest(str(arr.dtype).encode() + str(arr.shape).encode() + arr.tobytes(), 16)
+
+
+def clave(*partes):
+    """Clave de una entrada a partir de parámetros serializables en JSON."""
+    texto = json.dumps([VERSION, *partes], sort_keys=True, default=str)
+    return _digest(texto.encode())
+
+# =====================================================
+# Lectura / escritura atómica
+# =====================================================
+
+def _ruta(huella, clave_entrada, ext):
+    return os.path.join(CACHE_DIR, huella[:2], huella, f"{clave_entrada}.{ext}")
+
+
+def cargar_bytes(huella, clave_entrada, ext):
+    ruta = _ruta(huella, clave_entrada, ext)
+    try:
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        # La fecha de modificación hace de "último uso" para la purga LRU
+        os.utime(ruta)
+    except FileNotFoundError:
+        # No existe o la purgó otro proceso entre medias
+        return None
+    return datos
+
+
+def guardar_bytes(huella, clave_entrada, ext, datos):
+    """
+    Escribe en un temporal del mismo directorio y lo renombra: los lectores
+    de otros procesos ven el archivo completo o no lo ven.
+    """
+    global _escritos_desde_purga
+    ruta = _ruta(huella, clave_entrada, ext)
+    carpeta = os.path.dirname(ruta)
+    os.makedirs(carpeta, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=carpeta, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    _escritos_desde_purga += len(datos)
+    if _escritos_desde_purga >= _REVISAR_CADA:
+        _escritos_desde_purga = 0
+        purgar()
+
+
+def cargar_array(huella, clave_entrada):
+    datos = cargar_bytes(huella, clave_entrada, "npy")
+    if datos is None:
+        return None
+    return np.load(io.BytesIO(datos), allow_pickle=False)
+
+
+def guardar_array(huella, clave_entrada, arr):
+    buf = io.BytesIO()
+    np.save(buf, np.asarray(arr), allow_pickle=False)
+    guardar_bytes(huella, clave_entrada, "npy", buf.getvalue())
+
+# =====================================================
+# Cuota e invalidación
+# =====================================================
+
+def _entradas():
+    for raiz, _, archivos in os.walk(CACHE_DIR):
+        for nombre in archivos:
+            if nombre.startswith("."):
+                continue
+            ruta = os.path.join(raiz, nombre)
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            yield ruta, st.st_size, st.st_mtime
+
+
+def purgar(cuota=None):
+    """
+    Borra las entradas usadas hace más tiempo hasta quedar por debajo del 90 %
+    de la cuota. Solo purga un proceso a la vez; si otro ya lo está haciendo,
+    no espera.
+    """
+    cuota = CUOTA_BYTES if cuota is None else cuota
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, ".lock"), "a") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+        entradas = sorted(_entradas(), key=lambda e: e[2])
+        total = sum(e[1] for e in entradas)
+        if total <= cuota:
+            return
+        objetivo = int(cuota * 0.9)
+        for ruta, tam, _ in entradas:
+            if total <= objetivo:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tam
+
+
+def invalidar(huella):
+    """Borra todo lo guardado para una matriz (p. ej. si sus datos cambian)."""
+    carpeta = os.path.join(CACHE_DIR, huella[:2], huella)
+    if not os.path.isdir(carpeta):
+        return
+    for nombre in os.listdir(carpeta):
+        try:
+            os.remove(os.path.join(carpeta, nombre))
+        except FileNotFoundError:
+            pass
+    try:
+        os.rmdir(carpeta)
+    except OSError:
+        pass
+
+# =====================================================
+# Linkage y asignaciones para todos los K
+# =====================================================
+
+def _asignaciones(Z):
+    from scipy.cluster.hierarchy import fcluster
+    return np.stack(
+        [fcluster(Z, k, criterion="maxclust") for k in range(K_MIN, K_MAX + 1)], axis=1
+    ).astype(np.int32)
+
+
+def _claves_linkage(matrix_df, metodo, huella):
+    sub = huella_muestras(matrix_df.index)
+    return {nombre: clave(nombre, sub, metodo) for nombre in ("linkage", "asignaciones")}
+
+
+def linkage_cacheado(matrix_df, metodo, huella=None):
+    """
+    Z de la submatriz con el método dado (misma convención que sns.clustermap:
+    filas como observaciones euclídeas). Al calcularlo se guardan también
+    las asignaciones fcluster para K_MIN..K_MAX.
+    huella: la de la matriz completa de la que sale matrix_df, si se conoce.
+    """
+    if huella is None:
+        huella = huella_matriz(matrix_df)
+    claves = _claves_linkage(matrix_df, metodo, huella)
+    Z = cargar_array(huella, claves["linkage"])
+    if Z is not None:
+        return Z
+
+    from scipy.cluster.hierarchy import linkage
+
+    Z = linkage(matrix_df.values, method=metodo, metric="euclidean")
+    guardar_array(huella, claves["asignaciones"], _asignaciones(Z))
+    guardar_array(huella, claves["linkage"], Z)
+    return Z
+
+
+def linkage_optimo_cacheado(matrix_df, metodo, huella=None):
+    """
+    Z con el orden óptimo de hojas (optimal_leaf_ordering): mismas uniones,
+    alturas y filas que linkage_cacheado, solo cambia qué hijo se dibuja a la
+    izquierda. Cuesta O(n³) en el peor caso, así que se guarda con el linkage.
+    """
+    if huella is None:
+        huella = huella_matriz(matrix_df)
+    clave_optimo = clave("linkage_optimo", huella_muestras(matrix_df.index), metodo)
+    Z = cargar_array(huella, clave_optimo)
+    if Z is not None:
+        return Z
+
+    from scipy.cluster.hierarchy import optimal_leaf_ordering
+
+    Z = optimal_leaf_ordering(linkage_cacheado(matrix_df, metodo, huella), matrix_df.values,
+                              metric="euclidean")
+    guardar_array(huella, clave_optimo, Z)
+    return Z
+
+
+def asignaciones_cacheadas(matrix_df, metodo, huella=None):
+    """Matriz (n_muestras, K_MAX - K_MIN + 1); la columna j es el corte con K = K_MIN + j."""
+    if huella is None:
+        huella = huella_matriz(matrix_df)
+    claves = _claves_linkage(matrix_df, metodo, huella)
+    asignaciones = cargar_array(huella, claves["asignaciones"])
+    if asignaciones is None:
+        asignaciones = _asignaciones(linkage_cacheado(matrix_df, metodo, huella))
+        guardar_array(huella, claves["asignaciones"], asignaciones)
+    return asignaciones
@@ -0,0 +1,97 @@
+# calidad_clusters.py
+import numpy as np
+
+# =====================================================
+# Calidad de los clusters: correlación cofenética y silueta
+# =====================================================
+#
+# Para elegir método y K: la correlación cofenética mide cuánto respeta el
+# árbol las distancias de la matriz, y la silueta media mide la separación de
+# los clusters de cada corte K = K_MIN..K_MAX, siempre sobre la matriz de
+# distancias precalculada.
+#
+# La silueta de todos los K sale de un único recorrido por bloques de filas:
+# las asignaciones one-hot de todos los cortes se apilan en una matriz
+# (n, suma de K) y D[bloque] @ one-hot da, para cada muestra, la suma de sus
+# distancias a cada cluster de cada corte.
+
+BLOQUE_FILAS = 2048
+
+
+def one_hot_apilado(asignaciones):
+    """
+    asignaciones (n, n_cortes) con etiquetas 1..K de fcluster ->
+    (one-hot (n, total), primera columna de cada corte, columna propia (n, n_cortes)).
+    """
+    n, n_cortes = asignaciones.shape
+    n_clusters = asignaciones.max(axis=0).astype(np.int64)
+    desplazamiento = np.concatenate([[0], np.cumsum(n_clusters)[:-1]])
+    columnas = asignaciones.astype(np.int64) - 1 + desplazamiento
+    one_hot = np.zeros((n, int(n_clusters.sum())), dtype=np.float64)
+    np.put_along_axis(one_hot, columnas, 1.0, axis=1)
+    return one_hot, desplazamiento, columnas
+
+
+def siluetas(D, asignaciones, bloque=BLOQUE_FILAS):
+    """
+    Silueta media de cada columna de asignaciones (un corte por columna) con
+    la matriz de distancias D. Las muestras solas en su cluster cuentan 0,
+    como en sklearn.
+    """
+    D = np.asarray(D)
+    n, n_cortes = asignaciones.shape
+    one_hot, desplazamiento, columnas = one_hot_apilado(asignaciones)
+    tamanos = one_hot.sum(axis=0)
+
+    suma = np.zeros(n_cortes)
+    filas_todas = np.arange(n)
+    for ini in range(0, n, bloque):
+        fin = min(ini + bloque, n)
+        sumas = np.asarray(D[ini:fin], dtype=np.float64) @ one_hot  # (b, total)
+        propias = columnas[ini:fin]  # (b, n_cortes)
+        filas = filas_todas[: fin - ini, None]
+
+        tam_propio = tamanos[propias]
+        a = sumas[filas, propias] / np.maximum(tam_propio - 1, 1)
+
+        # b(i): la menor distancia media a otro cluster del mismo corte
+        medias = sumas / tamanos
+        medias[filas, propias] = np.inf
+        # Los clusters de cada corte son columnas contiguas: reduceat por corte
+        b = np.minimum.reduceat(medias, desplazamiento, axis=1)
+
+        s = np.where(np.isfinite(b), (b - a) / np.maximum(np.maximum(a, b), 1e-300), 0.0)
+        s[tam_propio <= 1] = 0.0
+        suma += s.sum(axis=0)
+    return suma / n
+
+
+def correlacion_cofenetica(D, Z):
+    """Correlación de Pearson entre las distancias cofenéticas de Z y las de D."""
+    from scipy.cluster.hierarchy import cophenet
+    from scipy.spatial.distance import squareform
+
+    condensada = squareform(np.asarray(D, dtype=np.float64), checks=False)
+    return float(np.corrcoef(cophenet(Z), condensada)[0, 1])
+
+
+def calidad_cacheada(matrix_df, metodo, huella=None):
+    """
+    Array [cofenética, silueta K_MIN, ..., silueta K_MAX] del método, guardado
+    en la caché de disco junto al linkage (calcula este si hace falta).
+    """
+    import cache_disco
+
+    if huella is None:
+        huella = cache_disco.huella_matriz(matrix_df)
+    clave_calidad = cache_disco.clave("calidad", cache_disco.huella_muestras(matrix_df.index), metodo)
+    calidad = cache_disco.cargar_array(huella, clave_calidad)
+    if calidad is not None:
+        return calidad
+
+    Z = cache_disco.linkage_cacheado(matrix_df, metodo, huella=huella)
+    asignaciones = cache_disco.asignaciones_cacheadas(matrix_df, metodo, huella=huella)
+    calidad = np.concatenate([[correlacion_cofenetica(matrix_df.values, Z)],
+                              siluetas(matrix_df.values, asignaciones)])
+    cache_disco.guardar_array(huella, clave_calidad, calidad)
+    return calidad
@@ -0,0 +1,119 @@
+# cofenetica.py
+import numpy as np
+
+# =====================================================
+# Distancias cofenéticas del árbol frente a las originales
+# =====================================================
+#
+# La distancia cofenética entre dos muestras es la altura de la unión en la
+# que el árbol las junta. Se guarda condensada en float32, en el mismo orden
+# que almacen_matrices (triángulo inferior por filas), y se calcula sin
+# recursión: en el orden de las hojas, la unión que junta las hojas p < q es
+# la más alta (la última fila de Z) de las que juntan vecinas k, k + 1 con
+# p <= k < q. Con el rango de la unión de cada par de vecinas, cada fila de la
+# matriz sale de dos np.maximum.accumulate desde la posición de la muestra:
+# O(n) por fila y sin arrays n × n auxiliares.
+#
+# Para dibujar, original y cofenética se agregan por franjas de hojas con
+# fuera_de_memoria.heatmap_agregado (la original se lee de la matriz publicada
+# en memoria compartida). Las alturas del linkage están en otra escala que las
+# distancias (filas como observaciones euclídeas), así que el residuo es
+# original - (α + β · cofenética), con α y β ajustados por mínimos cuadrados
+# sobre las franjas, ponderadas por su número de pares.
+
+CELDAS = 400
+
+
+def cofenetica(Z, progreso=None):
+    """Distancias cofenéticas de Z, condensadas (orden de almacen_matrices) en float32."""
+    import corte_dinamico
+
+    n = len(Z) + 1
+    orden, inicio = corte_dinamico.orden_hojas(Z)
+    hijos = Z[:, :2].astype(np.int64)
+    tamano_izquierdo = np.where(hijos[:, 0] < n, 1, Z[np.maximum(hijos[:, 0] - n, 0), 3]).astype(np.int64)
+    # rango[k] = fila de Z de la unión que junta las hojas vecinas k y k + 1
+    rango = np.empty(n - 1, dtype=np.int64)
+    rango[inicio[n:] + tamano_izquierdo - 1] = np.arange(n - 1)
+    alturas = Z[:, 2].astype(np.float32)
+    posicion = np.empty(n, dtype=np.int64)
+    posicion[orden] = np.arange(n)
+
+    C = np.empty(n * (n - 1) // 2, dtype=np.float32)
+    fila = np.empty(n, dtype=np.int64)
+    for x in range(1, n):
+        p = posicion[x]
+        fila[p + 1:] = np.maximum.accumulate(rango[p:])
+        fila[:p] = np.maximum.accumulate(rango[:p][::-1])[::-1]
+        C[x * (x - 1) // 2:x * (x + 1) // 2] = alturas[fila[posicion[:x]]]
+        if progreso and x % 2000 == 0:
+            progreso(x / n, f"Cofenética: {x}/{n} filas")
+    return C
+
+
+def cofenetica_cacheada(Z, muestras, huella, progreso=None):
+    """cofenetica(Z) guardada en la caché de disco junto al linkage."""
+    import cache_disco
+
+    clave_cofenetica = cache_disco.clave("cofenetica", cache_disco.huella_muestras(muestras),
+                                         cache_disco.huella_array(Z))
+    C = cache_disco.cargar_array(huella, clave_cofenetica)
+    if C is None:
+        C = cofenetica(Z, progreso=progreso)
+        cache_disco.guardar_array(huella, clave_cofenetica, C)
+    return C
+
+
+def _pares_por_celda(hojas, celdas):
+    # Pares (ordenados) que promedia cada celda de heatmap_agregado
+    m = len(hojas)
+    tamanos = np.bincount(np.arange(m) * celdas // m, minlength=celdas).astype(np.float64)
+    pares = np.outer(tamanos, tamanos)
+    np.fill_diagonal(pares, tamanos * (tamanos - 1))
+    return pares
+
+
+def comparar(referencia, posiciones, Z, Z_orden, huella, celdas=CELDAS, progreso=None):
+    """
+    En un proceso del pool. referencia/posiciones: matriz publicada con
+    memoria_compartida y filas de la submatriz en ella; Z: linkage de la
+    submatriz; Z_orden: el mismo árbol con el orden de hojas de la figura.
+    Devuelve {"original", "cofenetica" (escalada), "residuo", "alfa", "beta"}.
+    """
+    import fuera_de_memoria
+    import memoria_compartida
+    import corte_dinamico
+
+    escala = lambda a, b: (lambda f, m: progreso(a + (b - a) * f, m)) if progreso else None
+    hojas, _ = corte_dinamico.orden_hojas(Z_orden)
+    m = len(hojas)
+    celdas = min(celdas, m)
+
+    with memoria_compartida.adjuntar(referencia) as arrays:
+        C = cofenetica_cacheada(Z, arrays["muestras"][posiciones], huella, progreso=escala(0.0, 0.5))
+        agregada_C = fuera_de_memoria.heatmap_agregado(C, m, hojas, celdas=celdas,
+                                                       progreso=escala(0.5, 0.7))
+        del C
+        # heatmap_agregado recorre la selección en orden creciente
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        orden = np.argsort(posiciones, kind="stable")
+        en_seleccion = np.empty(m, dtype=np.int64)
+        en_seleccion[orden] = np.arange(m)
+        agregada_D = fuera_de_memoria.heatmap_agregado(
+            arrays["distancias"], len(arrays["muestras"]), en_seleccion[hojas], posiciones[orden],
+            celdas=celdas, progreso=escala(0.7, 0.95))
+
+    pesos = _pares_por_celda(hojas, celdas)
+    x = agregada_C.astype(np.float64)
+    y = agregada_D.astype(np.float64)
+    media_x = np.average(x, weights=pesos)
+    media_y = np.average(y, weights=pesos)
+    varianza = np.average((x - media_x) ** 2, weights=pesos)
+    beta = np.average((x - media_x) * (y - media_y), weights=pesos) / varianza if varianza > 0 else 0.0
+    alfa = media_y - beta * media_x
+    ajustada = alfa + beta * x
+    # La diagonal de franjas de una sola muestra no tiene pares
+    sin_pares = pesos == 0
+    ajustada[sin_pares] = y[sin_pares]
+    return {"original": agregada_D, "cofenetica": ajustada.astype(np.float32),
+            "residuo": (y - ajustada).astype(np.float32), "alfa": float(alfa), "beta": float(beta)}
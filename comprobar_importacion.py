@@ -0,0 +1,69 @@
+# comprobar_importacion.py
+import os
+import sys
+import subprocess
+
+# =====================================================
+# Presupuesto de tiempo de importación de la interfaz
+# =====================================================
+#
+# Importa los módulos que carga app.py al arrancar en un intérprete limpio con
+# "python -X importtime" y falla (código de salida 1) si:
+#   - la suma de sus tiempos acumulados supera el presupuesto, o
+#   - alguno arrastra una librería pesada que debería importarse más tarde.
+#
+#     python comprobar_importacion.py            # presupuesto por defecto
+#     python comprobar_importacion.py 150        # presupuesto en ms
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODULOS_UI = ["generar_clustermap", "dendrograma_clusters", "datos", "trabajos", "precalentamiento"]
+PESADOS = ["pandas", "numpy", "scipy", "seaborn", "matplotlib"]
+PRESUPUESTO_MS = float(os.environ.get("CLUSTERMAP_PRESUPUESTO_IMPORT_MS", "100"))
+
+
+def medir_importacion(modulos=MODULOS_UI):
+    """
+    Devuelve ({modulo: ms acumulados}, set de módulos de primer nivel importados)
+    según la salida de -X importtime.
+    """
+    codigo = "import " + ", ".join(modulos)
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True,
+    )
+    tiempos = {}
+    importados = set()
+    for linea in res.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        _, acumulado, nombre = linea.split("|")
+        if not acumulado.strip().isdigit():
+            continue  # cabecera
+        importados.add(nombre.strip().split(".")[0])
+        # Sin sangría = importado directamente por el código de la prueba
+        if nombre.startswith(" ") and not nombre.startswith("  "):
+            tiempos[nombre.strip()] = int(acumulado) / 1000
+    return tiempos, importados
+
+
+def main(presupuesto_ms=PRESUPUESTO_MS):
+    tiempos, importados = medir_importacion()
+    total = sum(tiempos.get(m, 0.0) for m in MODULOS_UI)
+    for modulo in MODULOS_UI:
+        print(f"{modulo:25s} {tiempos.get(modulo, 0.0):8.1f} ms")
+    print(f"{'total':25s} {total:8.1f} ms (presupuesto {presupuesto_ms:.0f} ms)")
+
+    errores = []
+    if total > presupuesto_ms:
+        errores.append(f"la importación tarda {total:.1f} ms, más que el presupuesto de {presupuesto_ms:.0f} ms")
+    pesados = sorted(importados.intersection(PESADOS))
+    if pesados:
+        errores.append(f"se importan librerías pesadas al arrancar: {', '.join(pesados)}")
+    for error in errores:
+        print(f"ERROR: {error}", file=sys.stderr)
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else PRESUPUESTO_MS))
@@ -0,0 +1,192 @@
+# comunidades.py
+import numpy as np
+
+# =====================================================
+# Comunidades del grafo de k vecinos (Louvain)
+# =====================================================
+#
+# Para conjuntos muy grandes, en lugar de un árbol sobre la matriz completa:
+#   1. grafo de k vecinos más cercanos, construido por bloques de filas
+#      (vecinos.construir_indice_filas), así que basta con leer la matriz por
+#      trozos, por ejemplo del triángulo condensado de un almacén .matriz;
+#      el grafo se simetriza (peso 2 si el vecindario es mutuo) y se guarda
+#      como CSR, con n·k aristas como mucho;
+#   2. Louvain sobre el CSR: fase local (cada nodo pasa a la comunidad vecina
+#      que más aumenta la modularidad, en orden aleatorio, hasta que nadie se
+#      mueve) y agregación de cada comunidad en un nodo con P^T A P, repetidas
+#      mientras la partición cambie. La fase local recorre el CSR con listas
+#      de Python (los vecindarios son de unas decenas de nodos, donde cada
+#      llamada a numpy cuesta más que el propio cálculo).
+# La resolución γ de la modularidad controla el tamaño: mayor γ, comunidades
+# más pequeñas.
+
+K_GRAFO = 15
+RESOLUCION = 1.0
+SEMILLA = 0
+
+
+def grafo_knn(indices, n=None):
+    """Índice de vecinos (n, k) -> matriz de adyacencia CSR simétrica."""
+    from scipy.sparse import csr_matrix
+
+    n = len(indices) if n is None else n
+    filas = np.repeat(np.arange(len(indices)), indices.shape[1])
+    A = csr_matrix((np.ones(len(filas)), (filas, indices.ravel())), shape=(n, n))
+    return (A + A.T).tocsr()
+
+
+def _fase_local(A, resolucion, rng):
+    """
+    Movimientos locales de Louvain con cola (como la fase rápida de Leiden):
+    tras la primera pasada solo se revisan los vecinos de los nodos que
+    cambiaron de comunidad. Devuelve la comunidad de cada nodo.
+    """
+    from collections import deque
+
+    n = A.shape[0]
+    indptr = A.indptr.tolist()
+    indices = A.indices.tolist()
+    pesos = A.data.tolist()
+    grado = np.asarray(A.sum(axis=1)).ravel()
+    escala = resolucion / grado.sum()
+    grado = grado.tolist()
+    comunidad = list(range(n))
+    total = list(grado)
+
+    cola = deque(rng.permutation(n).tolist())
+    en_cola = [True] * n
+    while cola:
+        i = cola.popleft()
+        en_cola[i] = False
+        actual = comunidad[i]
+        gi = grado[i]
+        total[actual] -= gi
+        # Peso hacia cada comunidad vecina (los lazos se mueven con el nodo)
+        hacia = {}
+        for p in range(indptr[i], indptr[i + 1]):
+            j = indices[p]
+            if j != i:
+                c = comunidad[j]
+                hacia[c] = hacia.get(c, 0.0) + pesos[p]
+        nueva = actual
+        mejor = hacia.get(actual, 0.0) - escala * total[actual] * gi
+        for c, w in hacia.items():
+            ganancia = w - escala * total[c] * gi
+            if ganancia > mejor + 1e-12:
+                mejor = ganancia
+                nueva = c
+        comunidad[i] = nueva
+        total[nueva] += gi
+        if nueva != actual:
+            for p in range(indptr[i], indptr[i + 1]):
+                j = indices[p]
+                if not en_cola[j] and comunidad[j] != nueva:
+                    en_cola[j] = True
+                    cola.append(j)
+    return np.array(comunidad)
+
+
+def modularidad(A, etiquetas, resolucion=RESOLUCION):
+    from scipy.sparse import csr_matrix
+
+    _, codigos = np.unique(etiquetas, return_inverse=True)
+    P = csr_matrix((np.ones(len(codigos)), (np.arange(len(codigos)), codigos)))
+    grado = np.asarray(A.sum(axis=1)).ravel()
+    m2 = grado.sum()
+    dentro = (P.T @ A @ P).diagonal()
+    total = P.T @ grado
+    return float(dentro.sum() / m2 - resolucion * ((total / m2) ** 2).sum())
+
+
+def louvain(A, resolucion=RESOLUCION, semilla=SEMILLA, progreso=None):
+    """
+    Etiquetas (n,) 1..k (por tamaño decreciente) de las comunidades del
+    grafo A (CSR simétrica con pesos).
+    """
+    from scipy.sparse import csr_matrix
+
+    rng = np.random.default_rng(semilla)
+    n = A.shape[0]
+    etiquetas = np.arange(n)
+    nivel = 0
+    while True:
+        nivel += 1
+        comunidad = _fase_local(A, resolucion, rng)
+        _, comunidad = np.unique(comunidad, return_inverse=True)
+        c = comunidad.max() + 1
+        if progreso:
+            progreso(min(0.2 + 0.2 * nivel, 0.95), f"Louvain: nivel {nivel}, {c} comunidades")
+        if c == A.shape[0]:
+            break
+        etiquetas = comunidad[etiquetas]
+        # Cada comunidad pasa a ser un nodo; los pesos internos quedan como lazo
+        P = csr_matrix((np.ones(len(comunidad)), (np.arange(len(comunidad)), comunidad)),
+                       shape=(len(comunidad), c))
+        A = (P.T @ A @ P).tocsr()
+
+    _, codigos, cuentas = np.unique(etiquetas, return_inverse=True, return_counts=True)
+    rango = np.empty(len(cuentas), dtype=np.int32)
+    rango[np.argsort(-cuentas, kind="stable")] = np.arange(1, len(cuentas) + 1)
+    return rango[codigos]
+
+
+def comunidades_filas(leer_filas, n, k=K_GRAFO, resolucion=RESOLUCION, semilla=SEMILLA,
+                      progreso=None):
+    """Grafo kNN leyendo la matriz por bloques y Louvain sobre él."""
+    import vecinos
+
+    indices, _ = vecinos.construir_indice_filas(
+        leer_filas, n, k,
+        progreso=(lambda f, m: progreso(0.2 * f, m)) if progreso else None)
+    return louvain(grafo_knn(indices), resolucion, semilla, progreso=progreso)
+
+
+def comunidades_almacen(ruta, k=K_GRAFO, resolucion=RESOLUCION, semilla=SEMILLA, progreso=None,
+                        seleccion=None, memoria_mb=None):
+    """
+    Comunidades de un almacén .matriz sin cargar la matriz completa, guardadas
+    en la caché de disco. Con 'seleccion' (posiciones en el almacén), las del
+    subgrupo, en el orden de la selección. memoria_mb limita cada bloque de
+    filas como en fuera_de_memoria.
+    """
+    import os
+    import almacen_matrices
+    import cache_disco
+    import fuera_de_memoria
+    import vecinos
+
+    huella = cache_disco.huella_archivo(os.path.join(ruta, "distancias.bin"))
+    clave_comunidades = cache_disco.clave(
+        "louvain_disco", None if seleccion is None else cache_disco.huella_array(np.asarray(seleccion)),
+        k, resolucion, semilla)
+    etiquetas = cache_disco.cargar_array(huella, clave_comunidades)
+    if etiquetas is None:
+        bloque = vecinos.BLOQUE_ALMACEN
+        if memoria_mb is not None:
+            n = almacen_matrices.leer_meta(ruta)["n"]
+            # almacen_matrices.leer_filas crea por celda unas dos veces los
+            # temporales de un tramo de fuera_de_memoria.recorrer
+            bloque = fuera_de_memoria.filas_por_tramo(n, memoria_mb / 2)
+        indices, _ = vecinos.indice_almacen(
+            ruta, k, bloque, progreso=(lambda f, m: progreso(0.2 * f, m)) if progreso else None,
+            seleccion=seleccion)
+        etiquetas = louvain(grafo_knn(indices), resolucion, semilla, progreso=progreso)
+        cache_disco.guardar_array(huella, clave_comunidades, etiquetas)
+    return etiquetas
+
+
+def comunidades_cacheadas(matrix_df, k=K_GRAFO, resolucion=RESOLUCION, huella=None,
+                          progreso=None):
+    import cache_disco
+
+    if huella is None:
+        huella = cache_disco.huella_matriz(matrix_df)
+    clave_comunidades = cache_disco.clave("louvain", cache_disco.huella_muestras(matrix_df.index),
+                                          k, resolucion, SEMILLA)
+    etiquetas = cache_disco.cargar_array(huella, clave_comunidades)
+    if etiquetas is None:
+        valores = matrix_df.values
+        etiquetas = comunidades_filas(lambda ini, fin: valores[ini:fin], len(valores), k,
+                                      resolucion, progreso=progreso)
+        cache_disco.guardar_array(huella, clave_comunidades, etiquetas)
+    return etiquetas
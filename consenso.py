@@ -0,0 +1,72 @@
+# consenso.py
+
+# =====================================================
+# Consenso entre matrices de varios compartimentos
+# =====================================================
+#
+# Las mismas muestras se perfilan en varios compartimentos celulares
+# (tumorales, mieloides, linfoides, no tumorales), cada uno con su matriz.
+# Se alinean las matrices por el identificador limpio de la muestra
+# (clean_filename), se agrupa cada una por separado y la matriz de
+# co-clustering cuenta, para cada par de muestras, la fracción de
+# (matriz, K) en que caen en el mismo cluster. La app trabaja después con
+# 1 - consenso como si fuera una matriz de distancias más.
+
+
+def alinear(matrices):
+    """
+    {nombre: DataFrame con índices ya limpios} -> mismas matrices restringidas
+    a las muestras comunes, en el orden de la primera. Si la limpieza deja
+    nombres repetidos en una matriz, se queda la primera aparición.
+    """
+    unicas = {}
+    for nombre, df in matrices.items():
+        df = df.loc[~df.index.duplicated(), ~df.columns.duplicated()]
+        unicas[nombre] = df
+    primera = next(iter(unicas.values()))
+    comunes = set(primera.index)
+    for df in unicas.values():
+        comunes &= set(df.index)
+    orden = [s for s in primera.index if s in comunes]
+    return {nombre: df.loc[orden, orden] for nombre, df in unicas.items()}
+
+
+def coclustering(asignaciones):
+    """
+    Lista de arrays (n, cortes) con etiquetas de fcluster (un corte por
+    columna, como asignaciones_cacheadas) -> matriz (n, n) con la fracción de
+    cortes en que cada par comparte cluster. Todos los cortes de todas las
+    matrices se apilan en un único one-hot y el conteo es un producto de
+    matrices.
+    """
+    import numpy as np
+    import calidad_clusters
+
+    apiladas = np.concatenate(asignaciones, axis=1)
+    one_hot, _, _ = calidad_clusters.one_hot_apilado(apiladas)
+    return (one_hot @ one_hot.T) / apiladas.shape[1]
+
+
+def matriz_consenso(gestor, grupo, matrices, metodo, ks, al_progresar=None):
+    """
+    Agrupa cada matriz alineada en un trabajo del gestor (en paralelo) y
+    devuelve el DataFrame 1 - co-clustering para los K de 'ks'.
+    """
+    import pandas as pd
+    import cache_disco
+    import trabajos
+
+    pendientes = []
+    for nombre, df in matrices.items():
+        huella = cache_disco.huella_matriz(df)
+        pendientes.append(gestor.enviar((*grupo, nombre), (huella, metodo),
+                                        trabajos.tarea_asignaciones, df, metodo, huella=huella))
+    gestor.esperar_todos(pendientes, al_progresar=al_progresar, unidad="matrices")
+    fallidos = [t.error or "cancelado" for t in pendientes if t.estado != "terminado"]
+    if fallidos:
+        raise RuntimeError(fallidos[0])
+
+    columnas = [k - cache_disco.K_MIN for k in ks]
+    consenso = coclustering([t.resultado[:, columnas] for t in pendientes])
+    muestras = next(iter(matrices.values())).index
+    return pd.DataFrame(1.0 - consenso, index=muestras, columns=muestras)
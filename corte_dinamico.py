@@ -0,0 +1,133 @@
+# corte_dinamico.py
+import numpy as np
+
+# =====================================================
+# Corte dinámico del árbol (estilo dynamic tree cut)
+# =====================================================
+#
+# fcluster(Z, K, "maxclust") corta todo el árbol a una misma altura; con
+# ramas anidadas y de densidad muy distinta eso parte las compactas o une las
+# difusas. Aquí cada rama se corta a su propia altura, con los criterios de
+# forma de Langfelder et al. (dynamicTreeCut, método híbrido):
+#   - tamaño mínimo del cluster,
+#   - dispersión del núcleo (altura media de las uniones dentro de la rama)
+#     por debajo de un máximo,
+#   - hueco entre esa dispersión y la altura a la que la rama se une a otra
+#     por encima de un mínimo.
+# Máximo y mínimo se expresan relativos al rango de alturas y salen de
+# deep_split (0 = pocos clusters grandes, 4 = muchos pequeños).
+#
+# Las uniones se recorren una vez en el orden de Z (de abajo arriba), con las
+# estadísticas de cada subárbol en arrays indexados por nodo. Al unirse dos
+# ramas:
+#   - si las dos cumplen los criterios, las dos quedan cerradas como clusters;
+#   - si una los cumple y la otra es menor que el tamaño mínimo, la pequeña
+#     se absorbe y la rama sigue creciendo;
+#   - si una los cumple y la otra es grande pero no, se cierra la primera y
+#     las muestras de la otra quedan sin asignar (etiqueta 0);
+#   - si ninguna los cumple, siguen creciendo juntas.
+# Cada subárbol ocupa un tramo contiguo en el orden de las hojas, así que las
+# etiquetas finales se escriben por tramos.
+
+DEEP_SPLIT = 2
+TAMANO_MINIMO = 20
+# Dispersión máxima del núcleo (relativa) para cada deep_split; el hueco
+# mínimo es 3/4 de lo que queda hasta 1, como en dynamicTreeCut
+DISPERSION_MAXIMA = [0.64, 0.73, 0.82, 0.91, 0.95]
+ALTURA_CORTE = 0.99
+
+
+def orden_hojas(Z):
+    """
+    (orden de las hojas, inicio del tramo de cada nodo en ese orden). Mismo
+    orden que leaves_list(Z) y el dendrograma de scipy: el hijo Z[i, 0] va a
+    la izquierda.
+    """
+    n = len(Z) + 1
+    hijos = Z[:, :2].astype(np.int64)
+    tamanos = np.ones(2 * n - 1, dtype=np.int64)
+    tamanos[n:] = Z[:, 3].astype(np.int64)
+    inicio = np.zeros(2 * n - 1, dtype=np.int64)
+    for i in range(n - 2, -1, -1):
+        a, b = hijos[i]
+        inicio[a] = inicio[n + i]
+        inicio[b] = inicio[n + i] + tamanos[a]
+    orden = np.empty(n, dtype=np.int64)
+    orden[inicio[:n]] = np.arange(n)
+    return orden, inicio
+
+
+def corte_dinamico(Z, deep_split=DEEP_SPLIT, tamano_minimo=TAMANO_MINIMO,
+                   altura_corte=None):
+    """
+    Etiquetas (n,) con los clusters del corte dinámico: 1..k numerados de
+    izquierda a derecha en el dendrograma, 0 para las muestras sin asignar.
+    altura_corte: por encima no se une nada (por defecto, el 99 % del rango
+    de alturas).
+    """
+    n = len(Z) + 1
+    alturas = Z[:, 2]
+    minima = float(alturas.min())
+    if altura_corte is None:
+        altura_corte = minima + ALTURA_CORTE * (float(alturas.max()) - minima)
+    rango = altura_corte - minima
+    relativa = DISPERSION_MAXIMA[int(np.clip(deep_split, 0, len(DISPERSION_MAXIMA) - 1))]
+    dispersion_maxima = minima + relativa * rango
+    hueco_minimo = (1 - relativa) * 0.75 * rango
+
+    hijos = Z[:, :2].astype(np.int64)
+    tamanos = np.ones(2 * n - 1, dtype=np.int64)
+    tamanos[n:] = Z[:, 3].astype(np.int64)
+    # Suma de las alturas de las uniones de cada subárbol (núcleo = media)
+    suma_alturas = np.zeros(2 * n - 1)
+    abierta = np.ones(2 * n - 1, dtype=bool)
+    cerrados = []
+
+    def cumple(nodo, altura):
+        if tamanos[nodo] < tamano_minimo:
+            return False
+        nucleo = suma_alturas[nodo] / max(tamanos[nodo] - 1, 1)
+        return nucleo <= dispersion_maxima and altura - nucleo >= hueco_minimo
+
+    for i in range(n - 1):
+        a, b = hijos[i]
+        h = alturas[i]
+        nodo = n + i
+        suma_alturas[nodo] = suma_alturas[a] + suma_alturas[b] + h
+        abierta[nodo] = False
+        if h > altura_corte:
+            # Por encima del corte: las ramas abiertas que llegan aquí se
+            # cierran si son grandes y compactas (sin exigir hueco)
+            for hijo in (a, b):
+                if abierta[hijo] and cumple(hijo, np.inf):
+                    cerrados.append(hijo)
+            continue
+        if abierta[a] and abierta[b]:
+            ca, cb = cumple(a, h), cumple(b, h)
+            if ca and cb:
+                cerrados += [a, b]
+            elif ca and tamanos[b] >= tamano_minimo:
+                cerrados.append(a)
+            elif cb and tamanos[a] >= tamano_minimo:
+                cerrados.append(b)
+            else:
+                abierta[nodo] = True
+        else:
+            # Una de las ramas ya contiene clusters: la otra se cierra si vale
+            for hijo in (a, b):
+                if abierta[hijo] and cumple(hijo, h):
+                    cerrados.append(hijo)
+
+    # Todo el árbol quedó en una sola rama abierta
+    raiz = 2 * n - 2
+    if abierta[raiz] and tamanos[raiz] >= tamano_minimo:
+        cerrados.append(raiz)
+
+    orden, inicio = orden_hojas(Z)
+    cerrados = np.array(sorted(cerrados, key=lambda c: inicio[c]), dtype=np.int64)
+    en_orden = np.zeros(n, dtype=np.int32)
+    for etiqueta, c in enumerate(cerrados, start=1):
+        en_orden[inicio[c]:inicio[c] + tamanos[c]] = etiqueta
+    etiquetas = np.empty(n, dtype=np.int32)
+    etiquetas[orden] = en_orden
+    return etiquetas
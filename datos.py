@@ -0,0 +1,147 @@
+# datos.py
+import os
+
+# pandas, numpy y la caché se importan dentro de cada función: este módulo se
+# carga al arrancar la interfaz y no debe retrasar el primer widget
+
+# =====================================================
+# Rutas de los archivos precargados
+# =====================================================
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+PRELOADED_MATRIX_DIR = os.path.join(DATA_DIR, "matrices")
+PRELOADED_METADATA_DIR = os.path.join(DATA_DIR, "anotaciones")
+
+METODOS = ["average", "ward", "single", "complete", "median"]
+SUBGRUPOS = ["Todos", "Carcinoma", "Dysplasia", "Stroma-ad",
+             "Carcinoma + Dysplasia", "Fanconi", "No Fanconi"]
+
+
+def listar_matrices(carpeta=PRELOADED_MATRIX_DIR):
+    """CSV y almacenes binarios (.matriz) ya completos de la carpeta."""
+    import almacen_matrices
+
+    if not os.path.isdir(carpeta):
+        return []
+    matrices = []
+    for f in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, f)
+        if f.endswith(".csv"):
+            matrices.append(f)
+        elif f.endswith(almacen_matrices.EXTENSION) and almacen_matrices.es_almacen(ruta):
+            if almacen_matrices.leer_meta(ruta).get("completa"):
+                matrices.append(f)
+    return sorted(matrices)
+
+def version_matriz(ruta):
+    """
+    Valor que cambia cuando cambia el contenido de la matriz: la fecha del CSV
+    o, en un almacén .matriz, la huella de su distancias.bin (la fecha de la
+    carpeta no cambia al reescribir el archivo de dentro).
+    """
+    import almacen_matrices
+
+    if almacen_matrices.es_almacen(ruta):
+        import cache_disco
+
+        return cache_disco.huella_archivo(os.path.join(ruta, "distancias.bin"))
+    return os.path.getmtime(ruta)
+
+# =====================================================
+# Lectura de matrices
+# =====================================================
+
+def leer_matriz(ruta):
+    """
+    Lee una matriz CSV de un archivo en disco. El resultado del parseo se guarda
+    en la caché de disco (valores + etiquetas), identificado por ruta, tamaño y
+    fecha, de modo que solo se parsea el CSV la primera vez. Los almacenes
+    binarios (.matriz) se leen directamente.
+    """
+    import numpy as np
+    import pandas as pd
+    import almacen_matrices
+    import cache_disco
+
+    if almacen_matrices.es_almacen(ruta):
+        return almacen_matrices.a_dataframe(ruta)
+
+    huella = cache_disco.huella_archivo(ruta)
+    claves = {nombre: cache_disco.clave("csv", nombre) for nombre in ("valores", "filas", "columnas")}
+
+    valores = cache_disco.cargar_array(huella, claves["valores"])
+    filas = cache_disco.cargar_array(huella, claves["filas"])
+    columnas = cache_disco.cargar_array(huella, claves["columnas"])
+    if valores is not None and filas is not None and columnas is not None:
+        return pd.DataFrame(valores, index=filas.tolist(), columns=columnas.tolist())
+
+    df = pd.read_csv(ruta, index_col=0)
+    cache_disco.guardar_array(huella, claves["filas"], np.asarray(df.index, dtype=str))
+    cache_disco.guardar_array(huella, claves["columnas"], np.asarray(df.columns, dtype=str))
+    cache_disco.guardar_array(huella, claves["valores"], df.values)
+    return df
+
+# =====================================================
+# Anotaciones y subgrupos
+# =====================================================
+
+def leer_csv_subido(archivo):
+    """Matriz desde un archivo subido (sin caché: no tiene ruta estable)."""
+    import pandas as pd
+    return pd.read_csv(archivo, index_col=0)
+
+
+def leer_metadata(origen):
+    """Metadatos desde una ruta o un archivo subido."""
+    import pandas as pd
+    return pd.read_csv(origen)
+
+
+def preparar_datos(df, metadata, mod):
+    """
+    Limpia los nombres de la matriz con los helpers del módulo elegido y arma
+    la tabla de anotaciones. metadata puede ser None (solo las anotaciones
+    que salen del nombre de archivo).
+    """
+    import cache_disco
+
+    cleaned = [mod.clean_filename(i) for i in df.index]
+    df.index = cleaned
+    df.columns = cleaned
+
+    return {
+        "df": df,
+        "annotations": anotaciones(cleaned, metadata, mod),
+        "huella": cache_disco.huella_matriz(df),
+    }
+
+
+def anotaciones(cleaned, metadata, mod):
+    """Tabla de anotaciones de unas muestras con nombres ya limpios."""
+    import pandas as pd
+
+    annotations = pd.DataFrame(index=cleaned)
+    annotations["Tipo"] = [mod.get_sample_type(n) for n in cleaned]
+    annotations["Fanconi"] = [mod.get_fanconi_status(n) for n in cleaned]
+    annotations["Grado displasia"] = [mod.get_grado_displasia(n) for n in cleaned]
+
+    if metadata is not None:
+        metadata["Sample"] = metadata["Archivo"].apply(mod.clean_filename)
+        metadata = metadata.set_index("Sample")
+        for col in ["Condition", "Gender", "Tumor stage", "BMT", "Desmoplastic category"]:
+            if col in metadata.columns:
+                annotations[col] = metadata.reindex(cleaned)[col]
+    return annotations
+
+
+def definir_subgrupos(cleaned, annotations):
+    return {
+        "Todos": cleaned,
+        "Carcinoma": [s for s in cleaned if annotations.loc[s, "Tipo"] == "carcinoma"],
+        "Dysplasia": [s for s in cleaned if annotations.loc[s, "Tipo"] == "dysplasia"],
+        "Stroma-ad": [s for s in cleaned if "stroma" in annotations.loc[s, "Tipo"]],
+        "Carcinoma + Dysplasia": [s for s in cleaned if annotations.loc[s, "Tipo"] in ["carcinoma", "dysplasia"]],
+        "Fanconi": [s for s in cleaned if annotations.loc[s, "Fanconi"] == "Fanconi"],
+        "No Fanconi": [s for s in cleaned if annotations.loc[s, "Fanconi"] == "No Fanconi"]
+    }
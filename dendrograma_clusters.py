@@ -1,10 +1,8 @@
 # dendrograma_clusters.py
 import os
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-from scipy.cluster.hierarchy import dendrogram, linkage, fcluster
+
+# pandas, seaborn, matplotlib y scipy se importan dentro de las funciones de
+# dibujo: la interfaz solo necesita los helpers y las paletas al arrancar
 
 # =====================================================
 # Funciones auxiliares
@@ -95,16 +93,69 @@ color_palettes = {
     'Grado displasia': grado_colors
 }
 
+# Barra extra con la muestra buscada y sus vecinos más cercanos
+resaltado_colors = {'Consulta': '#000000', 'Vecino': '#FF7F00'}
+
+def resaltado_column(samples, resaltar):
+    """Colores de la barra 'Vecinos': resaltar[0] es la consulta, el resto sus vecinos."""
+    vecinos = set(resaltar[1:])
+    return [resaltado_colors['Consulta'] if s == resaltar[0]
+            else resaltado_colors['Vecino'] if s in vecinos else '#FFFFFF'
+            for s in samples]
+
+# Barras extra con clusters calculados fuera del árbol (densidad.py,
+# comunidades.py): etiquetas 1..k, y 0 = ruido o sin asignar
+ruido_color = '#D9D9D9'
+
+def clusters_palette(etiquetas):
+    """
+    {'Ruido': gris (si hay), 'C1': color, ...} para unas etiquetas 0..k.
+    Hasta 20 clusters, tab20; con más, k tonos husl para que no se repitan.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
+    import seaborn as sns
+
+    k = int(max(etiquetas, default=0))
+    colores = ([plt.get_cmap("tab20")(i) for i in range(k)] if k <= 20
+               else sns.color_palette("husl", k))
+    palette = {'Ruido': ruido_color} if min(etiquetas, default=0) == 0 else {}
+    for i, color in enumerate(colores, start=1):
+        palette[f'C{i}'] = mcolors.to_hex(color)
+    return palette
+
+def clusters_column(etiquetas):
+    palette = clusters_palette(etiquetas)
+    return [palette[f'C{e}'] if e > 0 else palette['Ruido'] for e in etiquetas]
+
 # =====================================================
 # Función principal
 # =====================================================
 
 def plot_dendrograma(matrix_df, annotations_df, selected_annotations=None,
-                      metodo="average", K=4, figsize=(14,12), xticklabels=False, yticklabels=False):
+                      metodo="average", K=4, figsize=(14,12), xticklabels=False, yticklabels=False,
+                      Z=None, resaltar=None, soporte=None, clusters=None,
+                      barras_clusters=None):
     """
     Dendrograma superior con barras de color (col_colors) y clusters coloreados,
     sin mostrar heatmap, basado en el método de tu clustermap original.
+    Si se pasa Z (linkage ya calculado) no se vuelve a calcular.
+    resaltar: [consulta, vecino1, ...] añade una barra 'Vecinos' que los marca.
+    soporte: soporte bootstrap de cada fila de Z (estabilidad.py); se escribe
+    en porcentaje sobre las uniones más altas.
+    clusters: etiquetas por muestra de un corte a altura variable
+    (corte_dinamico.py; 0 = sin asignar) en lugar de fcluster con K.
+    barras_clusters: {título: etiquetas por muestra} de agrupaciones
+    externas al árbol (HDBSCAN, Louvain); cada una añade una barra, con el
+    ruido en gris.
     """
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
+    from scipy.cluster.hierarchy import dendrogram, fcluster
+    import cache_disco
+
     # ------------------------
     # Preparar samples
     # ------------------------
@@ -117,13 +168,22 @@ def plot_dendrograma(matrix_df, annotations_df, selected_annotations=None,
     for ann in selected_annotations:
         palette = color_palettes[ann]
         col_colors_dict[ann] = [palette.get(annotations_df.loc[s, ann], "#FFFFFF") for s in samples]
+    if resaltar:
+        col_colors_dict["Vecinos"] = resaltado_column(samples, resaltar)
+    for titulo, etiquetas in (barras_clusters or {}).items():
+        col_colors_dict[titulo] = clusters_column(etiquetas)
     col_colors = pd.DataFrame(col_colors_dict, index=samples)
     
     # ------------------------
     # Linkage y clusters
     # ------------------------
-    Z = linkage(matrix_df.values, method=metodo)
-    clusters = fcluster(Z, K, criterion="maxclust")
+    if Z is None:
+        Z = cache_disco.linkage_cacheado(matrix_df, metodo)
+    corte_fijo = clusters is None
+    if corte_fijo:
+        clusters = fcluster(Z, K, criterion="maxclust")
+    else:
+        K = max(int(clusters.max()), 1)
     
     viridis = plt.get_cmap("viridis", K)
     cluster_colors = {i+1: mcolors.to_hex(viridis(i)) for i in range(K)}
@@ -147,7 +207,7 @@ def plot_dendrograma(matrix_df, annotations_df, selected_annotations=None,
             c = leaf_cluster_map[node_id]
         else:
             c = node_cluster_map.get(node_id)
-        return cluster_colors[c] if c is not None else "black"
+        return cluster_colors.get(c, "black")
 
     # ------------------------
     # Crear clustermap para barras de color
@@ -156,6 +216,8 @@ def plot_dendrograma(matrix_df, annotations_df, selected_annotations=None,
         matrix_df,
         method=metodo,
         metric="euclidean",
+        row_linkage=Z,
+        col_linkage=Z,
         col_colors=col_colors,
         cmap="gray",
         figsize=figsize
@@ -183,9 +245,13 @@ def plot_dendrograma(matrix_df, annotations_df, selected_annotations=None,
         color_threshold=0
     )
     
-    # Línea de corte
-    cut_height = Z[-K+1, 2]
-    ax.axhline(cut_height, color="black", linestyle="dashed")
+    # Línea de corte (el corte dinámico no tiene una única altura)
+    if corte_fijo:
+        cut_height = Z[-K+1, 2]
+        ax.axhline(cut_height, color="black", linestyle="dashed")
+
+    if soporte is not None:
+        draw_support(ax, Z, leaf_order, soporte)
     
     ax.set_xticks([])
     ax.set_yticks([])
@@ -194,23 +260,50 @@ def plot_dendrograma(matrix_df, annotations_df, selected_annotations=None,
     plt.show()
     return g.fig
 
+# Número de uniones (las más altas) en las que se escribe el soporte
+MAX_SUPPORT_LABELS = 30
+
+def draw_support(ax, Z, leaf_order, soporte, max_labels=MAX_SUPPORT_LABELS):
+    """
+    Escribe el soporte (en %) sobre cada unión. scipy coloca la hoja de rango
+    r en x = 5 + 10 r y cada unión en el punto medio de sus dos hijos.
+    """
+    import numpy as np
+
+    n = len(Z) + 1
+    x = np.empty(2 * n - 1)
+    x[np.asarray(leaf_order)] = 5.0 + 10.0 * np.arange(n)
+    for i, (a, b) in enumerate(Z[:, :2].astype(int)):
+        x[n + i] = (x[a] + x[b]) / 2
+    for i in range(max(0, n - 1 - max_labels), n - 1):
+        if np.isnan(soporte[i]):
+            continue
+        ax.annotate(f"{100 * soporte[i]:.0f}", (x[n + i], Z[i, 2]), xytext=(0, 2),
+                    textcoords="offset points", ha="center", va="bottom", fontsize=7,
+                    color="#d62728" if soporte[i] < 0.5 else "black")
+
 # =====================================================
 # Función para leyendas de anotaciones
 # =====================================================
-def plot_legends(selected_annotations):
+def plot_legends(selected_annotations, paletas_extra=None):
     """
     Genera una figura separada con las leyendas de las anotaciones seleccionadas.
+    paletas_extra: {título: {valor: color}} de barras que no son anotaciones
+    (por ejemplo, las de barras_clusters).
     """
-    n_annotations = len(selected_annotations)
+    import matplotlib.pyplot as plt
+
+    palettes = {ann: color_palettes[ann] for ann in selected_annotations}
+    palettes.update(paletas_extra or {})
+    n_annotations = len(palettes)
     fig, axes = plt.subplots(1, n_annotations, figsize=(3*n_annotations, 2))
     
     # Si solo hay una anotación, axes no es lista
     if n_annotations == 1:
         axes = [axes]
     
-    for ax, annotation in zip(axes, selected_annotations):
+    for ax, (annotation, palette) in zip(axes, palettes.items()):
         ax.axis("off")
-        palette = color_palettes[annotation]
         
         # Título
         ax.set_title(annotation, fontsize=11, fontweight="bold")
@@ -0,0 +1,229 @@
+# densidad.py
+import numpy as np
+
+# =====================================================
+# Clusters por densidad (estilo HDBSCAN) sobre la matriz de distancias
+# =====================================================
+#
+# A diferencia de los cortes del árbol jerárquico, aquí no todas las muestras
+# acaban en un cluster: las de zonas poco densas quedan como ruido
+# (etiqueta 0). Los pasos son los de HDBSCAN (Campello et al. 2013), usando
+# directamente la matriz cargada como distancias precalculadas:
+#   1. distancia núcleo de cada muestra = distancia a su min_muestras-ésimo
+#      vecino (contándose a sí misma), por bloques de filas con np.partition;
+#   2. árbol de expansión mínima de la alcanzabilidad mutua
+#      max(núcleo(a), núcleo(b), d(a, b)) con Prim en O(n²): en cada paso se
+#      lee una sola fila de la matriz, así que no se materializa ninguna
+#      matriz n × n nueva y puede trabajar sobre el triángulo condensado de un
+#      almacén .matriz;
+#   3. jerarquía single-linkage de ese árbol y árbol condensado: al bajar por
+#      la jerarquía, las ramas con menos de tamano_minimo muestras no son un
+#      cluster nuevo sino muestras que "caen" del cluster padre;
+#   4. selección por exceso de masa (EOM) con la estabilidad de cada cluster,
+#      suma de (λ de salida - λ de nacimiento) de sus muestras, λ = 1 / d.
+
+TAMANO_MINIMO = 10
+BLOQUE_FILAS = 1024
+
+
+def fila_condensada(distancias, n, v):
+    """Fila v completa de la matriz cuadrada a partir del triángulo inferior."""
+    fila = np.empty(n, dtype=np.float64)
+    inicio = v * (v - 1) // 2
+    fila[:v] = distancias[inicio:inicio + v]
+    fila[v] = 0.0
+    posteriores = np.arange(v + 1, n, dtype=np.int64)
+    fila[v + 1:] = distancias[posteriores * (posteriores - 1) // 2 + v]
+    return fila
+
+
+def distancias_nucleo(leer_filas, n, min_muestras, bloque=BLOQUE_FILAS):
+    """
+    leer_filas(ini, fin) -> filas completas (fin - ini, n). Devuelve la
+    distancia de cada muestra a su min_muestras-ésimo vecino, ella incluida.
+    """
+    k = min(min_muestras, n) - 1
+    nucleo = np.empty(n, dtype=np.float64)
+    for ini in range(0, n, bloque):
+        fin = min(ini + bloque, n)
+        nucleo[ini:fin] = np.partition(leer_filas(ini, fin), k, axis=1)[:, k]
+    return nucleo
+
+
+def arbol_minimo(leer_fila, n, nucleo, progreso=None):
+    """
+    Prim sobre la alcanzabilidad mutua. Devuelve las n - 1 aristas
+    (origen, destino, peso) en el orden en que entran al árbol.
+    """
+    en_arbol = np.zeros(n, dtype=bool)
+    mejor = np.full(n, np.inf)
+    origen_mejor = np.zeros(n, dtype=np.int64)
+    aristas = np.empty((n - 1, 3))
+
+    actual = 0
+    en_arbol[0] = True
+    for paso in range(n - 1):
+        alcance = np.maximum(np.maximum(leer_fila(actual), nucleo), nucleo[actual])
+        mejora = (alcance < mejor) & ~en_arbol
+        mejor[mejora] = alcance[mejora]
+        origen_mejor[mejora] = actual
+        mejor[en_arbol] = np.inf
+        siguiente = int(np.argmin(mejor))
+        aristas[paso] = (origen_mejor[siguiente], siguiente, mejor[siguiente])
+        en_arbol[siguiente] = True
+        mejor[siguiente] = np.inf
+        actual = siguiente
+        if progreso and (paso + 1) % 1000 == 0:
+            progreso((paso + 1) / (n - 1), f"Árbol mínimo: {paso + 1}/{n - 1} aristas")
+    return aristas
+
+
+def jerarquia(aristas, n):
+    """Aristas del árbol mínimo -> matriz de linkage single (formato de scipy)."""
+    aristas = aristas[np.argsort(aristas[:, 2], kind="stable")]
+    padre = np.arange(2 * n - 1)
+    tamanos = np.ones(2 * n - 1, dtype=np.int64)
+    Z = np.empty((n - 1, 4))
+
+    def raiz(x):
+        while padre[x] != x:
+            padre[x] = padre[padre[x]]
+            x = padre[x]
+        return x
+
+    for i, (a, b, peso) in enumerate(aristas):
+        ra, rb = raiz(int(a)), raiz(int(b))
+        padre[ra] = padre[rb] = n + i
+        tamanos[n + i] = tamanos[ra] + tamanos[rb]
+        Z[i] = (min(ra, rb), max(ra, rb), peso, tamanos[n + i])
+    return Z
+
+
+def seleccionar_clusters(Z, tamano_minimo):
+    """
+    Árbol condensado y selección EOM sobre la jerarquía Z. Devuelve
+    etiquetas (n,) con 1..k por tamaño decreciente y 0 para el ruido.
+    """
+    n = len(Z) + 1
+    hijos = Z[:, :2].astype(np.int64)
+    tamanos = np.ones(2 * n - 1, dtype=np.int64)
+    tamanos[n:] = Z[:, 3].astype(np.int64)
+    # λ = 1 / d; las distancias nulas (muestras repetidas) no dan λ infinitos
+    lambdas = 1.0 / np.maximum(Z[:, 2], 1e-12)
+
+    # Cluster del árbol condensado al que pertenece cada nodo (0 = raíz) y si
+    # el nodo ya cayó de él (entonces sus hojas solo heredan la etiqueta)
+    cluster_nodo = np.zeros(2 * n - 1, dtype=np.int64)
+    caido = np.zeros(2 * n - 1, dtype=bool)
+    nacimiento = [0.0]
+    padre_cluster = [-1]
+    tamano_cluster = [n]
+    salida = [0.0]
+
+    for i in range(n - 2, -1, -1):
+        nodo = n + i
+        c = cluster_nodo[nodo]
+        a, b = hijos[i]
+        if caido[nodo]:
+            cluster_nodo[a] = cluster_nodo[b] = c
+            caido[a] = caido[b] = True
+            continue
+        lam = lambdas[i]
+        grande_a = tamanos[a] >= tamano_minimo
+        grande_b = tamanos[b] >= tamano_minimo
+        if grande_a and grande_b:
+            # Separación real: nacen dos clusters y todo el padre sale a este λ
+            salida[c] += lam * tamanos[nodo]
+            for hijo in (a, b):
+                cluster_nodo[hijo] = len(nacimiento)
+                nacimiento.append(lam)
+                padre_cluster.append(c)
+                tamano_cluster.append(tamanos[hijo])
+                salida.append(0.0)
+        else:
+            # Las ramas pequeñas caen del cluster; la grande (si la hay) lo continúa
+            for hijo, grande in ((a, grande_a), (b, grande_b)):
+                cluster_nodo[hijo] = c
+                if not grande:
+                    salida[c] += lam * tamanos[hijo]
+                    caido[hijo] = True
+
+    nacimiento = np.array(nacimiento)
+    padre_cluster = np.array(padre_cluster)
+    estabilidad = np.array(salida) - nacimiento * np.array(tamano_cluster)
+
+    # Exceso de masa: de abajo arriba, un cluster se queda si es más estable
+    # que la suma de sus hijos
+    m = len(nacimiento)
+    suma_hijos = np.zeros(m)
+    tiene_hijos = np.zeros(m, dtype=bool)
+    tiene_hijos[padre_cluster[1:]] = True
+    elegido = np.zeros(m, dtype=bool)
+    for c in range(m - 1, 0, -1):
+        if tiene_hijos[c] and suma_hijos[c] > estabilidad[c]:
+            estabilidad[c] = suma_hijos[c]
+        else:
+            elegido[c] = True
+        suma_hijos[padre_cluster[c]] += estabilidad[c]
+
+    # De arriba abajo: lo que está bajo un cluster elegido pertenece a él
+    destino = np.full(m, -1, dtype=np.int64)
+    for c in range(1, m):
+        arriba = destino[padre_cluster[c]]
+        destino[c] = arriba if arriba >= 0 else (c if elegido[c] else -1)
+
+    por_muestra = destino[cluster_nodo[:n]]
+    etiquetas = np.zeros(n, dtype=np.int32)
+    validos = por_muestra >= 0
+    if validos.any():
+        ids, codigos, cuentas = np.unique(por_muestra[validos], return_inverse=True,
+                                          return_counts=True)
+        rango = np.empty(len(ids), dtype=np.int32)
+        rango[np.argsort(-cuentas, kind="stable")] = np.arange(1, len(ids) + 1)
+        etiquetas[validos] = rango[codigos]
+    return etiquetas
+
+
+def hdbscan(D, tamano_minimo=TAMANO_MINIMO, min_muestras=None, progreso=None):
+    """
+    D: matriz cuadrada de distancias (array o memmap) o, si es 1-D, su
+    triángulo inferior condensado (orden de almacen_matrices). Devuelve las
+    etiquetas (1..k, 0 = ruido).
+    """
+    if min_muestras is None:
+        min_muestras = tamano_minimo
+    if D.ndim == 1:
+        import almacen_matrices
+
+        n = int(round((1 + np.sqrt(1 + 8 * len(D))) / 2))
+        leer_fila = lambda v: fila_condensada(D, n, v)
+        leer_filas = lambda ini, fin: almacen_matrices.leer_filas(D, n, np.arange(ini, fin))
+    else:
+        n = len(D)
+        leer_fila = lambda v: np.asarray(D[v], dtype=np.float64)
+        leer_filas = lambda ini, fin: np.asarray(D[ini:fin], dtype=np.float64)
+    if n < 2:
+        return np.zeros(n, dtype=np.int32)
+
+    nucleo = distancias_nucleo(leer_filas, n, min_muestras)
+    if progreso:
+        progreso(0.05, "Distancias núcleo calculadas")
+    aristas = arbol_minimo(
+        leer_fila, n, nucleo,
+        progreso=(lambda f, m: progreso(0.05 + 0.9 * f, m)) if progreso else None)
+    return seleccionar_clusters(jerarquia(aristas, n), tamano_minimo)
+
+
+def hdbscan_cacheado(matrix_df, tamano_minimo=TAMANO_MINIMO, min_muestras=None, huella=None,
+                     progreso=None):
+    import cache_disco
+
+    if huella is None:
+        huella = cache_disco.huella_matriz(matrix_df)
+    clave_densidad = cache_disco.clave("hdbscan", cache_disco.huella_muestras(matrix_df.index),
+                                       tamano_minimo, min_muestras)
+    etiquetas = cache_disco.cargar_array(huella, clave_densidad)
+    if etiquetas is None:
+        etiquetas = hdbscan(matrix_df.values, tamano_minimo, min_muestras, progreso=progreso)
+        cache_disco.guardar_array(huella, clave_densidad, etiquetas)
+    return etiquetas
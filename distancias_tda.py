@@ -0,0 +1,393 @@
+# distancias_tda.py
+import os
+import sys
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import almacen_matrices
+import trabajos
+
+# =====================================================
+# Matrices de distancia entre diagramas de persistencia
+# =====================================================
+#
+# Lee una carpeta de diagramas (un CSV por muestra, p. ej.
+# HG_dysplasia_F23P1_PRIM_1.csv) y calcula las distancias bottleneck o
+# Wasserstein entre todos los pares en un pool de procesos. El triángulo se
+# reparte en teselas de filas x columnas que se escriben directamente en un
+# almacén binario (almacen_matrices) que app.py puede abrir. Cada tesela
+# terminada queda anotada en teselas.txt, así que una ejecución interrumpida
+# continúa donde se quedó al volver a lanzarla.
+#
+#     python distancias_tda.py diagramas/ data/matrices/tumorales.matriz --metrica wasserstein
+#     python distancias_tda.py diagramas/ data/matrices/tumorales.matriz --anadir
+
+METRICAS = ["wasserstein", "bottleneck"]
+
+# =====================================================
+# Lectura de diagramas
+# =====================================================
+
+def listar_diagramas(carpeta):
+    return sorted(f for f in os.listdir(carpeta) if f.endswith(".csv"))
+
+
+def leer_diagrama(ruta, dimension=None):
+    """
+    Puntos (nacimiento, muerte) de un CSV. Se reconocen las columnas
+    birth/death (o nacimiento/muerte) y, opcionalmente, dimension/dim; sin
+    cabecera reconocible se usan las dos últimas columnas numéricas. Los
+    puntos con muerte infinita o vacía se descartan.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(ruta)
+    columnas = {c.strip().lower(): c for c in df.columns}
+    nac = columnas.get("birth", columnas.get("nacimiento"))
+    mue = columnas.get("death", columnas.get("muerte"))
+    dim = columnas.get("dimension", columnas.get("dim"))
+
+    if nac is None or mue is None:
+        df = pd.read_csv(ruta, header=None).apply(pd.to_numeric, errors="coerce")
+        df = df.dropna(axis=1, how="all").dropna(axis=0, how="any")
+        nac, mue = df.columns[-2], df.columns[-1]
+        dim = df.columns[-3] if df.shape[1] >= 3 else None
+
+    if dimension is not None and dim is not None:
+        df = df[df[dim] == dimension]
+    puntos = df[[nac, mue]].to_numpy(dtype=np.float64)
+    return puntos[np.isfinite(puntos).all(axis=1)]
+
+
+@functools.lru_cache(maxsize=4096)
+def _diagrama(ruta, dimension):
+    # Cada proceso del pool lee cada diagrama una sola vez
+    return leer_diagrama(ruta, dimension)
+
+# =====================================================
+# Distancias
+# =====================================================
+
+def _costes(a, b):
+    """
+    Matriz de costes aumentada (m+k) x (m+k) con distancia L-infinito: cada
+    punto puede emparejarse con otro o con su proyección en la diagonal.
+    """
+    m, k = len(a), len(b)
+    C = np.zeros((m + k, m + k), dtype=np.float64)
+    if m and k:
+        C[:m, :k] = np.maximum(np.abs(a[:, None, 0] - b[None, :, 0]),
+                               np.abs(a[:, None, 1] - b[None, :, 1]))
+    diag_a = (a[:, 1] - a[:, 0]) / 2
+    diag_b = (b[:, 1] - b[:, 0]) / 2
+    C[:m, k:] = np.inf
+    C[m:, :k] = np.inf
+    if m:
+        C[np.arange(m), k + np.arange(m)] = diag_a
+    if k:
+        C[m + np.arange(k), np.arange(k)] = diag_b
+    # Diagonal con diagonal: coste 0 (bloque inferior derecho ya es 0)
+    return C
+
+
+def wasserstein(a, b, q=1.0):
+    from scipy.optimize import linear_sum_assignment
+
+    if len(a) == 0 and len(b) == 0:
+        return 0.0
+    C = _costes(a, b)
+    C = np.where(np.isfinite(C), C ** q, 1e300)
+    filas, cols = linear_sum_assignment(C)
+    return float(C[filas, cols].sum() ** (1.0 / q))
+
+
+def bottleneck(a, b):
+    """
+    Menor umbral t que admite un emparejamiento perfecto usando solo aristas
+    de coste <= t; búsqueda binaria sobre los costes candidatos.
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import maximum_bipartite_matching
+
+    if len(a) == 0 and len(b) == 0:
+        return 0.0
+    C = _costes(a, b)
+    total = C.shape[0]
+    candidatos = np.unique(C[np.isfinite(C)])
+
+    def perfecto(t):
+        permitido = C <= t
+        grafo = csr_matrix(permitido.astype(np.int8))
+        return (maximum_bipartite_matching(grafo, perm_type="column") >= 0).sum() == total
+
+    lo, hi = 0, len(candidatos) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if perfecto(candidatos[mid]):
+            hi = mid
+        else:
+            lo = mid + 1
+    return float(candidatos[lo])
+
+
+def distancia(a, b, metrica="wasserstein", q=1.0):
+    if metrica == "bottleneck":
+        return bottleneck(a, b)
+    return wasserstein(a, b, q=q)
+
+# =====================================================
+# Teselas del triángulo
+# =====================================================
+
+def teselas(n, tam, desde=0):
+    """
+    Bloques (fila_ini, fila_fin, col_ini, col_fin) que cubren los pares i > j
+    con i >= desde (desde > 0 para añadir solo las filas nuevas).
+    """
+    bloques = []
+    for fi in range(0, n, tam):
+        ff = min(fi + tam, n)
+        if ff <= desde:
+            continue
+        for ci in range(0, ff, tam):
+            cf = min(ci + tam, n)
+            bloques.append((max(fi, desde), ff, ci, cf))
+    return bloques
+
+
+def _id_tesela(bloque):
+    return "-".join(map(str, bloque))
+
+
+def calcular_tesela(ruta_almacen, archivos, bloque, metrica, q, dimension):
+    """Calcula los pares de un bloque y los escribe en el almacén (proceso del pool)."""
+    fi, ff, ci, cf = bloque
+    _, _, distancias = almacen_matrices.abrir(ruta_almacen, "r+")
+    posiciones, valores = [], []
+    for i in range(fi, ff):
+        a = _diagrama(archivos[i], dimension)
+        for j in range(ci, min(cf, i)):
+            posiciones.append(almacen_matrices.indice(i, j))
+            valores.append(distancia(a, _diagrama(archivos[j], dimension), metrica, q))
+    if posiciones:
+        distancias[np.array(posiciones)] = valores
+        distancias.flush()
+    return bloque
+
+
+def _teselas_hechas(ruta):
+    ruta_log = os.path.join(ruta, "teselas.txt")
+    if not os.path.exists(ruta_log):
+        return set()
+    with open(ruta_log) as f:
+        return {linea.strip() for linea in f if linea.strip()}
+
+
+def _anotar_tesela(ruta, bloque):
+    # Una línea por tesela; fsync para que un corte no pierda el progreso
+    with open(os.path.join(ruta, "teselas.txt"), "a") as f:
+        f.write(_id_tesela(bloque) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def ejecutar_teselas(ruta_almacen, archivos, bloques, metrica, q, dimension,
+                     max_procesos=None, progreso=None):
+    """Reparte los bloques pendientes en el pool, anotando cada uno al terminar."""
+    hechas = _teselas_hechas(ruta_almacen)
+    pendientes = [b for b in bloques if _id_tesela(b) not in hechas]
+    if not pendientes:
+        return 0
+    if max_procesos is None:
+        max_procesos = os.cpu_count() or 1
+
+    hechos = 0
+    with ProcessPoolExecutor(max_workers=max_procesos, mp_context=trabajos._contexto()) as executor:
+        with trabajos._sin_main_de_streamlit():
+            futures = [executor.submit(calcular_tesela, ruta_almacen, archivos, b, metrica, q, dimension)
+                       for b in pendientes]
+        for f in as_completed(futures):
+            _anotar_tesela(ruta_almacen, f.result())
+            hechos += 1
+            if progreso:
+                progreso(hechos / len(pendientes), f"{hechos}/{len(pendientes)} teselas")
+    return hechos
+
+
+def calcular_matriz(carpeta, ruta_almacen, metrica="wasserstein", q=1.0, dimension=None,
+                    tam_tesela=64, max_procesos=None, dtype="float64", progreso=None):
+    """
+    Calcula la matriz de distancias de todos los diagramas de la carpeta en
+    ruta_almacen. Si el almacén ya existe con los mismos diagramas y
+    parámetros, continúa las teselas que falten.
+    """
+    nombres = listar_diagramas(carpeta)
+    archivos = [os.path.join(carpeta, f) for f in nombres]
+    parametros = {"metrica": metrica, "q": q, "dimension": dimension, "tam_tesela": tam_tesela}
+
+    reanudar = False
+    if almacen_matrices.es_almacen(ruta_almacen):
+        meta = almacen_matrices.leer_meta(ruta_almacen)
+        mismos = all(meta.get(k) == v for k, v in parametros.items())
+        reanudar = mismos and almacen_matrices.leer_muestras(ruta_almacen) == nombres
+        if not reanudar and os.path.exists(os.path.join(ruta_almacen, "teselas.txt")):
+            os.remove(os.path.join(ruta_almacen, "teselas.txt"))
+    if not reanudar:
+        almacen_matrices.crear(ruta_almacen, nombres, dtype=dtype, **parametros)
+
+    bloques = teselas(len(nombres), tam_tesela)
+    ejecutar_teselas(ruta_almacen, archivos, bloques, metrica, q, dimension,
+                     max_procesos=max_procesos, progreso=progreso)
+
+    meta = almacen_matrices.leer_meta(ruta_almacen)
+    meta["completa"] = True
+    almacen_matrices.escribir_meta(ruta_almacen, meta)
+    return ruta_almacen
+
+# =====================================================
+# Añadir muestras nuevas a una matriz existente
+# =====================================================
+
+def _huella_en_app(ruta_almacen):
+    """
+    Huella con la que la app guarda en caché lo derivado de esta matriz (la de
+    datos.preparar_datos), calculada por bloques de filas sin cargarla entera.
+    """
+    import cache_disco
+    import fuera_de_memoria
+    from generar_clustermap import clean_filename
+
+    meta, muestras, distancias = almacen_matrices.abrir(ruta_almacen)
+    n = meta["n"]
+    leer = lambda ini, fin: almacen_matrices.leer_filas(distancias, n, np.arange(ini, fin))
+    # leer_filas crea por celda unas dos veces los temporales de un tramo de
+    # fuera_de_memoria.recorrer
+    bloque = fuera_de_memoria.filas_por_tramo(n, fuera_de_memoria.MEMORIA_MB / 2)
+    return cache_disco.huella_matriz_filas([clean_filename(m) for m in muestras], leer, n, bloque)
+
+
+def _archivos_almacen(carpeta, muestras):
+    """
+    Archivo de la carpeta de cada muestra del almacén: el de su mismo nombre
+    o, si no está, el único cuyo nombre normalizado (clean_filename)
+    coincide. ValueError si alguna no tiene archivo o es ambiguo.
+    """
+    from generar_clustermap import clean_filename
+
+    presentes = listar_diagramas(carpeta)
+    por_nombre = {}
+    for f in presentes:
+        por_nombre.setdefault(clean_filename(f), []).append(f)
+    exactos = set(presentes)
+    archivos, problemas = [], []
+    for m in muestras:
+        candidatos = [m] if m in exactos else por_nombre.get(clean_filename(m), [])
+        if len(candidatos) != 1:
+            problemas.append(f"{m} ({'sin archivo' if not candidatos else 'ambiguo: ' + ', '.join(candidatos)})")
+            continue
+        archivos.append(os.path.join(carpeta, candidatos[0]))
+    if problemas:
+        raise ValueError(f"{len(problemas)} muestras del almacén sin un diagrama único en {carpeta}: "
+                         + "; ".join(problemas[:5]) + ("..." if len(problemas) > 5 else ""))
+    return archivos
+
+
+def _validar_meta(meta, ruta_almacen):
+    # Los almacenes de featurizacion.py o guardar_dataframe no vienen de diagramas
+    if meta.get("metrica") not in METRICAS or any(k not in meta for k in ("q", "dimension", "tam_tesela")):
+        raise ValueError(f"{ruta_almacen} no es una matriz de distancias entre diagramas de "
+                         f"distancias_tda.py (métrica {meta.get('metrica')!r}): no se le pueden añadir "
+                         "muestras")
+    if not meta.get("completa") and "n_previo" not in meta:
+        raise ValueError(f"{ruta_almacen} está incompleta: termínala con el mismo comando sin --anadir")
+
+
+def anadir_muestras(carpeta, ruta_almacen, max_procesos=None, progreso=None):
+    """
+    Compara las muestras del almacén (normalizadas con clean_filename) con los
+    diagramas de la carpeta y calcula solo las filas de las que faltan, contra
+    todas las existentes. El archivo crece por el final; el triángulo ya
+    calculado no se reescribe. Los linkages en caché de la matriz anterior se
+    invalidan. Devuelve la lista de muestras añadidas.
+    """
+    import cache_disco
+    from generar_clustermap import clean_filename
+
+    meta = almacen_matrices.leer_meta(ruta_almacen)
+    _validar_meta(meta, ruta_almacen)
+    muestras = almacen_matrices.leer_muestras(ruta_almacen)
+
+    if meta.get("completa"):
+        # Antes de tocar el almacén: cada muestra guardada debe tener su diagrama
+        archivos = _archivos_almacen(carpeta, muestras[:meta["n"]])
+        existentes = {clean_filename(m) for m in muestras[:meta["n"]]}
+        nuevas = [f for f in listar_diagramas(carpeta) if clean_filename(f) not in existentes]
+        if not nuevas:
+            return []
+        archivos += [os.path.join(carpeta, f) for f in nuevas]
+        huella_previa = _huella_en_app(ruta_almacen)
+
+        n_previo = meta["n"]
+        muestras = muestras[:n_previo] + nuevas
+        with open(os.path.join(ruta_almacen, "muestras.txt"), "w") as f:
+            f.write("".join(f"{m}\n" for m in muestras))
+        # truncate solo alarga el archivo: los bytes existentes no se tocan
+        with open(os.path.join(ruta_almacen, "distancias.bin"), "r+b") as f:
+            f.truncate(almacen_matrices.n_pares(len(muestras)) * np.dtype(meta["dtype"]).itemsize)
+        meta.update(n=len(muestras), n_previo=n_previo, huella_previa=huella_previa, completa=False)
+        almacen_matrices.escribir_meta(ruta_almacen, meta)
+    else:
+        # Un añadido anterior se interrumpió: se retoman sus teselas
+        n_previo = meta["n_previo"]
+        nuevas = muestras[n_previo:meta["n"]]
+        archivos = _archivos_almacen(carpeta, muestras[:meta["n"]])
+
+    bloques = teselas(meta["n"], meta["tam_tesela"], desde=n_previo)
+    ejecutar_teselas(ruta_almacen, archivos, bloques, meta["metrica"], meta["q"], meta["dimension"],
+                     max_procesos=max_procesos, progreso=progreso)
+
+    cache_disco.invalidar(meta.pop("huella_previa"))
+    meta.pop("n_previo")
+    meta["completa"] = True
+    almacen_matrices.escribir_meta(ruta_almacen, meta)
+    return nuevas
+
+# =====================================================
+# Línea de comandos
+# =====================================================
+
+def _argumentos(argv=None):
+    p = argparse.ArgumentParser(description="Matriz de distancias entre diagramas de persistencia")
+    p.add_argument("carpeta", help="carpeta con un CSV de diagrama por muestra")
+    p.add_argument("salida", help="almacén de salida (p. ej. data/matrices/tumorales.matriz)")
+    p.add_argument("--metrica", choices=METRICAS, default="wasserstein")
+    p.add_argument("--q", type=float, default=1.0, help="orden de la distancia Wasserstein")
+    p.add_argument("--dimension", type=int, default=None, help="usar solo puntos de esta dimensión")
+    p.add_argument("--tesela", type=int, default=64, help="muestras por lado de cada tesela")
+    p.add_argument("--procesos", type=int, default=None)
+    p.add_argument("--anadir", action="store_true",
+                   help="añadir solo los diagramas que no estén ya en la matriz de salida")
+    return p.parse_args(argv)
+
+
+def _imprimir_progreso(fraccion, mensaje):
+    print(f"\r{fraccion:6.1%}  {mensaje}", end="", file=sys.stderr, flush=True)
+
+
+if __name__ == "__main__":
+    # Importado por nombre para que los procesos del pool encuentren las funciones
+    import distancias_tda
+    args = _argumentos()
+    if args.anadir:
+        nuevas = distancias_tda.anadir_muestras(args.carpeta, args.salida, max_procesos=args.procesos,
+                                                progreso=_imprimir_progreso)
+        print(f"\n{len(nuevas)} muestras añadidas", file=sys.stderr)
+    else:
+        distancias_tda.calcular_matriz(
+            args.carpeta, args.salida, metrica=args.metrica, q=args.q, dimension=args.dimension,
+            tam_tesela=args.tesela, max_procesos=args.procesos, progreso=_imprimir_progreso,
+        )
+        print(file=sys.stderr)
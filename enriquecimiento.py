@@ -0,0 +1,119 @@
+# enriquecimiento.py
+import numpy as np
+
+# =====================================================
+# Enriquecimiento de anotaciones por cluster, para todos los K
+# =====================================================
+#
+# Para cada anotación, la tabla de contingencia cluster × categoría de todos
+# los cortes K = K_MIN..K_MAX sale de un único np.bincount sobre el código
+# combinado (corte, cluster, categoría) de cada muestra. Con las tablas
+# apiladas en un array (cortes, K_MAX, categorías) se calculan en bloque:
+#   - observados / esperados (log2) de cada celda,
+#   - p de Fisher unilateral de sobrerrepresentación de la categoría en el
+#     cluster (cola superior de la hipergeométrica, la tabla 2×2 cluster /
+#     resto × categoría / resto),
+#   - chi-cuadrado de independencia de cada corte.
+# Las muestras sin valor en la anotación no cuentan.
+
+ANOTACIONES = ["Tipo", "Fanconi", "Tumor stage", "BMT", "Condition",
+               "Desmoplastic category", "Grado displasia"]
+
+
+def contingencias(asignaciones, valores):
+    """
+    asignaciones (n, cortes) con etiquetas 1..K de fcluster; valores: Serie
+    con la categoría de cada muestra. Devuelve (conteos (cortes, K_MAX,
+    categorías) int64, categorías).
+    """
+    import pandas as pd
+
+    codigos, categorias = pd.factorize(pd.Series(valores).astype(object), sort=True)
+    n_cat = max(len(categorias), 1)
+    n_cortes = asignaciones.shape[1]
+    k_max = int(asignaciones.max())
+
+    validas = codigos >= 0
+    etiquetas = asignaciones[validas].astype(np.int64) - 1
+    cortes = np.arange(n_cortes, dtype=np.int64)
+    combinado = ((cortes * k_max + etiquetas) * n_cat + codigos[validas, None]).ravel()
+    conteos = np.bincount(combinado, minlength=n_cortes * k_max * n_cat)
+    return conteos.reshape(n_cortes, k_max, n_cat), list(categorias)
+
+
+def estadisticos(conteos):
+    """
+    Estadísticos de todas las celdas y cortes a la vez. Devuelve un dict con
+    arrays de la forma de conteos (esperados, log2_oe, p_fisher) y por corte
+    (chi2, gl, p_chi2).
+    """
+    from scipy.stats import hypergeom, chi2
+
+    conteos = conteos.astype(np.float64)
+    por_cluster = conteos.sum(axis=2, keepdims=True)
+    por_categoria = conteos.sum(axis=1, keepdims=True)
+    total = conteos.sum(axis=(1, 2), keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        esperados = por_cluster * por_categoria / total
+        log2_oe = np.log2((conteos + 0.5) / (esperados + 0.5))
+        celdas_chi = np.where(esperados > 0, (conteos - esperados) ** 2 / esperados, 0.0)
+
+    # P(X >= observados) con X ~ Hipergeométrica(total, tamaño categoría, tamaño cluster)
+    p_fisher = hypergeom.sf(conteos - 1, total, por_categoria, por_cluster)
+    p_fisher = np.where(por_cluster > 0, p_fisher, 1.0)
+
+    estadistico = celdas_chi.sum(axis=(1, 2))
+    filas = (por_cluster[..., 0] > 0).sum(axis=1)
+    columnas = (por_categoria[:, 0, :] > 0).sum(axis=1)
+    gl = np.maximum((filas - 1) * (columnas - 1), 0)
+    p_chi2 = np.where(gl > 0, chi2.sf(estadistico, np.maximum(gl, 1)), 1.0)
+
+    return {"esperados": esperados, "log2_oe": log2_oe, "p_fisher": p_fisher,
+            "chi2": estadistico, "gl": gl, "p_chi2": p_chi2}
+
+
+def ajustar_bh(p):
+    """q-valores de Benjamini-Hochberg (misma forma que p)."""
+    p = np.asarray(p, dtype=np.float64)
+    plano = p.ravel()
+    orden = np.argsort(plano)
+    m = len(plano)
+    q = plano[orden] * m / np.arange(1, m + 1)
+    q = np.minimum.accumulate(q[::-1])[::-1]
+    resultado = np.empty(m)
+    resultado[orden] = np.minimum(q, 1.0)
+    return resultado.reshape(p.shape)
+
+
+def enriquecimiento(asignaciones, annotations_df, anotaciones=ANOTACIONES):
+    """{anotación: {"categorias", "conteos", ...estadísticos}} para las anotaciones presentes."""
+    resultado = {}
+    for anotacion in anotaciones:
+        if anotacion not in annotations_df.columns:
+            continue
+        conteos, categorias = contingencias(asignaciones, annotations_df[anotacion])
+        if not categorias:
+            continue
+        resultado[anotacion] = {"categorias": categorias, "conteos": conteos, **estadisticos(conteos)}
+    return resultado
+
+
+def tabla_k(resultado, K, k_min=2):
+    """
+    Filas largas (cluster, anotación, categoría, observados, esperados,
+    log2_oe, p, q) del corte K, con q de BH sobre todas las celdas del corte.
+    """
+    import pandas as pd
+
+    j = K - k_min
+    filas = []
+    for anotacion, r in resultado.items():
+        for c in np.flatnonzero(r["conteos"][j].sum(axis=1) > 0):
+            for i, categoria in enumerate(r["categorias"]):
+                filas.append((int(c) + 1, anotacion, str(categoria), int(r["conteos"][j, c, i]),
+                              float(r["esperados"][j, c, i]), float(r["log2_oe"][j, c, i]),
+                              float(r["p_fisher"][j, c, i])))
+    tabla = pd.DataFrame(filas, columns=["Cluster", "Anotación", "Categoría", "Observados",
+                                         "Esperados", "log2 O/E", "p"])
+    tabla["q"] = ajustar_bh(tabla["p"].values) if len(tabla) else []
+    return tabla
@@ -0,0 +1,163 @@
+# estabilidad.py
+import numpy as np
+
+# =====================================================
+# Estabilidad de las ramas del dendrograma (bootstrap)
+# =====================================================
+#
+# Cada réplica toma al azar una fracción de las muestras de la submatriz, la
+# vuelve a agrupar con el mismo método y la misma convención que la app
+# (filas como observaciones) y comprueba qué ramas del Z de referencia
+# reaparecen. Una rama B reaparece si B ∩ S (S = muestras de la réplica) es
+# exactamente un cluster del árbol de la réplica. El soporte de B es la
+# fracción de réplicas en que reaparece, entre las que contienen al menos dos
+# de sus muestras (valor BP al estilo de pvclust, con submuestreo).
+#
+# Los clusters se comparan por su huella de Zobrist: cada muestra recibe un
+# entero aleatorio de 64 bits y un cluster es el XOR de los de sus muestras,
+# así que comparar conjuntos es comparar enteros.
+#
+# Las réplicas se reparten en bloques entre los procesos del pool de la app,
+# que leen la matriz condensada de memoria compartida (memoria_compartida.py):
+# la que la app publicó al cargarla, o una publicación temporal de la
+# submatriz. Cada réplica reconstruye solo su submatriz cuadrada, leyendo del
+# triángulo los pares entre sus muestras (almacen_matrices.leer_submatriz). Cada
+# réplica tiene su propia semilla derivada con SeedSequence, de modo que el
+# resultado no depende del reparto.
+
+REPLICAS = 100
+FRACCION = 0.8
+SEMILLA = 0
+REPLICAS_POR_TRABAJO = 10
+
+
+def _huellas_zobrist(n, semilla=SEMILLA):
+    return np.random.default_rng([semilla, n]).integers(
+        1, np.iinfo(np.uint64).max, size=n, dtype=np.uint64, endpoint=True)
+
+
+def huellas_nodos(Z, codigos_hojas):
+    """
+    Huella (XOR de las hojas) y número de hojas con código distinto de cero de
+    cada nodo interno de Z. Devuelve dos arrays de longitud n - 1.
+    """
+    n = len(Z) + 1
+    huellas = np.zeros(2 * n - 1, dtype=np.uint64)
+    tamanos = np.zeros(2 * n - 1, dtype=np.int64)
+    huellas[:n] = codigos_hojas
+    tamanos[:n] = codigos_hojas != 0
+    hijos = Z[:, :2].astype(np.int64)
+    for i, (a, b) in enumerate(hijos):
+        huellas[n + i] = huellas[a] ^ huellas[b]
+        tamanos[n + i] = tamanos[a] + tamanos[b]
+    return huellas[n:], tamanos[n:]
+
+
+def _replica(leer_submatriz, n, Z_ref, metodo, fraccion, semilla_replica, codigos):
+    """
+    (recuperada, elegible) de cada rama de Z_ref en una réplica.
+    leer_submatriz(S) -> matriz cuadrada de las muestras S.
+    """
+    from scipy.cluster.hierarchy import linkage
+
+    m = max(3, int(round(fraccion * n)))
+    rng = np.random.default_rng(semilla_replica)
+    S = np.sort(rng.choice(n, size=m, replace=False))
+
+    Z_rep = linkage(leer_submatriz(S), method=metodo, metric="euclidean")
+    huellas_rep, _ = huellas_nodos(Z_rep, codigos[S])
+
+    # Ramas de referencia restringidas a S: las hojas fuera de S no cuentan
+    codigos_ref = np.zeros(n, dtype=np.uint64)
+    codigos_ref[S] = codigos[S]
+    huellas_ref, tamanos_ref = huellas_nodos(Z_ref, codigos_ref)
+
+    elegible = tamanos_ref >= 2
+    recuperada = elegible & np.isin(huellas_ref, huellas_rep)
+    return recuperada, elegible
+
+
+def replicas_en_bloque(referencia, posiciones, Z_ref, metodo, fraccion, semillas, progreso=None):
+    """
+    Bloque de réplicas (trabajos.tarea_estabilidad, en un proceso del pool).
+    referencia: matriz publicada con memoria_compartida.publicar_matriz;
+    posiciones: filas de la submatriz en ella. Devuelve (recuperadas,
+    elegibles) sumadas, arrays de longitud n - 1.
+    """
+    import almacen_matrices
+    import memoria_compartida
+
+    posiciones = np.asarray(posiciones, dtype=np.int64)
+    n = len(posiciones)
+    with memoria_compartida.adjuntar({"distancias": referencia["distancias"]}) as arrays:
+        distancias = arrays["distancias"]
+        leer_submatriz = lambda S: almacen_matrices.leer_submatriz(distancias, posiciones[S])
+
+        codigos = _huellas_zobrist(n)
+        recuperadas = np.zeros(len(Z_ref), dtype=np.int32)
+        elegibles = np.zeros(len(Z_ref), dtype=np.int32)
+        for i, semilla in enumerate(semillas):
+            r, e = _replica(leer_submatriz, n, Z_ref, metodo, fraccion, semilla, codigos)
+            recuperadas += r
+            elegibles += e
+            if progreso:
+                progreso((i + 1) / len(semillas), f"Réplica {i + 1}/{len(semillas)}")
+        del distancias
+        return recuperadas, elegibles
+
+
+def _clave(matrix_df, Z, metodo, replicas, fraccion, semilla):
+    import cache_disco
+    # Z entra en la clave: un árbol importado no es el linkage del método. El
+    # dtype también: las réplicas agrupan con las distancias en esa precisión
+    return cache_disco.clave("estabilidad", cache_disco.huella_muestras(matrix_df.index),
+                             cache_disco.huella_array(Z), metodo, replicas, fraccion, semilla,
+                             str(matrix_df.values.dtype))
+
+
+def calcular_soporte(gestor, grupo, matrix_df, Z, metodo, huella, replicas=REPLICAS,
+                     fraccion=FRACCION, semilla=SEMILLA, al_progresar=None, publicada=None):
+    """
+    Reparte las réplicas en trabajos del gestor, espera a que terminen y
+    devuelve el soporte (float32, longitud n - 1, alineado con las filas de
+    Z; NaN si la rama no fue elegible en ninguna réplica). Se guarda en la
+    caché de disco. publicada: referencia de la matriz completa ya publicada
+    en memoria compartida; sin ella se publica la submatriz solo para este
+    cálculo.
+    """
+    from contextlib import nullcontext
+    import cache_disco
+    import memoria_compartida
+    import trabajos
+
+    clave_soporte = _clave(matrix_df, Z, metodo, replicas, fraccion, semilla)
+    soporte = cache_disco.cargar_array(huella, clave_soporte)
+    if soporte is not None:
+        return soporte
+
+    if publicada is None:
+        temporal = memoria_compartida.temporal(memoria_compartida.arrays_matriz(matrix_df))
+    else:
+        temporal = nullcontext(publicada)
+    with temporal as referencia:
+        posiciones = (np.arange(len(matrix_df)) if publicada is None
+                      else memoria_compartida.posiciones(referencia, matrix_df.index))
+        semillas = np.random.SeedSequence(semilla).spawn(replicas)
+        bloques = [semillas[i:i + REPLICAS_POR_TRABAJO]
+                   for i in range(0, replicas, REPLICAS_POR_TRABAJO)]
+        pendientes = [
+            gestor.enviar((*grupo, i), (clave_soporte, i), trabajos.tarea_estabilidad,
+                          referencia, posiciones, Z, metodo, fraccion, bloque)
+            for i, bloque in enumerate(bloques)
+        ]
+        gestor.esperar_todos(pendientes, al_progresar=al_progresar, unidad="bloques")
+        fallidos = [t.error or "cancelado" for t in pendientes if t.estado != "terminado"]
+        if fallidos:
+            raise RuntimeError(fallidos[0])
+
+    recuperadas = sum(t.resultado[0] for t in pendientes)
+    elegibles = sum(t.resultado[1] for t in pendientes)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        soporte = (recuperadas / elegibles).astype(np.float32)
+    cache_disco.guardar_array(huella, clave_soporte, soporte)
+    return soporte
@@ -0,0 +1,219 @@
+# featurizacion.py
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+import distancias_tda
+
+# =====================================================
+# Distancias aproximadas por vectorización de diagramas
+# =====================================================
+#
+# Para exploraciones rápidas: cada diagrama se convierte en un vector de
+# longitud fija (imagen de persistencia o paisaje) calculado por lotes en
+# NumPy, y la matriz de distancias euclídea o coseno sale de un único
+# producto de matrices. El resultado se escribe con el mismo formato que las
+# matrices de data/matrices (CSV etiquetado, o almacén .matriz).
+#
+#     python featurizacion.py diagramas/ data/matrices/tumorales_pi.csv --modo imagen
+#     python featurizacion.py diagramas/ salida.csv --modo paisaje --comparar 40
+
+MODOS = ["imagen", "paisaje"]
+DISTANCIAS = ["euclidea", "coseno"]
+
+
+def _rellenar(diagramas):
+    """Diagramas de distinto tamaño -> array (D, P_max, 2) y máscara de puntos reales."""
+    p_max = max(1, max(len(d) for d in diagramas))
+    puntos = np.zeros((len(diagramas), p_max, 2), dtype=np.float64)
+    mascara = np.zeros((len(diagramas), p_max), dtype=bool)
+    for i, d in enumerate(diagramas):
+        puntos[i, :len(d)] = d
+        mascara[i, :len(d)] = True
+    return puntos, mascara
+
+# =====================================================
+# Imágenes de persistencia
+# =====================================================
+
+def imagenes_persistencia(diagramas, resolucion=20, sigma=None, rango=None, lote=256):
+    """
+    Imagen de persistencia (resolucion x resolucion) de cada diagrama en
+    coordenadas (nacimiento, persistencia), con núcleo gaussiano y peso lineal
+    en la persistencia. El rango de la rejilla es común a todos los diagramas.
+    Devuelve (D, resolucion * resolucion).
+    """
+    puntos, mascara = _rellenar(diagramas)
+    nac = puntos[..., 0]
+    pers = puntos[..., 1] - puntos[..., 0]
+
+    if rango is None:
+        if mascara.any():
+            rango = (nac[mascara].min(), nac[mascara].max(), 0.0, pers[mascara].max())
+        else:
+            rango = (0.0, 1.0, 0.0, 1.0)
+    b_min, b_max, p_min, p_max = rango
+    b_max = max(b_max, b_min + 1e-12)
+    p_max = max(p_max, p_min + 1e-12)
+    if sigma is None:
+        sigma = max(b_max - b_min, p_max - p_min) / resolucion
+
+    ejes_b = np.linspace(b_min, b_max, resolucion)
+    ejes_p = np.linspace(p_min, p_max, resolucion)
+    pesos = np.where(mascara, pers / p_max, 0.0)
+
+    imagenes = np.empty((len(diagramas), resolucion, resolucion), dtype=np.float64)
+    for ini in range(0, len(diagramas), lote):
+        fin = ini + lote
+        # Núcleo separable: exp(-(db²+dp²)/2σ²) = gb * gp, así la suma sobre
+        # puntos de cada diagrama es un producto de matrices por lotes
+        gb = np.exp(-((nac[ini:fin, :, None] - ejes_b) ** 2) / (2 * sigma ** 2))
+        gp = np.exp(-((pers[ini:fin, :, None] - ejes_p) ** 2) / (2 * sigma ** 2))
+        gp *= pesos[ini:fin, :, None]
+        imagenes[ini:fin] = np.matmul(gp.transpose(0, 2, 1), gb)
+    return imagenes.reshape(len(diagramas), -1)
+
+# =====================================================
+# Paisajes de persistencia
+# =====================================================
+
+def paisajes_persistencia(diagramas, k=5, muestras=100, rango=None, lote=64):
+    """
+    Los k primeros paisajes de cada diagrama muestreados en una rejilla común
+    de 'muestras' puntos. Devuelve (D, k * muestras).
+    """
+    puntos, mascara = _rellenar(diagramas)
+    if rango is None:
+        if mascara.any():
+            rango = (puntos[..., 0][mascara].min(), puntos[..., 1][mascara].max())
+        else:
+            rango = (0.0, 1.0)
+    t = np.linspace(rango[0], rango[1], muestras)
+
+    p_max = puntos.shape[1]
+    k_real = min(k, p_max)
+    paisajes = np.zeros((len(diagramas), k, muestras), dtype=np.float64)
+    for ini in range(0, len(diagramas), lote):
+        fin = ini + lote
+        b = puntos[ini:fin, :, 0, None]
+        d = puntos[ini:fin, :, 1, None]
+        # Función tienda de cada punto: max(0, min(t - b, d - t))
+        tiendas = np.maximum(0.0, np.minimum(t - b, d - t))
+        tiendas[~mascara[ini:fin]] = 0.0
+        # Los k valores más altos en cada t, de mayor a menor
+        top = -np.partition(-tiendas, k_real - 1, axis=1)[:, :k_real]
+        paisajes[ini:fin, :k_real] = -np.sort(-top, axis=1)
+    return paisajes.reshape(len(diagramas), -1)
+
+# =====================================================
+# Distancias con un producto de matrices
+# =====================================================
+
+def matriz_distancias(X, distancia="euclidea"):
+    X = np.asarray(X, dtype=np.float64)
+    if distancia == "coseno":
+        normas = np.linalg.norm(X, axis=1, keepdims=True)
+        Xn = X / np.where(normas > 0, normas, 1.0)
+        D = 1.0 - Xn @ Xn.T
+    else:
+        cuadrados = np.einsum("ij,ij->i", X, X)
+        D = cuadrados[:, None] + cuadrados[None, :] - 2.0 * (X @ X.T)
+        np.sqrt(np.maximum(D, 0.0), out=D)
+    np.fill_diagonal(D, 0.0)
+    return np.maximum(D, 0.0)
+
+
+def caracteristicas(diagramas, modo="imagen", **opciones):
+    if modo == "paisaje":
+        return paisajes_persistencia(diagramas, **opciones)
+    return imagenes_persistencia(diagramas, **opciones)
+
+
+def calcular_matriz(carpeta, salida, modo="imagen", distancia="euclidea", dimension=None, **opciones):
+    """Escribe en 'salida' (CSV o .matriz) la matriz aproximada de todos los diagramas."""
+    import pandas as pd
+    import almacen_matrices
+
+    nombres = distancias_tda.listar_diagramas(carpeta)
+    diagramas = [distancias_tda.leer_diagrama(os.path.join(carpeta, f), dimension) for f in nombres]
+    D = matriz_distancias(caracteristicas(diagramas, modo, **opciones), distancia)
+    df = pd.DataFrame(D, index=nombres, columns=nombres)
+    if salida.endswith(almacen_matrices.EXTENSION):
+        almacen_matrices.guardar_dataframe(salida, df, metrica=f"{modo}-{distancia}", dimension=dimension)
+    else:
+        df.to_csv(salida)
+    return df
+
+# =====================================================
+# Precisión frente a tiempo
+# =====================================================
+
+def comparar_con_exacta(carpeta, n=40, modo="imagen", distancia="euclidea", metrica="wasserstein",
+                        q=1.0, dimension=None, semilla=0, **opciones):
+    """
+    Sobre n diagramas elegidos al azar calcula las distancias exactas
+    (distancias_tda) y las aproximadas, y devuelve tiempos y correlaciones
+    de Pearson y Spearman entre ambas.
+    """
+    from scipy.stats import pearsonr, spearmanr
+
+    nombres = distancias_tda.listar_diagramas(carpeta)
+    rng = np.random.default_rng(semilla)
+    elegidos = sorted(rng.choice(len(nombres), size=min(n, len(nombres)), replace=False))
+    diagramas = [distancias_tda.leer_diagrama(os.path.join(carpeta, nombres[i]), dimension)
+                 for i in elegidos]
+    m = len(diagramas)
+    iu = np.triu_indices(m, 1)
+
+    inicio = time.perf_counter()
+    exacta = np.array([distancias_tda.distancia(diagramas[i], diagramas[j], metrica, q)
+                       for i, j in zip(*iu)])
+    t_exacta = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    aprox = matriz_distancias(caracteristicas(diagramas, modo, **opciones), distancia)[iu]
+    t_aprox = time.perf_counter() - inicio
+
+    return {
+        "muestras": m,
+        "pares": len(exacta),
+        "segundos_exacta": t_exacta,
+        "segundos_aproximada": t_aprox,
+        "aceleracion": t_exacta / max(t_aprox, 1e-9),
+        "pearson": float(pearsonr(exacta, aprox)[0]),
+        "spearman": float(spearmanr(exacta, aprox)[0]),
+    }
+
+# =====================================================
+# Línea de comandos
+# =====================================================
+
+def _argumentos(argv=None):
+    p = argparse.ArgumentParser(description="Matriz de distancias aproximada por imágenes o paisajes de persistencia")
+    p.add_argument("carpeta", help="carpeta con un CSV de diagrama por muestra")
+    p.add_argument("salida", help="CSV o almacén .matriz de salida")
+    p.add_argument("--modo", choices=MODOS, default="imagen")
+    p.add_argument("--distancia", choices=DISTANCIAS, default="euclidea")
+    p.add_argument("--dimension", type=int, default=None)
+    p.add_argument("--resolucion", type=int, default=20, help="lado de la imagen de persistencia")
+    p.add_argument("--k", type=int, default=5, help="número de paisajes")
+    p.add_argument("--comparar", type=int, default=0, metavar="N",
+                   help="informar de precisión y tiempo frente a Wasserstein exacta sobre N diagramas")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = _argumentos()
+    opciones = {"resolucion": args.resolucion} if args.modo == "imagen" else {"k": args.k}
+    inicio = time.perf_counter()
+    calcular_matriz(args.carpeta, args.salida, args.modo, args.distancia, args.dimension, **opciones)
+    print(f"Matriz escrita en {args.salida} ({time.perf_counter() - inicio:.2f} s)", file=sys.stderr)
+    if args.comparar:
+        informe = comparar_con_exacta(args.carpeta, args.comparar, args.modo, args.distancia,
+                                      dimension=args.dimension, **opciones)
+        for clave, valor in informe.items():
+            print(f"{clave:22s} {valor:.4g}" if isinstance(valor, float) else f"{clave:22s} {valor}",
+                  file=sys.stderr)
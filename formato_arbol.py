@@ -0,0 +1,227 @@
+# formato_arbol.py
+import io
+import re
+import numpy as np
+
+# =====================================================
+# Exportar e importar el árbol (Newick y .npz)
+# =====================================================
+#
+# Newick, para herramientas de filogenia: cada nodo interno de Z se escribe
+# como (hijo_izquierdo,hijo_derecho) con la longitud de rama
+# altura(padre) - altura(hijo), así que las alturas del dendrograma se
+# recuperan sumando longitudes desde las hojas. El hijo Z[i, 0] va primero,
+# con lo que el orden de las hojas se conserva al volver a leerlo. Escritura
+# y lectura recorren el árbol con una pila explícita (sin recursión), para
+# árboles de decenas de miles de hojas.
+#
+# .npz, para archivar: Z en float64 tal cual, las etiquetas y el método de
+# linkage; se relee sin pérdida.
+#
+# Un árbol importado se alinea con las muestras de la submatriz por nombre:
+# las hojas de Z pasan a numerarse según la posición de cada muestra.
+
+BLOQUE_ESCRITURA = 8192
+# Sin comillas solo si no hay blancos ni caracteres con significado en Newick
+_ETIQUETA_SIMPLE = re.compile(r"^[^\s()\[\]':;,]+$")
+_TOKENS = re.compile(r"\s*(?:(\[[^\]]*\])|'((?:[^']|'')*)'|([(),:;])|([^\s()\[\]':;,]+))")
+
+
+def _etiqueta(texto):
+    texto = str(texto)
+    if _ETIQUETA_SIMPLE.match(texto):
+        return texto
+    return "'" + texto.replace("'", "''") + "'"
+
+
+def escribir_newick(Z, etiquetas, salida):
+    """Escribe el árbol en 'salida' (objeto de texto con write) por bloques."""
+    Z = np.asarray(Z, dtype=np.float64)
+    n = len(Z) + 1
+    if len(etiquetas) != n:
+        raise ValueError(f"{len(etiquetas)} etiquetas para un árbol de {n} hojas")
+    hijos = Z[:, :2].astype(np.int64).tolist()
+    altura = [0.0] * n + Z[:, 2].tolist()
+    longitud = [0.0] * (2 * n - 1)
+    for i, (a, b) in enumerate(hijos):
+        longitud[a] = altura[n + i] - altura[a]
+        longitud[b] = altura[n + i] - altura[b]
+    nombres = [_etiqueta(e) for e in etiquetas]
+
+    partes = []
+    pila = [2 * n - 2]
+    raiz = 2 * n - 2
+    while pila:
+        x = pila.pop()
+        if isinstance(x, str):
+            partes.append(x)
+        else:
+            sufijo = "" if x == raiz else f":{longitud[x]!r}"
+            if x < n:
+                partes.append(nombres[x] + sufijo)
+            else:
+                a, b = hijos[x - n]
+                partes.append("(")
+                pila.extend([")" + sufijo, b, ",", a])
+        if len(partes) >= BLOQUE_ESCRITURA:
+            salida.write("".join(partes))
+            partes.clear()
+    partes.append(";\n")
+    salida.write("".join(partes))
+
+
+def a_newick(Z, etiquetas):
+    salida = io.StringIO()
+    escribir_newick(Z, etiquetas, salida)
+    return salida.getvalue()
+
+
+def leer_newick(texto):
+    """
+    (Z, etiquetas) de un árbol Newick con raíz. Los nodos con más de dos
+    hijos se resuelven en uniones sucesivas a la misma altura; las etiquetas
+    y comentarios de los nodos internos se ignoran.
+    """
+    etiquetas = []
+    # Nodos en orden de creación (los hijos siempre antes que el padre):
+    # None para las hojas, lista de hijos para los internos
+    hijos_nodo = []
+    longitud = []
+    abiertos = [[]]
+    ultimo = None
+    previo = None
+
+    def nueva_hoja(nombre):
+        etiquetas.append(nombre)
+        hijos_nodo.append(None)
+        longitud.append(0.0)
+        abiertos[-1].append(len(hijos_nodo) - 1)
+        return len(hijos_nodo) - 1
+
+    for m in _TOKENS.finditer(texto):
+        comentario, citada, simbolo, simple = m.groups()
+        if comentario is not None:
+            continue
+        if simbolo is None:
+            valor = citada.replace("''", "'") if citada is not None else simple
+            if previo == ":":
+                try:
+                    longitud[ultimo] = float(valor)
+                except ValueError:
+                    raise ValueError(f"Longitud de rama no válida: {valor!r}") from None
+            elif previo != ")":
+                ultimo = nueva_hoja(valor)
+            previo = "etiqueta"
+            continue
+        if simbolo in ",):;" and previo in (None, "(", ","):
+            # Hoja sin nombre, como en "(,)"
+            ultimo = nueva_hoja("")
+        if simbolo == "(":
+            abiertos.append([])
+        elif simbolo == ")":
+            if len(abiertos) < 2:
+                raise ValueError("Hay un ')' sin su '('")
+            hijos_nodo.append(abiertos.pop())
+            longitud.append(0.0)
+            ultimo = len(hijos_nodo) - 1
+            abiertos[-1].append(ultimo)
+        elif simbolo == ";":
+            break
+        previo = simbolo
+    if len(abiertos) != 1 or len(abiertos[0]) != 1:
+        raise ValueError("El texto no es un único árbol Newick completo")
+    n = len(etiquetas)
+    if n < 2:
+        raise ValueError("El árbol necesita al menos dos hojas")
+
+    # Id de Z y altura de cada nodo, de las hojas hacia la raíz
+    id_z = [0] * len(hijos_nodo)
+    altura = [0.0] * len(hijos_nodo)
+    tamano = [1] * len(hijos_nodo)
+    filas = []
+    hojas = 0
+    for nodo, hijos in enumerate(hijos_nodo):
+        if hijos is None:
+            id_z[nodo] = hojas
+            hojas += 1
+            continue
+        h = max(altura[c] + longitud[c] for c in hijos)
+        actual, tam = id_z[hijos[0]], tamano[hijos[0]]
+        for c in hijos[1:]:
+            tam += tamano[c]
+            filas.append((actual, id_z[c], h, tam))
+            actual = n + len(filas) - 1
+        id_z[nodo], altura[nodo], tamano[nodo] = actual, h, tam
+    Z = np.array(filas, dtype=np.float64).reshape(-1, 4)
+
+    # Filas de abajo arriba, como las de scipy, si las alturas lo permiten
+    # (en un árbol no monótono un hijo puede estar por encima de su padre)
+    hijos_z = Z[:, :2].astype(np.int64)
+    alturas_hijos = np.where(hijos_z >= n, Z[np.maximum(hijos_z - n, 0), 2], 0.0)
+    if (alturas_hijos <= Z[:, 2:3]).all():
+        orden = np.argsort(Z[:, 2], kind="stable")
+        nuevo = np.arange(2 * n - 1)
+        nuevo[n + orden] = n + np.arange(len(orden))
+        Z = Z[orden]
+        Z[:, :2] = nuevo[Z[:, :2].astype(np.int64)]
+    return Z, etiquetas
+
+
+def a_npz(Z, etiquetas, metodo=None):
+    """Bytes de un .npz comprimido con Z, las etiquetas y el método."""
+    buf = io.BytesIO()
+    np.savez_compressed(buf, Z=np.asarray(Z, dtype=np.float64),
+                        etiquetas=np.array([str(e) for e in etiquetas]),
+                        metodo=np.array(metodo or ""))
+    return buf.getvalue()
+
+
+def leer_npz(origen):
+    """(Z, etiquetas, metodo o None) de un .npz escrito por a_npz."""
+    from scipy.cluster.hierarchy import is_valid_linkage
+
+    if isinstance(origen, bytes):
+        origen = io.BytesIO(origen)
+    with np.load(origen, allow_pickle=False) as datos:
+        if "Z" not in datos or "etiquetas" not in datos:
+            raise ValueError("El .npz no contiene 'Z' y 'etiquetas'")
+        Z = datos["Z"].astype(np.float64)
+        etiquetas = datos["etiquetas"].tolist()
+        metodo = str(datos["metodo"]) if "metodo" in datos else ""
+    if not is_valid_linkage(Z) or len(etiquetas) != len(Z) + 1:
+        raise ValueError("La matriz Z del .npz no es un linkage válido para sus etiquetas")
+    return Z, etiquetas, metodo or None
+
+
+def leer_arbol(nombre, contenido):
+    """(Z, etiquetas, metodo o None) según la extensión del archivo."""
+    if nombre.lower().endswith(".npz"):
+        return leer_npz(contenido)
+    if isinstance(contenido, bytes):
+        contenido = contenido.decode("utf-8-sig")
+    Z, etiquetas = leer_newick(contenido)
+    return Z, etiquetas, None
+
+
+def alinear(Z, etiquetas, muestras):
+    """
+    Z con las hojas renumeradas según la posición de cada etiqueta en
+    'muestras'. ValueError si las etiquetas no son exactamente esas muestras.
+    """
+    import pandas as pd
+
+    n = len(Z) + 1
+    muestras = pd.Index([str(m) for m in muestras])
+    etiquetas = pd.Index([str(e) for e in etiquetas])
+    if etiquetas.has_duplicates:
+        raise ValueError("El árbol tiene hojas con el mismo nombre")
+    posicion = muestras.get_indexer(etiquetas)
+    faltan = (posicion < 0).sum()
+    if faltan or len(muestras) != n:
+        raise ValueError(f"El árbol tiene {n} hojas ({faltan} fuera del subgrupo) y el "
+                         f"subgrupo {len(muestras)} muestras")
+    Z = np.array(Z, dtype=np.float64)
+    hijos = Z[:, :2]
+    hojas = hijos < n
+    hijos[hojas] = posicion[hijos[hojas].astype(np.int64)]
+    return Z
@@ -0,0 +1,210 @@
+# fuera_de_memoria.py
+import os
+import numpy as np
+
+# =====================================================
+# Matrices más grandes que la memoria (almacén .matriz en disco)
+# =====================================================
+#
+# La matriz nunca se carga entera: el triángulo condensado del almacén
+# (almacen_matrices) se abre como memmap y se recorre por tramos contiguos de
+# filas, con el tamaño de cada tramo calculado a partir de la memoria máxima
+# (CLUSTERMAP_MEMORIA_MB). Un subgrupo es solo un array de posiciones: de
+# cada tramo se recogen las filas y columnas del subgrupo. Sobre ese
+# recorrido se construyen:
+#   - el single linkage, a partir del árbol de expansión mínima de Borůvka:
+#     en cada ronda una pasada por la matriz busca la arista más corta que
+#     sale de cada componente, y las componentes se unen (log2 n rondas como
+#     mucho). La jerarquía sale del árbol con densidad.jerarquia. Aquí las
+#     distancias del archivo se usan directamente (no las filas como
+#     observaciones euclídeas, como hace linkage_cacheado con el DataFrame);
+#   - el heatmap agregado: las muestras, en el orden de las hojas, se reparten
+#     en CELDAS franjas y cada píxel es la distancia media entre dos franjas,
+#     acumulada con np.bincount tramo a tramo.
+
+MEMORIA_MB = float(os.environ.get("CLUSTERMAP_MEMORIA_MB", "1024"))
+CELDAS = 1000
+# Bytes por celda de un tramo en el pico de memoria: índices int64 del
+# subgrupo y sus temporales, el bloque reunido y las máscaras (medido con
+# tracemalloc, el pico queda por debajo de memoria_mb)
+BYTES_POR_CELDA = 48
+
+
+def filas_por_tramo(n, memoria_mb=MEMORIA_MB):
+    return max(1, int(memoria_mb * 1024 ** 2 // (BYTES_POR_CELDA * max(n, 1))))
+
+
+def necesita_disco(n, memoria_mb=MEMORIA_MB):
+    """¿Ocuparía la matriz cuadrada en float64 más que la memoria permitida?"""
+    return n * n * 8 > memoria_mb * 1024 ** 2
+
+
+def recorrer(distancias, n, seleccion=None, memoria_mb=MEMORIA_MB):
+    """
+    Recorre el triángulo inferior de la submatriz del subgrupo 'seleccion'
+    (posiciones crecientes en el almacén; None = todas). Genera
+    (filas, bloque): filas son posiciones dentro del subgrupo y
+    bloque[r, c] = d(filas[r], c) para c < filas[r], np.inf en el resto.
+    """
+    seleccion = np.arange(n) if seleccion is None else np.asarray(seleccion, dtype=np.int64)
+    paso = filas_por_tramo(n, memoria_mb)
+    for ini in range(0, n, paso):
+        fin = min(ini + paso, n)
+        p_ini, p_fin = np.searchsorted(seleccion, [ini, fin])
+        # Sin filas del subgrupo, o solo su primera muestra (fila sin
+        # columnas a la izquierda): el tramo no aporta ningún par
+        if p_fin <= p_ini or p_fin <= 1:
+            continue
+        inicio_tramo = ini * (ini - 1) // 2
+        tramo = distancias[inicio_tramo:fin * (fin - 1) // 2]
+        filas = np.arange(p_ini, p_fin)
+        originales = seleccion[filas]
+        # Desplazamiento de cada d(i, seleccion[c]) dentro del tramo
+        cols = np.arange(p_fin - 1)
+        validas = cols[None, :] < filas[:, None]
+        desplazamiento = ((originales * (originales - 1) // 2 - inicio_tramo)[:, None]
+                          + seleccion[None, :p_fin - 1])
+        bloque = np.full(validas.shape, np.inf, dtype=np.result_type(distancias.dtype, np.float32))
+        bloque[validas] = tramo[desplazamiento[validas]]
+        yield filas, bloque
+
+
+def arbol_minimo(distancias, n, seleccion=None, memoria_mb=MEMORIA_MB, progreso=None):
+    """
+    Árbol de expansión mínima (Borůvka) del subgrupo. Devuelve las m - 1
+    aristas (origen, destino, peso) en posiciones del subgrupo.
+    """
+    m = n if seleccion is None else len(seleccion)
+    componente = np.arange(m)
+    aristas = []
+    ronda = 0
+    while len(aristas) < m - 1:
+        ronda += 1
+        mejor_peso = np.full(m, np.inf)
+        mejor_destino = np.full(m, -1, dtype=np.int64)
+        for filas, bloque in recorrer(distancias, n, seleccion, memoria_mb):
+            cols = np.arange(bloque.shape[1])
+            bloque[componente[filas][:, None] == componente[None, cols]] = np.inf
+            # Lado de las filas: la arista más corta de cada fila del tramo
+            j = np.argmin(bloque, axis=1)
+            peso = bloque[np.arange(len(filas)), j]
+            mejora = peso < mejor_peso[filas]
+            mejor_peso[filas[mejora]] = peso[mejora]
+            mejor_destino[filas[mejora]] = j[mejora]
+            # Lado de las columnas: la más corta de cada columna en el tramo
+            if len(cols):
+                i = np.argmin(bloque, axis=0)
+                peso = bloque[i, cols]
+                mejora = peso < mejor_peso[cols]
+                mejor_peso[cols[mejora]] = peso[mejora]
+                mejor_destino[cols[mejora]] = filas[i[mejora]]
+
+        # La arista más corta de cada componente
+        orden = np.lexsort((mejor_peso, componente))
+        primera = np.r_[True, np.diff(componente[orden]) != 0]
+        candidatas = orden[primera]
+        candidatas = candidatas[np.isfinite(mejor_peso[candidatas])]
+        if not len(candidatas):
+            break
+        candidatas = candidatas[np.argsort(mejor_peso[candidatas], kind="stable")]
+
+        # Unión de componentes (union-find sobre las etiquetas de componente)
+        padre = {}
+
+        def raiz(c):
+            while padre.get(c, c) != c:
+                c = padre[c]
+            return c
+
+        for v in candidatas:
+            w = mejor_destino[v]
+            a, b = raiz(componente[v]), raiz(componente[w])
+            if a != b:
+                padre[max(a, b)] = min(a, b)
+                aristas.append((v, w, mejor_peso[v]))
+        etiquetas = np.unique(componente)
+        nuevas = np.array([raiz(c) for c in etiquetas])
+        componente = nuevas[np.searchsorted(etiquetas, componente)]
+        if progreso:
+            progreso(min(len(aristas) / max(m - 1, 1), 0.99),
+                     f"Borůvka: ronda {ronda}, {m - len(aristas)} componentes")
+    return np.array(aristas, dtype=np.float64).reshape(-1, 3)
+
+
+def single_linkage(distancias, n, seleccion=None, memoria_mb=MEMORIA_MB, progreso=None):
+    """Z de single linkage (formato de scipy) del subgrupo."""
+    import densidad
+
+    m = n if seleccion is None else len(seleccion)
+    return densidad.jerarquia(arbol_minimo(distancias, n, seleccion, memoria_mb, progreso), m)
+
+
+def heatmap_agregado(distancias, n, hojas, seleccion=None, celdas=CELDAS,
+                     memoria_mb=MEMORIA_MB, progreso=None):
+    """
+    Matriz (celdas, celdas) float32 con la distancia media entre franjas de
+    muestras consecutivas en el orden 'hojas' (posiciones del subgrupo).
+    """
+    m = len(hojas)
+    celdas = min(celdas, m)
+    posicion = np.empty(m, dtype=np.int64)
+    posicion[hojas] = np.arange(m)
+    franja = posicion * celdas // m
+
+    sumas = np.zeros(celdas * celdas)
+    cuentas = np.zeros(celdas * celdas)
+    hechas = 0
+    for filas, bloque in recorrer(distancias, n, seleccion, memoria_mb):
+        validas = np.arange(bloque.shape[1])[None, :] < filas[:, None]
+        codigo = (franja[filas][:, None] * celdas + franja[None, :bloque.shape[1]])[validas]
+        sumas += np.bincount(codigo, bloque[validas], minlength=celdas * celdas)
+        cuentas += np.bincount(codigo, minlength=celdas * celdas)
+        hechas = filas[-1] + 1
+        if progreso:
+            progreso(hechas / m, f"Heatmap agregado: {hechas}/{m} filas")
+
+    sumas = sumas.reshape(celdas, celdas)
+    cuentas = cuentas.reshape(celdas, celdas)
+    sumas += sumas.T
+    cuentas += cuentas.T
+    with np.errstate(invalid="ignore"):
+        media = np.where(cuentas > 0, sumas / np.maximum(cuentas, 1), 0.0)
+    return media.astype(np.float32)
+
+# =====================================================
+# Con caché de disco
+# =====================================================
+
+def _huella(ruta):
+    import cache_disco
+
+    return cache_disco.huella_archivo(os.path.join(ruta, "distancias.bin"))
+
+
+def linkage_almacen(ruta, seleccion, memoria_mb=MEMORIA_MB, progreso=None):
+    import almacen_matrices
+    import cache_disco
+
+    huella = _huella(ruta)
+    clave_z = cache_disco.clave("single_disco", cache_disco.huella_array(np.asarray(seleccion)))
+    Z = cache_disco.cargar_array(huella, clave_z)
+    if Z is None:
+        meta, _, distancias = almacen_matrices.abrir(ruta)
+        Z = single_linkage(distancias, meta["n"], seleccion, memoria_mb, progreso)
+        cache_disco.guardar_array(huella, clave_z, Z)
+    return Z
+
+
+def agregado_almacen(ruta, seleccion, hojas, celdas=CELDAS, memoria_mb=MEMORIA_MB, progreso=None):
+    import almacen_matrices
+    import cache_disco
+
+    huella = _huella(ruta)
+    clave_agregado = cache_disco.clave("agregado_disco", cache_disco.huella_array(np.asarray(seleccion)),
+                                       cache_disco.huella_array(np.asarray(hojas)), celdas)
+    media = cache_disco.cargar_array(huella, clave_agregado)
+    if media is None:
+        meta, _, distancias = almacen_matrices.abrir(ruta)
+        media = heatmap_agregado(distancias, meta["n"], hojas, seleccion, celdas, memoria_mb, progreso)
+        cache_disco.guardar_array(huella, clave_agregado, media)
+    return media
@@ -1,10 +1,9 @@
 # generar_clustermap.py
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-from matplotlib.patches import Patch
 import os
 
+# pandas, seaborn, matplotlib y scipy se importan al dibujar: los helpers y las
+# paletas de este módulo se usan en la interfaz antes de necesitar nada pesado
+
 # =====================================================
 # Funciones auxiliares
 # =====================================================
@@ -94,24 +93,48 @@ color_palettes = {
     'Grado displasia': grado_colors
 }
 
+# Barra extra con la muestra buscada y sus vecinos más cercanos
+resaltado_colors = {'Consulta': '#000000', 'Vecino': '#FF7F00'}
+
+def resaltado_column(samples, resaltar):
+    """Colores de la barra 'Vecinos': resaltar[0] es la consulta, el resto sus vecinos."""
+    vecinos = set(resaltar[1:])
+    return [resaltado_colors['Consulta'] if s == resaltar[0]
+            else resaltado_colors['Vecino'] if s in vecinos else '#FFFFFF'
+            for s in samples]
+
 # =====================================================
 # FUNCIÓN PRINCIPAL
 # =====================================================
 
 def plot_clustermap(matrix_df, annotations_df, selected_annotations, metodo="average",
-                    figsize=(18, 20), xticklabels=False, yticklabels=False):
+                    figsize=(18, 20), xticklabels=False, yticklabels=False, Z=None,
+                    resaltar=None):
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    import cache_disco
+
+    if Z is None:
+        Z = cache_disco.linkage_cacheado(matrix_df, metodo)
 
     row_colors_df = None
     if selected_annotations:
         row_colors_df = pd.DataFrame(index=matrix_df.index)
         for col in selected_annotations:
             row_colors_df[col] = annotations_df[col].map(color_palettes[col]).fillna("#FFFFFF")
+    if resaltar:
+        if row_colors_df is None:
+            row_colors_df = pd.DataFrame(index=matrix_df.index)
+        row_colors_df["Vecinos"] = resaltado_column(matrix_df.index, resaltar)
 
     g = sns.clustermap(
         matrix_df,
         cmap="viridis",
         figsize=figsize,
         method=metodo,
+        row_linkage=Z,
+        col_linkage=Z,
         row_colors=row_colors_df,
         col_colors=row_colors_df,
         xticklabels=xticklabels,
@@ -167,3 +190,127 @@ def plot_clustermap(matrix_df, annotations_df, selected_annotations, metodo="ave
     draw_column(legend_ax2, col2_annotations)
 
     return g
+
+# =====================================================
+# CLUSTERMAP AGREGADO (matrices en disco, fuera_de_memoria.py)
+# =====================================================
+
+# Uniones más altas del dendrograma que se dibujan sobre el heatmap agregado
+MAX_UNIONES_AGREGADO = 200
+
+def plot_clustermap_agregado(agregada, Z, annotations_df, selected_annotations,
+                             figsize=(18, 20), max_uniones=MAX_UNIONES_AGREGADO,
+                             barras_clusters=None):
+    """
+    Heatmap de la matriz agregada por franjas (celdas × celdas, en el orden
+    de las hojas de Z) con el dendrograma superior y una barra por anotación.
+    annotations_df: una fila por muestra, en el orden de Z. Cada franja de la
+    barra toma la categoría más frecuente de sus muestras. barras_clusters:
+    {título: etiquetas 0..k por muestra, en el orden de Z} de agrupaciones
+    externas al árbol (Louvain), con una barra más cada una. Del dendrograma se
+    dibujan solo las max_uniones uniones más altas, cada nodo en el centro
+    de su tramo de hojas, para que quede alineado con las franjas.
+    """
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as mcolors
+    from matplotlib.collections import LineCollection
+    import corte_dinamico
+
+    n = len(Z) + 1
+    celdas = len(agregada)
+    hojas, inicio = corte_dinamico.orden_hojas(Z)
+    tamanos = np.ones(2 * n - 1)
+    tamanos[n:] = Z[:, 3]
+    alturas = np.zeros(2 * n - 1)
+    alturas[n:] = Z[:, 2]
+    # x en unidades de franja: [0, celdas)
+    centro = (inicio + tamanos / 2) * celdas / n
+
+    alto_barra = 0.025
+    fig = plt.figure(figsize=figsize)
+    barras_clusters = barras_clusters or {}
+    n_barras = len(selected_annotations) + len(barras_clusters)
+    ax_dendro = fig.add_axes([0.08, 0.80, 0.80, 0.15])
+    ax_heat = fig.add_axes([0.08, 0.05, 0.80, 0.75 - n_barras * alto_barra])
+    cax = fig.add_axes([0.90, 0.05, 0.015, 0.3])
+
+    segmentos = []
+    for i in range(max(0, n - 1 - max_uniones), n - 1):
+        a, b = Z[i, :2].astype(int)
+        h = Z[i, 2]
+        segmentos += [[(centro[a], alturas[a]), (centro[a], h)],
+                      [(centro[a], h), (centro[b], h)],
+                      [(centro[b], h), (centro[b], alturas[b])]]
+    ax_dendro.add_collection(LineCollection(segmentos, colors="black", linewidths=0.8))
+    ax_dendro.set_xlim(0, celdas)
+    ax_dendro.set_ylim(Z[max(0, n - 1 - max_uniones), 2] * 0.95 if n > max_uniones else 0,
+                       Z[-1, 2] * 1.02)
+    ax_dendro.axis("off")
+
+    franja = np.empty(n, dtype=np.int64)
+    franja[hojas] = np.arange(n) * celdas // n
+    barras = []
+    for ann in selected_annotations:
+        mayoritaria = (annotations_df[ann].groupby(franja).agg(
+            lambda s: s.mode().iat[0] if s.notna().any() else None))
+        barras.append((ann, [mcolors.to_rgb(color_palettes[ann].get(mayoritaria.get(c), "#FFFFFF"))
+                             for c in range(celdas)]))
+    if barras_clusters:
+        from dendrograma_clusters import clusters_palette, ruido_color
+
+        for titulo, etiquetas in barras_clusters.items():
+            etiquetas = np.asarray(etiquetas, dtype=np.int64)
+            # Etiqueta más frecuente de cada franja (0 = ruido)
+            cuentas = np.zeros((celdas, etiquetas.max() + 1), dtype=np.int64)
+            np.add.at(cuentas, (franja, etiquetas), 1)
+            paleta = clusters_palette(etiquetas)
+            barras.append((titulo, [mcolors.to_rgb(paleta[f"C{e}"] if e > 0 else ruido_color)
+                                    for e in cuentas.argmax(axis=1)]))
+    for k, (titulo, colores) in enumerate(barras):
+        ax = fig.add_axes([0.08, 0.80 - (k + 1) * alto_barra, 0.80, alto_barra])
+        ax.imshow([colores], aspect="auto", extent=(0, celdas, 0, 1))
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.set_ylabel(titulo, rotation=0, ha="right", va="center", fontsize=9)
+
+    im = ax_heat.imshow(agregada, cmap="viridis", aspect="auto", interpolation="nearest",
+                        extent=(0, celdas, celdas, 0))
+    ax_heat.set_xticks([])
+    ax_heat.set_yticks([])
+    ax_heat.set_xlabel(f"{n} muestras en {celdas} franjas (distancia media por bloque)")
+    fig.colorbar(im, cax=cax)
+    return fig
+
+
+def plot_cofenetica(comparacion, n, figsize=(18, 6.5)):
+    """
+    Original, cofenética (escalada a las unidades de la original) y residuo,
+    lado a lado, agregados por franjas en el orden de las hojas de la figura.
+    comparacion: resultado de cofenetica.comparar.
+    """
+    import numpy as np
+    import matplotlib.pyplot as plt
+
+    original = comparacion["original"]
+    celdas = len(original)
+    fig, axes = plt.subplots(1, 3, figsize=figsize)
+    vmin = float(min(original.min(), comparacion["cofenetica"].min()))
+    vmax = float(max(original.max(), comparacion["cofenetica"].max()))
+    limite = float(np.abs(comparacion["residuo"]).max()) or 1.0
+    paneles = [
+        ("Distancias originales", original, "viridis", vmin, vmax),
+        (f"Cofenéticas ({comparacion['alfa']:.3g} + {comparacion['beta']:.3g} · altura)",
+         comparacion["cofenetica"], "viridis", vmin, vmax),
+        ("Residuo (original - cofenética)", comparacion["residuo"], "RdBu_r", -limite, limite),
+    ]
+    for ax, (titulo, valores, cmap, bajo, alto) in zip(axes, paneles):
+        im = ax.imshow(valores, cmap=cmap, vmin=bajo, vmax=alto, aspect="equal",
+                       interpolation="nearest")
+        ax.set_title(titulo, fontsize=11)
+        ax.set_xticks([])
+        ax.set_yticks([])
+        fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
+    axes[0].set_xlabel(f"{n} muestras en {celdas} franjas (media por bloque)")
+    fig.tight_layout()
+    return fig
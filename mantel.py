@@ -0,0 +1,144 @@
+# mantel.py
+import numpy as np
+
+# =====================================================
+# Prueba de Mantel (y Mantel parcial) entre matrices
+# =====================================================
+#
+# r de Mantel = correlación de Pearson entre los triángulos inferiores de dos
+# matrices de distancias sobre las mismas muestras. Su distribución nula se
+# obtiene permutando a la vez filas y columnas de B. El p-valor es unilateral
+# (r permutado >= r observado), con la corrección +1 habitual:
+#     p = (1 + #{r_perm >= r_obs}) / (1 + permutaciones)
+# En la prueba parcial se controla una tercera matriz C:
+#     r_ab.c = (r_ab - r_ac r_bc) / sqrt((1 - r_ac²) (1 - r_bc²))
+# y al permutar B cambian r_ab y r_bc.
+#
+# Cada matriz se estandariza una vez sobre sus pares (media 0, varianza 1) y
+# se guarda cuadrada en float32 con la diagonal a cero; así r es un producto
+# escalar: r = <ZA, ZB[p][:, p]> / (2 · pares). La permutación son dos
+# np.take por ejes (filas contiguas y luego columnas dentro de cada fila, que
+# caben en caché), bastante más rápido que reunir los pares uno a uno en el
+# triángulo condensado. Las permutaciones se reparten en bloques entre los
+# procesos del pool, que leen las matrices de memoria compartida; cada bloque
+# tiene su semilla de SeedSequence.
+
+PERMUTACIONES = 9999
+SEMILLA = 0
+PERMUTACIONES_POR_TRABAJO = 1000
+
+
+def estandarizar(D):
+    """Matriz cuadrada float32 con los pares estandarizados y la diagonal a cero."""
+    D = np.asarray(D, dtype=np.float64)
+    n = len(D)
+    i, j = np.tril_indices(n, -1)
+    pares = D[i, j]
+    desviacion = pares.std()
+    z = (pares - pares.mean()) / (desviacion if desviacion > 0 else 1.0)
+    Z = np.zeros((n, n), dtype=np.float32)
+    Z[i, j] = z
+    Z[j, i] = z
+    return Z
+
+
+def _r(ZA, ZB):
+    n = len(ZA)
+    return float(np.vdot(ZA, ZB)) / (n * (n - 1))
+
+
+def _parcial(r_ab, r_ac, r_bc):
+    # Sin definir (NaN) si C está perfectamente correlada con A o con B
+    denominador = np.sqrt(max((1 - r_ac ** 2) * (1 - r_bc ** 2), 0.0))
+    if denominador < 1e-9:
+        return np.nan
+    return (r_ab - r_ac * r_bc) / denominador
+
+
+def estadisticos(ZA, ZB, ZC=None):
+    """(r_ab, r_ab.c o None) observados."""
+    r_ab = _r(ZA, ZB)
+    if ZC is None:
+        return r_ab, None
+    return r_ab, float(_parcial(r_ab, _r(ZA, ZC), _r(ZB, ZC)))
+
+
+def permutar_en_bloque(Z, semilla, permutaciones, r_obs, progreso=None):
+    """
+    Z: array (2 o 3, n, n) con ZA, ZB y opcionalmente ZC. Devuelve cuántas
+    permutaciones de B igualan o superan r_obs = (r_ab, r_ab.c o None).
+    """
+    ZA, ZB = Z[0], Z[1]
+    ZC = Z[2] if len(Z) > 2 else None
+    n = len(ZA)
+    r_ac = _r(ZA, ZC) if ZC is not None else None
+    rng = np.random.default_rng(semilla)
+
+    mayores = np.zeros(2, dtype=np.int64)
+    for k in range(permutaciones):
+        p = rng.permutation(n)
+        ZBp = np.take(np.take(ZB, p, axis=0), p, axis=1)
+        r_ab = _r(ZA, ZBp)
+        mayores[0] += r_ab >= r_obs[0]
+        if ZC is not None:
+            mayores[1] += _parcial(r_ab, r_ac, _r(ZBp, ZC)) >= r_obs[1]
+        if progreso and (k + 1) % 100 == 0:
+            progreso((k + 1) / permutaciones, f"{k + 1}/{permutaciones} permutaciones")
+    return mayores
+
+
+def permutaciones_en_bloque(referencia, semilla, permutaciones, r_obs, progreso=None):
+    """Bloque de permutaciones (trabajos.tarea_mantel, en un proceso del pool)."""
+    import memoria_compartida
+
+    with memoria_compartida.adjuntar(referencia) as arrays:
+        return permutar_en_bloque(arrays["Z"], semilla, permutaciones, r_obs, progreso=progreso)
+
+
+def prueba_mantel(gestor, grupo, A, B, C=None, permutaciones=PERMUTACIONES, semilla=SEMILLA,
+                  al_progresar=None):
+    """
+    Mantel entre A y B (DataFrames alineados), y parcial controlando C si se
+    pasa. Devuelve {"r", "p", "r_parcial", "p_parcial", "muestras",
+    "permutaciones"} y lo guarda en la caché de disco.
+    """
+    import cache_disco
+    import memoria_compartida
+    import trabajos
+
+    huellas = [cache_disco.huella_matriz(m) for m in (A, B, C) if m is not None]
+    clave_mantel = cache_disco.clave("mantel", huellas, permutaciones, semilla)
+    guardado = cache_disco.cargar_array(huellas[0], clave_mantel)
+    if guardado is not None:
+        r, p, r_parcial, p_parcial = (float(v) for v in guardado)
+        if C is None:
+            r_parcial = p_parcial = None
+        return {"r": r, "p": p, "r_parcial": r_parcial, "p_parcial": p_parcial,
+                "muestras": len(A), "permutaciones": permutaciones}
+
+    Z = np.stack([estandarizar(m.values) for m in (A, B, C) if m is not None])
+    r_obs = estadisticos(*Z)
+
+    with memoria_compartida.temporal({"Z": Z}) as referencia:
+        del Z
+        semillas = np.random.SeedSequence(semilla).spawn(
+            -(-permutaciones // PERMUTACIONES_POR_TRABAJO))
+        pendientes = []
+        for i, s in enumerate(semillas):
+            cuantas = min(PERMUTACIONES_POR_TRABAJO, permutaciones - i * PERMUTACIONES_POR_TRABAJO)
+            pendientes.append(gestor.enviar((*grupo, i), (clave_mantel, i), trabajos.tarea_mantel,
+                                            referencia, s, cuantas, r_obs))
+        gestor.esperar_todos(pendientes, al_progresar=al_progresar, unidad="bloques")
+        fallidos = [t.error or "cancelado" for t in pendientes if t.estado != "terminado"]
+        if fallidos:
+            raise RuntimeError(fallidos[0])
+
+    mayores = sum(t.resultado for t in pendientes)
+    p = (1 + mayores) / (1 + permutaciones)
+    resultado = {"r": r_obs[0], "p": float(p[0]),
+                 "r_parcial": r_obs[1],
+                 "p_parcial": None if C is None else float(p[1]) if np.isfinite(r_obs[1]) else np.nan,
+                 "muestras": len(A), "permutaciones": permutaciones}
+    cache_disco.guardar_array(huellas[0], clave_mantel, np.array(
+        [np.nan if resultado[k] is None else resultado[k] for k in ("r", "p", "r_parcial", "p_parcial")]))
+    return resultado
@@ -0,0 +1,95 @@
+# mds.py
+import numpy as np
+
+# scipy y la caché se importan dentro de las funciones: app.py carga este
+# módulo al arrancar
+
+# =====================================================
+# Escalado multidimensional clásico (MDS de Torgerson)
+# =====================================================
+#
+# Las coordenadas salen de los autovectores principales de la matriz doble
+# centrada B = -1/2 · J D² J (J = I - 11ᵀ/n). B no se construye nunca: eigsh
+# solo necesita multiplicar B por vectores, y eso es centrar, multiplicar por
+# D² y volver a centrar. Así se calculan unos pocos autopares sin
+# descomponer la matriz entera (n = 20 000 cabe en segundos).
+
+DIMENSIONES = 3
+
+
+def _operador_centrado(D2):
+    from scipy.sparse.linalg import LinearOperator
+
+    def producto(x):
+        x = np.asarray(x, dtype=D2.dtype).reshape(len(D2), -1)
+        x = x - x.mean(axis=0)
+        y = D2 @ x
+        y -= y.mean(axis=0)
+        return -0.5 * y
+
+    n = len(D2)
+    return LinearOperator((n, n), matvec=producto, matmat=producto, dtype=D2.dtype)
+
+
+def mds_clasico(D, dimensiones=DIMENSIONES, semilla=0):
+    """
+    Coordenadas (n, dimensiones) de la matriz de distancias D y fracción de la
+    traza de B que explica cada eje. Los ejes van ordenados de mayor a menor
+    autovalor; los autovalores negativos (distancias no euclídeas) dan ejes
+    nulos.
+    """
+    D = np.asarray(D)
+    n = len(D)
+    # float32 basta para los autovectores y reduce a la mitad la memoria de D²
+    D2 = np.square(D, dtype=np.float32)
+    traza = float(D2.sum(dtype=np.float64)) / (2 * n)
+
+    if dimensiones >= n - 1:
+        # Demasiado pequeña para ARPACK: descomposición completa
+        J = np.eye(n) - 1.0 / n
+        valores, vectores = np.linalg.eigh(-0.5 * J @ D2.astype(np.float64) @ J)
+        valores, vectores = valores[::-1][:dimensiones], vectores[:, ::-1][:, :dimensiones]
+    else:
+        from scipy.sparse.linalg import eigsh
+
+        # v0 fijo: resultados reproducibles entre ejecuciones y procesos
+        v0 = np.random.default_rng(semilla).standard_normal(n).astype(D2.dtype)
+        valores, vectores = eigsh(_operador_centrado(D2), k=dimensiones, which="LA", v0=v0)
+        orden = np.argsort(valores)[::-1]
+        valores, vectores = valores[orden].astype(np.float64), vectores[:, orden].astype(np.float64)
+
+    # Signo de cada eje fijado por su componente de mayor valor absoluto
+    signos = np.sign(vectores[np.abs(vectores).argmax(axis=0), np.arange(vectores.shape[1])])
+    signos[signos == 0] = 1.0
+    valores = np.maximum(valores, 0.0)
+    coordenadas = vectores * signos * np.sqrt(valores)
+
+    if coordenadas.shape[1] < dimensiones:
+        coordenadas = np.pad(coordenadas, ((0, 0), (0, dimensiones - coordenadas.shape[1])))
+        valores = np.pad(valores, (0, dimensiones - len(valores)))
+    explicada = valores / traza if traza > 0 else np.zeros_like(valores)
+    return coordenadas.astype(np.float32), explicada
+
+
+def mds_cacheado(matrix_df, huella=None, dimensiones=DIMENSIONES):
+    """
+    Como mds_clasico, guardado en la caché de disco bajo la huella de la
+    matriz completa y el subconjunto de muestras de matrix_df.
+    """
+    import cache_disco
+
+    if huella is None:
+        huella = cache_disco.huella_matriz(matrix_df)
+    base = ("mds", cache_disco.huella_muestras(matrix_df.index), dimensiones)
+    clave_coord = cache_disco.clave(*base, "coordenadas")
+    clave_expl = cache_disco.clave(*base, "explicada")
+
+    coordenadas = cache_disco.cargar_array(huella, clave_coord)
+    explicada = cache_disco.cargar_array(huella, clave_expl)
+    if coordenadas is not None and explicada is not None:
+        return coordenadas, explicada
+
+    coordenadas, explicada = mds_clasico(matrix_df.values, dimensiones)
+    cache_disco.guardar_array(huella, clave_expl, explicada)
+    cache_disco.guardar_array(huella, clave_coord, coordenadas)
+    return coordenadas, explicada
@@ -0,0 +1,82 @@
+# medoides.py
+import numpy as np
+
+# =====================================================
+# Medoides y muestras representativas de cada cluster
+# =====================================================
+#
+# El medoide de un cluster es la muestra con menor suma de distancias al
+# resto de su cluster; las n más centrales son las n con menor suma. Para
+# todos los cortes K = K_MIN..K_MAX a la vez, las sumas salen de recorrer la
+# matriz por bloques de filas completas y multiplicar cada bloque por el
+# one-hot apilado de todos los cortes. No se construye ninguna submatriz por
+# cluster ni ninguna copia de la matriz: los bloques son vistas de los
+# valores del DataFrame.
+
+BLOQUE_FILAS = 2048
+N_REPRESENTANTES = 3
+
+
+def sumas_intra(leer_filas, n, asignaciones, bloque=BLOQUE_FILAS, progreso=None):
+    """
+    leer_filas(ini, fin) -> filas completas (fin - ini, n). Suma de
+    distancias de cada muestra a las de su propio cluster, para cada corte:
+    array (n, cortes).
+    """
+    import calidad_clusters
+
+    one_hot, _, columnas = calidad_clusters.one_hot_apilado(asignaciones)
+    sumas = np.empty(asignaciones.shape, dtype=np.float64)
+    for ini in range(0, n, bloque):
+        fin = min(ini + bloque, n)
+        por_cluster = leer_filas(ini, fin) @ one_hot
+        sumas[ini:fin] = np.take_along_axis(por_cluster, columnas[ini:fin], axis=1)
+        if progreso:
+            progreso(fin / n, f"Medoides: {fin}/{n} filas")
+    return sumas
+
+
+def representantes(sumas, asignaciones, K, muestras, n_top=N_REPRESENTANTES, k_min=2):
+    """
+    Tabla (Cluster, Rango, Muestra, Distancia media) con las n_top muestras
+    más centrales de cada cluster del corte K; rango 1 = medoide.
+    """
+    import pandas as pd
+
+    j = K - k_min
+    etiquetas = asignaciones[:, j]
+    tamanos = np.bincount(etiquetas)[etiquetas]
+    # Orden por cluster y, dentro de cada uno, por suma de distancias
+    orden = np.lexsort((sumas[:, j], etiquetas))
+    etiquetas_ord = etiquetas[orden]
+    inicio_cluster = np.r_[0, np.flatnonzero(np.diff(etiquetas_ord)) + 1]
+    rango = np.arange(len(orden)) - np.repeat(inicio_cluster, np.diff(np.r_[inicio_cluster, len(orden)]))
+    elegidos = orden[rango < n_top]
+
+    media = sumas[elegidos, j] / np.maximum(tamanos[elegidos] - 1, 1)
+    return pd.DataFrame({
+        "Cluster": etiquetas[elegidos],
+        "Rango": rango[rango < n_top] + 1,
+        "Muestra": np.asarray(muestras)[elegidos],
+        "Tamaño del cluster": tamanos[elegidos],
+        "Distancia media": media,
+    })
+
+
+def sumas_cacheadas(matrix_df, metodo, huella=None, progreso=None):
+    """sumas_intra de todos los cortes del linkage, guardadas en la caché de disco."""
+    import cache_disco
+
+    if huella is None:
+        huella = cache_disco.huella_matriz(matrix_df)
+    clave_sumas = cache_disco.clave("medoides", cache_disco.huella_muestras(matrix_df.index), metodo)
+    sumas = cache_disco.cargar_array(huella, clave_sumas)
+    if sumas is not None:
+        return sumas
+
+    asignaciones = cache_disco.asignaciones_cacheadas(matrix_df, metodo, huella=huella)
+    valores = matrix_df.values
+    sumas = sumas_intra(lambda ini, fin: valores[ini:fin], len(valores), asignaciones,
+                        progreso=progreso)
+    cache_disco.guardar_array(huella, clave_sumas, sumas)
+    return sumas
@@ -0,0 +1,203 @@
+# memoria_compartida.py
+import atexit
+import threading
+import uuid
+from contextlib import contextmanager
+import numpy as np
+
+# =====================================================
+# Registro de bloques de memoria compartida
+# =====================================================
+#
+# Los trabajos del pool reciben sus argumentos serializados con pickle; con
+# matrices grandes eso copia la matriz entera en cada proceso. En su lugar, el
+# servidor publica los arrays una vez en bloques de
+# multiprocessing.shared_memory y a los trabajos solo les llega la referencia
+# (un dict con el nombre, la forma y el dtype de cada bloque, que se serializa
+# en unos bytes). Los procesos se adjuntan por nombre y leen los arrays sin
+# copiarlos.
+#
+# Cada publicación tiene una clave (la huella de la matriz, por ejemplo) y un
+# conjunto de titulares (las sesiones que la usan): publicar la misma clave
+# desde otra sesión solo añade el titular, y el bloque se libera (close +
+# unlink) cuando se suelta el último. Al cerrarse una sesión de Streamlit su
+# session_state se descarta; el testigo que guarda allí suelta sus
+# publicaciones al recogerse. Al salir del servidor se libera todo.
+#
+# Solo el servidor crea y libera bloques. Los procesos del pool comparten el
+# resource_tracker de la app, así que adjuntarse no añade otro registro y no
+# deben desregistrar ni hacer unlink: el bloque lo libera quien lo creó.
+
+_lock = threading.Lock()
+# clave -> {"bloques": [SharedMemory], "referencia": dict, "titulares": set}
+_publicaciones = {}
+
+
+def _crear(array):
+    from multiprocessing import shared_memory
+
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, {"nombre": shm.name, "forma": array.shape, "dtype": array.dtype.str}
+
+
+def _liberar(publicacion):
+    for shm in publicacion["bloques"]:
+        shm.close()
+        shm.unlink()
+
+
+def publicar(clave, arrays, titular):
+    """
+    Publica {nombre: array} bajo 'clave' para 'titular' y devuelve la
+    referencia que se pasa a los trabajos. Si la clave ya está publicada, solo
+    se añade el titular (los arrays no se vuelven a copiar).
+    """
+    with _lock:
+        publicacion = _publicaciones.get(clave)
+        if publicacion is None:
+            bloques, referencia = [], {}
+            try:
+                for nombre, array in arrays.items():
+                    shm, referencia[nombre] = _crear(array)
+                    bloques.append(shm)
+            except Exception:
+                _liberar({"bloques": bloques})
+                raise
+            publicacion = {"bloques": bloques, "referencia": referencia, "titulares": set()}
+            _publicaciones[clave] = publicacion
+        publicacion["titulares"].add(titular)
+        return publicacion["referencia"]
+
+
+def arrays_matriz(matrix_df):
+    """
+    {"distancias": triángulo inferior condensado (orden de almacen_matrices),
+    "muestras": etiquetas} de un DataFrame cuadrado. Las distancias conservan
+    el dtype del DataFrame: el bootstrap de estabilidad vuelve a agrupar con
+    ellas y compara con el árbol calculado sobre el DataFrame, así que con
+    otro redondeo los empates cercanos cambiarían de rama.
+    """
+    valores = matrix_df.values
+    n = len(valores)
+    dtype = valores.dtype if np.issubdtype(valores.dtype, np.floating) else np.float64
+    distancias = np.empty(n * (n - 1) // 2, dtype=dtype)
+    # Fila a fila: tril_indices de una matriz grande ocuparía más que ella
+    for i in range(1, n):
+        distancias[i * (i - 1) // 2:i * (i + 1) // 2] = valores[i, :i]
+    return {"distancias": distancias, "muestras": np.array([str(m) for m in matrix_df.index])}
+
+
+def publicar_matriz(clave, matrix_df, titular):
+    """publicar() de arrays_matriz; con la clave ya publicada no se recorre la matriz."""
+    with _lock:
+        if clave in _publicaciones:
+            _publicaciones[clave]["titulares"].add(titular)
+            return _publicaciones[clave]["referencia"]
+    return publicar(clave, arrays_matriz(matrix_df), titular)
+
+
+def soltar(clave, titular):
+    """Quita el titular de la publicación; sin titulares, se libera el bloque."""
+    with _lock:
+        publicacion = _publicaciones.get(clave)
+        if publicacion is None:
+            return
+        publicacion["titulares"].discard(titular)
+        if publicacion["titulares"]:
+            return
+        del _publicaciones[clave]
+    _liberar(publicacion)
+
+
+def soltar_titular(titular):
+    """Suelta todas las publicaciones del titular (fin de sesión, matriz nueva)."""
+    with _lock:
+        claves = [c for c, p in _publicaciones.items() if titular in p["titulares"]]
+    for clave in claves:
+        soltar(clave, titular)
+
+
+def titulares(clave):
+    with _lock:
+        publicacion = _publicaciones.get(clave)
+        return set(publicacion["titulares"]) if publicacion else set()
+
+
+@contextmanager
+def temporal(arrays):
+    """Publicación de un solo uso: se libera al salir del bloque with."""
+    clave = titular = uuid.uuid4().hex
+    referencia = publicar(clave, arrays, titular)
+    try:
+        yield referencia
+    finally:
+        soltar(clave, titular)
+
+
+class _Testigo:
+    def __init__(self, titular):
+        self.titular = titular
+
+    def __del__(self):
+        soltar_titular(self.titular)
+
+
+def testigo(titular):
+    """
+    Objeto para guardar en el session_state: cuando Streamlit descarta la
+    sesión y se recoge, suelta las publicaciones del titular.
+    """
+    return _Testigo(titular)
+
+
+@atexit.register
+def _liberar_todo():
+    with _lock:
+        publicaciones = list(_publicaciones.values())
+        _publicaciones.clear()
+    for publicacion in publicaciones:
+        _liberar(publicacion)
+
+# =====================================================
+# En los procesos del pool
+# =====================================================
+
+@contextmanager
+def adjuntar(referencia):
+    """
+    {nombre: array de solo lectura} sobre los bloques de la referencia, sin
+    copiarlos. Los arrays no deben usarse fuera del bloque with.
+    """
+    from multiprocessing import shared_memory
+
+    bloques, arrays = [], {}
+    try:
+        for nombre, r in referencia.items():
+            shm = shared_memory.SharedMemory(name=r["nombre"])
+            bloques.append(shm)
+            array = np.ndarray(r["forma"], dtype=np.dtype(r["dtype"]), buffer=shm.buf)
+            array.flags.writeable = False
+            arrays[nombre] = array
+        yield arrays
+    finally:
+        arrays.clear()
+        for shm in bloques:
+            try:
+                shm.close()
+            except BufferError:
+                # Queda alguna vista del bloque viva; se cierra al terminar el proceso
+                pass
+
+
+def posiciones(referencia, muestras):
+    """Posición de cada muestra en una matriz publicada (en el servidor)."""
+    import pandas as pd
+
+    with adjuntar({"muestras": referencia["muestras"]}) as arrays:
+        indice = pd.Index(arrays["muestras"].copy())
+    pos = indice.get_indexer([str(m) for m in muestras])
+    if (pos < 0).any():
+        raise KeyError("Hay muestras que no están en la matriz publicada")
+    return pos
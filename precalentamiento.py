@@ -0,0 +1,103 @@
+# precalentamiento.py
+import os
+import sys
+import time
+import functools
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+
+import trabajos
+
+# =====================================================
+# Precálculo de las matrices precargadas
+# =====================================================
+#
+# Recorre data/matrices y, para cada matriz, subgrupo predefinido y método de
+# linkage, deja en la caché de disco el CSV parseado y el linkage. Así el
+# primer usuario que elige una combinación no paga el cálculo completo. Los
+# almacenes .matriz que no caben en memoria (fuera_de_memoria.necesita_disco)
+# se saltan: cargarlos como DataFrame en cada proceso del pool la agotaría.
+#
+# Se activa al arrancar la app con CLUSTERMAP_PRECALENTAR=1, o a mano:
+#     python precalentamiento.py
+
+# Módulo cuyos helpers se usan para limpiar nombres y definir subgrupos
+MODULO = "generar_clustermap"
+
+
+def tareas_por_prioridad(carpeta=None):
+    """
+    Lista (ruta, subgrupo, metodo) ordenada para que salgan primero las
+    opciones por defecto de la app (average, "Todos") de todas las matrices,
+    y después las combinaciones más alejadas de ellas.
+    """
+    import datos
+    import almacen_matrices
+    import fuera_de_memoria
+
+    carpeta = carpeta or datos.PRELOADED_MATRIX_DIR
+    rutas = []
+    for nombre in datos.listar_matrices(carpeta):
+        ruta = os.path.join(carpeta, nombre)
+        if (almacen_matrices.es_almacen(ruta)
+                and fuera_de_memoria.necesita_disco(almacen_matrices.leer_meta(ruta)["n"])):
+            continue
+        rutas.append(ruta)
+    tareas = []
+    for i_m, metodo in enumerate(datos.METODOS):
+        for i_g, grupo in enumerate(datos.SUBGRUPOS):
+            for ruta in rutas:
+                tareas.append((i_m + i_g, ruta, grupo, metodo))
+    tareas.sort(key=lambda t: t[0])
+    return [t[1:] for t in tareas]
+
+
+@functools.lru_cache(maxsize=2)
+def _cargar(ruta, version):
+    # Cada proceso del pool parsea una matriz una sola vez para todos sus subgrupos
+    import datos
+
+    mod = importlib.import_module(MODULO)
+    preparados = datos.preparar_datos(datos.leer_matriz(ruta), None, mod)
+    preparados["subgrupos"] = datos.definir_subgrupos(
+        preparados["df"].index.tolist(), preparados["annotations"])
+    return preparados
+
+
+def precalentar_uno(ruta, grupo, metodo):
+    import cache_disco
+    import datos
+
+    preparados = _cargar(ruta, datos.version_matriz(ruta))
+    muestras = preparados["subgrupos"][grupo]
+    if len(muestras) < 3:
+        return ruta, grupo, metodo, 0.0
+    inicio = time.perf_counter()
+    cache_disco.linkage_cacheado(preparados["df"].loc[muestras, muestras], metodo,
+                                 huella=preparados["huella"])
+    return ruta, grupo, metodo, time.perf_counter() - inicio
+
+
+def iniciar(max_procesos=None, carpeta=None):
+    """
+    Lanza el precálculo en un pool de procesos y vuelve enseguida.
+    Devuelve el executor y la lista de futures, en orden de prioridad.
+    """
+    if max_procesos is None:
+        max_procesos = int(os.environ.get("CLUSTERMAP_TRABAJADORES",
+                                          max(1, (os.cpu_count() or 2) // 2)))
+    executor = ProcessPoolExecutor(max_workers=max_procesos, mp_context=trabajos._contexto())
+    with trabajos._sin_main_de_streamlit():
+        # El pool arranca sus procesos al enviar el primer trabajo
+        futures = [executor.submit(precalentar_uno, *t) for t in tareas_por_prioridad(carpeta)]
+    executor.shutdown(wait=False)
+    return executor, futures
+
+
+if __name__ == "__main__":
+    # Importado por nombre para que los procesos del pool encuentren las funciones
+    import precalentamiento
+    _, futures = precalentamiento.iniciar()
+    for f in futures:
+        ruta, grupo, metodo, segundos = f.result()
+        print(f"{os.path.basename(ruta)} | {grupo} | {metodo}: {segundos:.2f} s", file=sys.stderr)
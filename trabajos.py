@@ -0,0 +1,490 @@
+# trabajos.py
+import os
+import io
+import sys
+import time
+import threading
+import importlib
+import multiprocessing as mp
+from collections import deque
+from contextlib import contextmanager
+
+# =====================================================
+# Contexto de procesos
+# =====================================================
+
+# Módulos que el forkserver deja importados para que cada trabajo arranque rápido.
+# Los módulos de la app importan lo pesado de forma diferida, así que se listan aparte.
+MODULOS_PRECARGA = ["trabajos", "cache_disco", "generar_clustermap", "dendrograma_clusters",
+                    "mds", "vecinos", "calidad_clusters", "estabilidad",
+                    "mantel", "medoides", "densidad", "comunidades", "fuera_de_memoria",
+                    "memoria_compartida", "cofenetica",
+                    "pandas", "matplotlib.pyplot", "seaborn",
+                    "scipy.cluster.hierarchy"]
+
+
+def _contexto():
+    """
+    Streamlit ejecuta varios hilos, así que no usamos 'fork' directamente.
+    En Linux el forkserver con módulos precargados evita pagar la importación
+    de pandas/seaborn en cada trabajo; en el resto de plataformas, 'spawn'.
+    """
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(MODULOS_PRECARGA)
+        return ctx
+    return mp.get_context("spawn")
+
+
+@contextmanager
+def _sin_main_de_streamlit():
+    """
+    Streamlit registra app.py como __main__; si el proceso hijo lo ve,
+    multiprocessing lo re-ejecuta al arrancar. Lo ocultamos mientras se lanza.
+    """
+    main = sys.modules.get("__main__")
+    ruta = main.__dict__.pop("__file__", None) if main is not None else None
+    try:
+        yield
+    finally:
+        if ruta is not None:
+            main.__file__ = ruta
+
+
+def _ejecutar(cola, funcion, args, kwargs):
+    def progreso(fraccion, mensaje=""):
+        cola.put(("progreso", float(fraccion), mensaje))
+
+    try:
+        resultado = funcion(*args, progreso=progreso, **kwargs)
+        cola.put(("ok", resultado))
+    except Exception as e:
+        cola.put(("error", f"{type(e).__name__}: {e}"))
+
+
+# =====================================================
+# Trabajo individual
+# =====================================================
+
+class Trabajo:
+    """
+    Un cálculo enviado al pool. El estado pasa por
+    'pendiente' -> 'ejecutando' -> 'terminado' | 'error' | 'cancelado'.
+    """
+
+    def __init__(self, grupo, clave, funcion, args, kwargs):
+        self.grupo = grupo
+        self.clave = clave
+        self.funcion = funcion
+        self.args = args
+        self.kwargs = kwargs
+        self.estado = "pendiente"
+        self.progreso = 0.0
+        self.mensaje = "En cola"
+        self.resultado = None
+        self.error = None
+        self.proceso = None
+        self.cola = None
+
+    def terminado(self):
+        return self.estado in ("terminado", "error", "cancelado")
+
+    def _leer_mensajes(self):
+        if self.cola is None:
+            return
+        self._vaciar_cola()
+        if self.estado == "ejecutando" and not self.proceso.is_alive():
+            # El proceso pudo dejar el resultado en la cola y salir entre la
+            # lectura anterior y is_alive(): al salir ya lo ha volcado entero
+            # en la tubería, así que se vuelve a leer antes de darlo por caído
+            self._vaciar_cola()
+            if self.estado == "ejecutando":
+                # Murió sin avisar (memoria, señal...)
+                self.estado = "error"
+                self.error = f"El proceso terminó con código {self.proceso.exitcode}"
+
+    def _vaciar_cola(self):
+        while True:
+            try:
+                msg = self.cola.get_nowait()
+            except Exception:
+                break
+            if msg[0] == "progreso":
+                self.progreso, self.mensaje = msg[1], msg[2]
+            elif msg[0] == "ok":
+                self.estado, self.resultado, self.progreso = "terminado", msg[1], 1.0
+            else:
+                self.estado, self.error = "error", msg[1]
+
+    def _liberar(self):
+        if self.proceso is not None:
+            self.proceso.join(timeout=0)
+            self.proceso = None
+        if self.cola is not None:
+            self.cola.close()
+            self.cola = None
+
+
+# =====================================================
+# Gestor compartido por todas las sesiones
+# =====================================================
+
+class GestorTrabajos:
+    """
+    Pool de procesos con cancelación. Cada trabajo pertenece a un grupo
+    (p. ej. la sesión y el tipo de cálculo); al enviar un trabajo nuevo a un
+    grupo se cancelan los anteriores cuya clave ya no coincide, de modo que
+    mover un widget a mitad de un cálculo no encola otro cálculo completo.
+    """
+
+    def __init__(self, max_procesos=None):
+        if max_procesos is None:
+            max_procesos = int(os.environ.get(
+                "CLUSTERMAP_TRABAJADORES", max(1, (os.cpu_count() or 2) // 2)))
+        self.max_procesos = max_procesos
+        self._ctx = _contexto()
+        self._lock = threading.Lock()
+        self._por_grupo = {}
+        self._cola = deque()
+        self._activos = []
+
+    def enviar(self, grupo, clave, funcion, *args, **kwargs):
+        """
+        Devuelve el trabajo del grupo con esa clave (reutilizándolo si ya
+        existe) y cancela los que hayan quedado obsoletos.
+        """
+        with self._lock:
+            trabajo = self._por_grupo.get(grupo)
+            if trabajo is not None and trabajo.clave == clave and trabajo.estado != "cancelado":
+                self._actualizar()
+                return trabajo
+            if trabajo is not None:
+                self._cancelar(trabajo)
+
+            trabajo = Trabajo(grupo, clave, funcion, args, kwargs)
+            self._por_grupo[grupo] = trabajo
+            self._cola.append(trabajo)
+            self._actualizar()
+            return trabajo
+
+    def cancelar_grupo(self, prefijo):
+        """
+        Cancela los trabajos de los grupos que empiezan por 'prefijo' (una
+        tupla): (sesion_id,) cancela todos los de la sesión.
+        """
+        with self._lock:
+            for grupo in [g for g in self._por_grupo if g[:len(prefijo)] == prefijo]:
+                self._cancelar(self._por_grupo.pop(grupo))
+
+    def actualizar(self):
+        with self._lock:
+            self._actualizar()
+
+    def esperar(self, trabajo, intervalo=0.1, al_progresar=None):
+        """Bloquea hasta que el trabajo termina, avisando del progreso."""
+        while True:
+            self.actualizar()
+            if al_progresar is not None:
+                al_progresar(trabajo)
+            if trabajo.terminado():
+                return trabajo
+            time.sleep(intervalo)
+
+    def esperar_todos(self, trabajos, intervalo=0.1, al_progresar=None, unidad="trabajos"):
+        """
+        Como esperar, para varios trabajos a la vez (p. ej. bloques de un mismo
+        cálculo repartidos en el pool). al_progresar(fraccion, mensaje).
+        """
+        while True:
+            self.actualizar()
+            hechos = sum(t.terminado() for t in trabajos)
+            if al_progresar is not None:
+                al_progresar(sum(t.progreso for t in trabajos) / len(trabajos),
+                             f"{hechos}/{len(trabajos)} {unidad}")
+            if hechos == len(trabajos):
+                return trabajos
+            time.sleep(intervalo)
+
+    # -------------------------
+    # Internos (con lock tomado)
+    # -------------------------
+
+    def _cancelar(self, trabajo):
+        if trabajo.estado == "pendiente":
+            self._cola.remove(trabajo)
+        elif trabajo.estado == "ejecutando":
+            trabajo.proceso.terminate()
+            self._activos.remove(trabajo)
+        if not trabajo.terminado():
+            trabajo.estado = "cancelado"
+            trabajo.mensaje = "Cancelado"
+        trabajo._liberar()
+
+    def _actualizar(self):
+        for trabajo in list(self._activos):
+            trabajo._leer_mensajes()
+            if trabajo.terminado():
+                self._activos.remove(trabajo)
+                trabajo._liberar()
+
+        while self._cola and len(self._activos) < self.max_procesos:
+            trabajo = self._cola.popleft()
+            trabajo.cola = self._ctx.Queue()
+            trabajo.proceso = self._ctx.Process(
+                target=_ejecutar,
+                args=(trabajo.cola, trabajo.funcion, trabajo.args, trabajo.kwargs),
+                daemon=True,
+            )
+            with _sin_main_de_streamlit():
+                trabajo.proceso.start()
+            trabajo.estado = "ejecutando"
+            trabajo.mensaje = "Iniciando"
+            self._activos.append(trabajo)
+
+
+# =====================================================
+# Tareas que se ejecutan en los procesos del pool
+# =====================================================
+
+def tarea_linkage(matrix_df, metodo, huella=None, progreso=None):
+    import cache_disco
+
+    if progreso:
+        progreso(0.05, f"Linkage ({metodo})")
+    # Si ya está en la caché de disco (de esta u otra ejecución) se lee de ahí
+    Z = cache_disco.linkage_cacheado(matrix_df, metodo, huella=huella)
+    if progreso:
+        progreso(1.0, "Linkage listo")
+    return Z
+
+
+def tarea_orden_optimo(matrix_df, metodo, huella=None, progreso=None):
+    import cache_disco
+
+    if progreso:
+        progreso(0.1, "Calculando el orden óptimo de las hojas")
+    return cache_disco.linkage_optimo_cacheado(matrix_df, metodo, huella=huella)
+
+
+def tarea_asignaciones(matrix_df, metodo, huella=None, progreso=None):
+    import cache_disco
+
+    if progreso:
+        progreso(0.05, f"Linkage ({metodo})")
+    cache_disco.linkage_cacheado(matrix_df, metodo, huella=huella)
+    asignaciones = cache_disco.asignaciones_cacheadas(matrix_df, metodo, huella=huella)
+    if progreso:
+        progreso(1.0, "Clusters listos")
+    return asignaciones
+
+
+def tarea_mds(matrix_df, huella=None, dimensiones=3, progreso=None):
+    import mds
+
+    if progreso:
+        progreso(0.05, "MDS clásico")
+    coordenadas, explicada = mds.mds_cacheado(matrix_df, huella=huella, dimensiones=dimensiones)
+    if progreso:
+        progreso(1.0, "MDS listo")
+    return coordenadas, explicada
+
+
+def tarea_calidad(matrix_df, metodo, huella=None, progreso=None):
+    import calidad_clusters
+
+    if progreso:
+        progreso(0.05, f"Calidad ({metodo})")
+    calidad = calidad_clusters.calidad_cacheada(matrix_df, metodo, huella=huella)
+    if progreso:
+        progreso(1.0, "Calidad lista")
+    return calidad
+
+
+def tarea_estabilidad(referencia, posiciones, Z, metodo, fraccion, semillas, progreso=None):
+    import estabilidad
+
+    return estabilidad.replicas_en_bloque(referencia, posiciones, Z, metodo, fraccion, semillas,
+                                          progreso=progreso)
+
+
+def tarea_mantel(referencia, semilla, permutaciones, r_obs, progreso=None):
+    import mantel
+
+    return mantel.permutaciones_en_bloque(referencia, semilla, permutaciones, r_obs,
+                                          progreso=progreso)
+
+
+def tarea_medoides(matrix_df, metodo, huella=None, progreso=None):
+    import medoides
+
+    return medoides.sumas_cacheadas(matrix_df, metodo, huella=huella, progreso=progreso)
+
+
+def tarea_densidad(matrix_df, tamano_minimo, min_muestras=None, huella=None, progreso=None):
+    import densidad
+
+    return densidad.hdbscan_cacheado(matrix_df, tamano_minimo, min_muestras, huella=huella,
+                                     progreso=progreso)
+
+
+def tarea_comunidades(matrix_df, k, resolucion, huella=None, progreso=None):
+    import comunidades
+
+    return comunidades.comunidades_cacheadas(matrix_df, k, resolucion, huella=huella,
+                                             progreso=progreso)
+
+
+def tarea_indice_vecinos(matrix_df, huella=None, progreso=None):
+    import vecinos
+
+    return vecinos.indice_cacheado(matrix_df, huella=huella, progreso=progreso)
+
+
+def tarea_clustermap_disco(ruta, seleccion, annotations_df, selected_annotations, figsize,
+                           memoria_mb, celdas, louvain=None, progreso=None):
+    """
+    Clustermap agregado de un almacén .matriz sin cargarlo en memoria:
+    single linkage por Borůvka y heatmap por franjas, los dos en la caché.
+    louvain: (k, resolución) para añadir la barra de comunidades del
+    subgrupo, o None.
+    """
+    import fuera_de_memoria
+    import corte_dinamico
+
+    escala = lambda a, b: (lambda f, m: progreso(a + (b - a) * f, m)) if progreso else None
+    Z = fuera_de_memoria.linkage_almacen(ruta, seleccion, memoria_mb, progreso=escala(0.0, 0.5))
+    hojas, _ = corte_dinamico.orden_hojas(Z)
+    agregada = fuera_de_memoria.agregado_almacen(ruta, seleccion, hojas, celdas, memoria_mb,
+                                                 progreso=escala(0.5, 0.7))
+    barras_clusters = {}
+    if louvain is not None:
+        import comunidades
+
+        k, resolucion = louvain
+        barras_clusters["Louvain"] = comunidades.comunidades_almacen(
+            ruta, k, resolucion, progreso=escala(0.7, 0.9), seleccion=seleccion,
+            memoria_mb=memoria_mb)
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import generar_clustermap
+
+    if progreso:
+        progreso(0.9, "Dibujando figura")
+    fig = generar_clustermap.plot_clustermap_agregado(agregada, Z, annotations_df,
+                                                      selected_annotations, figsize=figsize,
+                                                      barras_clusters=barras_clusters)
+    resultado = {"comunidades": int(barras_clusters["Louvain"].max())} if barras_clusters else {}
+    for nombre, formato, dpi in FORMATOS_VISTA:
+        buf = io.BytesIO()
+        fig.savefig(buf, format=formato, dpi=dpi, bbox_inches="tight")
+        resultado[nombre] = buf.getvalue()
+    plt.close(fig)
+    return resultado
+
+
+def tarea_cofenetica(referencia, posiciones, Z, Z_orden, huella, celdas, progreso=None):
+    """
+    Distancias originales frente a cofenéticas de la submatriz, agregadas por
+    franjas en el orden de la figura. Devuelve la figura (PNG) y α, β.
+    """
+    import cofenetica
+
+    comparacion = cofenetica.comparar(referencia, posiciones, Z, Z_orden, huella, celdas,
+                                      progreso=progreso)
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import generar_clustermap
+
+    if progreso:
+        progreso(0.95, "Dibujando figura")
+    fig = generar_clustermap.plot_cofenetica(comparacion, len(posiciones))
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=100, bbox_inches="tight")
+    plt.close(fig)
+    return {"vista": buf.getvalue(), "alfa": comparacion["alfa"], "beta": comparacion["beta"]}
+
+
+# (nombre, formato, dpi) de cada salida de tarea_render
+FORMATOS_VISTA = [("vista", "png", 100)]
+FORMATOS_EXPORTACION = [("png", "png", 300), ("pdf", "pdf", None)]
+
+
+def tarea_render(modulo, matrix_df, annotations_df, selected_annotations, metodo,
+                 Z, figsize, K=None, formatos=None, huella=None, resaltar=None, soporte=None,
+                 clusters=None, barras_clusters=None, progreso=None):
+    """
+    Dibuja la figura en el proceso del pool y devuelve los bytes listos para
+    mostrar y descargar, así la sesión no bloquea su hilo con matplotlib.
+    Cada formato se guarda en la caché de disco; si todos están, no se dibuja.
+    """
+    import cache_disco
+
+    pasos = formatos if formatos is not None else FORMATOS_VISTA + FORMATOS_EXPORTACION
+    con_leyendas = (modulo == "dendrograma_clusters" and (selected_annotations or barras_clusters)
+                    and any(nombre == "vista" for nombre, _, _ in pasos))
+    if con_leyendas:
+        pasos = pasos + [("leyendas", "png", 300)]
+
+    if huella is None:
+        huella = cache_disco.huella_matriz(matrix_df)
+    anotaciones = annotations_df[list(selected_annotations)].astype(str)
+    base = ("figura", modulo, cache_disco.huella_muestras(matrix_df.index),
+            cache_disco.huella_array(Z), list(selected_annotations),
+            cache_disco.huella_array(anotaciones.values.astype("U")), K, list(figsize),
+            list(resaltar or []), None if soporte is None else cache_disco.huella_array(soporte),
+            None if clusters is None else cache_disco.huella_array(clusters),
+            [[titulo, cache_disco.huella_array(e)] for titulo, e in (barras_clusters or {}).items()])
+    claves = {nombre: cache_disco.clave(*base, nombre, formato, dpi) for nombre, formato, dpi in pasos}
+
+    resultado = {}
+    for nombre, formato, _ in pasos:
+        datos = cache_disco.cargar_bytes(huella, claves[nombre], formato)
+        if datos is None:
+            break
+        resultado[nombre] = datos
+    else:
+        if progreso:
+            progreso(1.0, "Figura en caché")
+        return resultado
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    mod = importlib.import_module(modulo)
+
+    if progreso:
+        progreso(0.1, "Dibujando figura")
+    kwargs = dict(selected_annotations=selected_annotations, metodo=metodo,
+                  figsize=figsize, xticklabels=False, yticklabels=False, Z=Z, resaltar=resaltar)
+    if modulo == "dendrograma_clusters":
+        res = mod.plot_dendrograma(matrix_df, annotations_df, K=K, soporte=soporte,
+                                   clusters=clusters, barras_clusters=barras_clusters, **kwargs)
+    else:
+        res = mod.plot_clustermap(matrix_df, annotations_df, **kwargs)
+    fig = getattr(res, "fig", res)
+
+    resultado = {}
+    if con_leyendas:
+        fig_legends = mod.plot_legends(
+            selected_annotations,
+            paletas_extra={titulo: mod.clusters_palette(e) for titulo, e in (barras_clusters or {}).items()})
+    for i, (nombre, formato, dpi) in enumerate(pasos):
+        if progreso:
+            progreso(0.4 + 0.5 * i / len(pasos), f"Exportando {nombre.upper()}")
+        buf = io.BytesIO()
+        origen = fig_legends if nombre == "leyendas" else fig
+        origen.savefig(buf, format=formato, dpi=dpi, bbox_inches="tight")
+        resultado[nombre] = buf.getvalue()
+        cache_disco.guardar_bytes(huella, claves[nombre], formato, resultado[nombre])
+    plt.close(fig)
+    if con_leyendas:
+        plt.close(fig_legends)
+
+    if progreso:
+        progreso(1.0, "Figura lista")
+    return resultado
@@ -0,0 +1,98 @@
+# vecinos.py
+import numpy as np
+
+# =====================================================
+# Índice de k vecinos más cercanos
+# =====================================================
+#
+# Para cada muestra de la matriz cargada se guardan sus K_INDICE vecinos más
+# cercanos (sin ella misma) ordenados por distancia: índices en int32 y
+# distancias en float32, es decir, 8 bytes por vecino. Se construye por
+# bloques de filas con np.argpartition, sin ordenar filas completas, y se
+# guarda en la caché de disco bajo la huella de la matriz. Una consulta es
+# solo leer una fila del índice.
+
+K_INDICE = 50
+BLOQUE_FILAS = 1024
+# Desde un almacén cada fila se reconstruye con índices int64 del triángulo:
+# bloques más pequeños para no multiplicar la memoria
+BLOQUE_ALMACEN = 128
+
+
+def construir_indice(D, k=K_INDICE, bloque=BLOQUE_FILAS, progreso=None):
+    """
+    Devuelve (indices (n, k) int32, distancias (n, k) float32) de los k
+    vecinos de cada fila de la matriz de distancias D, de más a menos cercano.
+    """
+    D = np.asarray(D)
+    return construir_indice_filas(lambda ini, fin: D[ini:fin], len(D), k, bloque, progreso)
+
+
+def construir_indice_filas(leer_filas, n, k=K_INDICE, bloque=BLOQUE_FILAS, progreso=None):
+    """
+    Igual que construir_indice, pero leyendo la matriz por bloques con
+    leer_filas(ini, fin) -> filas completas (fin - ini, n); la matriz entera
+    no llega a estar en memoria.
+    """
+    k = min(k, n - 1)
+    indices = np.empty((n, k), dtype=np.int32)
+    distancias = np.empty((n, k), dtype=np.float32)
+    filas_todas = np.arange(n)
+
+    for ini in range(0, n, bloque):
+        fin = min(ini + bloque, n)
+        filas = filas_todas[ini:fin, None]
+        d = np.array(leer_filas(ini, fin), dtype=np.float32)
+        # La propia muestra no es vecina de sí misma
+        d[np.arange(fin - ini), filas_todas[ini:fin]] = np.inf
+        # Los k menores en cualquier orden, y luego solo esos k se ordenan
+        candidatos = np.argpartition(d, k - 1, axis=1)[:, :k]
+        d_cand = d[filas - ini, candidatos]
+        orden = np.argsort(d_cand, axis=1, kind="stable")
+        indices[ini:fin] = np.take_along_axis(candidatos, orden, axis=1)
+        distancias[ini:fin] = np.take_along_axis(d_cand, orden, axis=1)
+        if progreso:
+            progreso(fin / n, f"Índice kNN: {fin}/{n} filas")
+    return indices, distancias
+
+
+def indice_almacen(ruta, k=K_INDICE, bloque=BLOQUE_ALMACEN, progreso=None, seleccion=None):
+    """
+    Índice kNN de un almacén .matriz leyendo su triángulo condensado por
+    bloques. Con 'seleccion' (posiciones en el almacén), solo entre las
+    muestras del subgrupo y numerado según su posición en la selección.
+    """
+    import almacen_matrices
+
+    meta, _, distancias = almacen_matrices.abrir(ruta)
+    n = meta["n"]
+    if seleccion is None:
+        leer = lambda ini, fin: almacen_matrices.leer_filas(distancias, n, np.arange(ini, fin))
+        return construir_indice_filas(leer, n, k, bloque, progreso)
+    seleccion = np.asarray(seleccion, dtype=np.int64)
+    leer = lambda ini, fin: almacen_matrices.leer_filas(distancias, n, seleccion[ini:fin])[:, seleccion]
+    return construir_indice_filas(leer, len(seleccion), k, bloque, progreso)
+
+
+def indice_cacheado(matrix_df, huella=None, k=K_INDICE, progreso=None):
+    import cache_disco
+
+    if huella is None:
+        huella = cache_disco.huella_matriz(matrix_df)
+    clave_ind = cache_disco.clave("knn", k, "indices")
+    clave_dist = cache_disco.clave("knn", k, "distancias")
+    indices = cache_disco.cargar_array(huella, clave_ind)
+    distancias = cache_disco.cargar_array(huella, clave_dist)
+    if indices is not None and distancias is not None:
+        return indices, distancias
+
+    indices, distancias = construir_indice(matrix_df.values, k, progreso=progreso)
+    cache_disco.guardar_array(huella, clave_dist, distancias)
+    cache_disco.guardar_array(huella, clave_ind, indices)
+    return indices, distancias
+
+
+def consultar(indice, posicion, k):
+    """Los k primeros vecinos (posiciones, distancias) de la muestra en 'posicion'."""
+    indices, distancias = indice
+    return indices[posicion, :k], distancias[posicion, :k]